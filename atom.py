@@ -5,10 +5,16 @@ __author__ = "Steve Marshall (steve@nascentguruism.com)"
 __copyright__ = "Copyright (c) 2008 Steve Marshall"
 __license__ = "Python"
 
+import hashlib
+import mmap
 import os
+import scratch
 import StringIO
-from struct import calcsize, pack, unpack
-import tempfile
+from itertools import izip
+from multiprocessing.pool import ThreadPool
+from struct import Struct, calcsize, pack, unpack
+import threading
+import weakref
 
 
 ATOM_HEADER = {
@@ -20,12 +26,20 @@ ATOM_HEADER = {
     # Only used if basic size == 1
     'large': '>L4sQ',
 }
+BASIC_HEADER = Struct(ATOM_HEADER['basic'])
+LARGE_HEADER = Struct(ATOM_HEADER['large'])
+# Size of the blocks in which atom content is compared and digested
+CONTENT_BLOCK_SIZE = 1024 * 1024
+# Size of the blocks in which atom headers are read while loading
+HEADER_BLOCK_SIZE = 64 * 1024
+# Reads made (and bytes read) through every SourceReader
+IO_COUNTERS = {'reads': 0, 'bytes': 0}
 # Define known atom types
 ATOM_CONTAINER_TYPES = [
     'aaid', 'akid', '\xa9alb', 'apid', 'aART', '\xa9ART', 'atid', 'clip',
     '\xa9cmt', '\xa9com', 'covr', 'cpil', 'cprt', '\xa9day', 'dinf', 'disk',
     'edts', 'geid', 'gnre', '\xa9grp', 'hinf', 'hnti', 'ilst', 'matt',
-    'mdia', 'minf', 'moof', 'moov', '\xa9nam', 'pinf', 'plid', 'rtng',
+    'mdia', 'minf', 'moof', 'moov', 'mvex', '\xa9nam', 'pinf', 'plid', 'rtng',
     'schi', 'sinf', 'stbl', 'stik', 'tmpo', '\xa9too', 'traf', 'trak', 'trkn',
     'udta', '\xa9wrt',
 ]
@@ -40,15 +54,23 @@ ATOM_SPECIAL_CONTAINER_TYPES = {
     'drms': {
         'padding': 28
     },
+    # Protected sample entries, which hold their original type in a sinf
+    'enca': {
+        'padding': 28
+    },
+    'encv': {
+        'padding': 78
+    },
     'meta': {
         'padding': 4
     },
 }
 ATOM_NONCONTAINER_TYPES = [
-    'chtb', 'ctts', 'data', 'esds', 'free', 'frma', 'ftyp', '\xa9gen', 'hmhd',
-    'iviv', 'key ', 'mdat', 'mdhd', 'mp4s', 'mpv4', 'mvhd', 'name',
-    'priv', 'rtp', 'sign', 'stco', 'stsc', 'stp', 'stts', 'tfhd',
-    'tkhd', 'tref', 'trun', 'user', 'vmhd', 'wide',
+    'chtb', 'ctts', 'data', 'elst', 'esds', 'free', 'frma', 'ftyp', '\xa9gen', 'hmhd',
+    'iviv', 'key ', 'mdat', 'mdhd', 'mehd', 'mfhd', 'mp4s', 'mpv4', 'mvhd',
+    'name', 'priv', 'pssh', 'rtp', 'saio', 'saiz', 'senc', 'sign', 'stco',
+    'stsc', 'stp', 'stts', 'tenc', 'tfdt', 'tfhd', 'tkhd', 'tref', 'trex',
+    'trun', 'user', 'vmhd', 'wide',
 ]
 
 def get_header_size(content_size):
@@ -56,6 +78,17 @@ def get_header_size(content_size):
         return calcsize(ATOM_HEADER['large'])
     return calcsize(ATOM_HEADER['basic'])
 
+def readinto(stream, buffer):
+    """Read from <stream> into <buffer>, even if <stream> has no readinto
+       method of its own; return the number of bytes read.
+    """
+    if hasattr(stream, 'readinto'):
+        return stream.readinto(buffer)
+    
+    data = stream.read(len(buffer))
+    memoryview(buffer)[:len(data)] = data
+    return len(data)
+
 def render_atom_header(atom_type, content_size):
     """Build an MP4 atom header for a given <type> and
        <content_size> (bytes).
@@ -75,6 +108,22 @@ def render_atom_header(atom_type, content_size):
     
     return rendered_header
 
+def render_free(size):
+    """Render a free atom <size> bytes long, including its header"""
+    header_size = calcsize(ATOM_HEADER['basic'])
+    return render_atom_header('free', size - header_size) \
+        + '\0' * (size - header_size)
+
+def skip_written(stream, size):
+    """Skip past as many of the next <size> bytes to be written to <stream>
+       as it already holds (as a resumed rewrite.JournaledWriter does, say),
+       so they needn't be read again; return the number skipped
+    """
+    skip = getattr(stream, 'skip_written', None)
+    if skip is None:
+        return 0
+    return skip(size)
+
 def parse_atom_header(stream, offset=0):
     """Parse an atom header from a particular <offset> within a
        file-like object
@@ -88,6 +137,8 @@ def parse_atom_header(stream, offset=0):
     # If the atom isn't large, we can discard the false large size later
     stream.seek(offset)
     atom_header = stream.read(header_size)
+    if len(atom_header) < basic_header:
+        raise EOFError, 'Incomplete atom header at offset %d' % offset
     
     # If we have enough data to unpack as a large atom, try that
     if len(atom_header) == large_header:
@@ -107,7 +158,10 @@ def parse_atom_header(stream, offset=0):
         header_size = basic_header
 
     if 0 == atom_size:
+        # A zero size means the atom extends to the end of the stream
         stream.seek(0, os.SEEK_END)
+        atom_size = stream.tell() - (offset + header_size)
+        stream.seek(offset + header_size)
     else:
         # Remove the header from the size we use
         atom_size -= header_size
@@ -120,32 +174,403 @@ def parse_atom_header(stream, offset=0):
     return (atom_type, atom_size)
 
 
+def get_atom_paths(atoms, parent_path=''):
+    """Get (path, atom) for each of <atoms>, whose parent is at
+       <parent_path>. Paths look like 'moov/trak[2]/mdia', with an index
+       (counting from 1) wherever siblings share a type.
+    """
+    type_counts = {}
+    for atom in atoms:
+        type_counts[atom.type] = type_counts.get(atom.type, 0) + 1
+    
+    paths = []
+    type_indices = {}
+    for atom in atoms:
+        path = parent_path + atom.type
+        if 1 < type_counts[atom.type]:
+            type_indices[atom.type] = type_indices.get(atom.type, 0) + 1
+            path += '[%d]' % type_indices[atom.type]
+        paths.append((path, atom))
+    return paths
+
+def walk_atoms(atoms, parent_path=''):
+    """Iterate over (path, atom) for each of <atoms> and their descendants,
+       with paths as given by get_atom_paths
+    """
+    for (path, atom) in get_atom_paths(atoms, parent_path):
+        yield (path, atom)
+        if atom.is_container():
+            for descendant in walk_atoms(atom, path + '/'):
+                yield descendant
+
+
+class SourceReader(object):
+    """Positional reads from a stream shared by every atom loaded from it.
+    
+    Reads neither use nor move the stream's position, so atoms can keep
+    their own positions and be read from many threads at once. Files are
+    read with os.pread where the platform has it, or through a read-only
+    memory map otherwise (unless <use_map> is False), neither of which
+    needs a lock; other streams (StringIO, say) and reads into buffers are
+    made by seeking under a lock, so files are read into buffers without a
+    copy.
+    
+    The stream is only weakly referenced, so that the reader (and its
+    map) is freed along with the last atom holding the stream.
+    """
+    def __init__(self, stream, use_map=True):
+        try:
+            self.__stream = weakref.ref(stream)
+        except TypeError:
+            # Streams that can't be weakly referenced (cStringIO, say)
+            self.__stream = lambda: stream
+        self.__lock = threading.Lock()
+        self.__map = None
+        try:
+            self.__fileno = stream.fileno()
+        except (AttributeError, IOError, ValueError):
+            self.__fileno = None
+        self.use_map = use_map
+    
+    @property
+    def stream(self):
+        return self.__stream()
+    
+    def __get_map(self, end):
+        """Get a map of the file covering <end>, if it can be mapped"""
+        mapped = self.__map
+        if mapped is None or len(mapped) < end:
+            with self.__lock:
+                if self.__fileno is None:
+                    return None
+                try:
+                    # Remap to take in anything appended since
+                    self.__map = mmap.mmap(self.__fileno, 0,
+                                           access=mmap.ACCESS_READ)
+                except (EnvironmentError, ValueError, OverflowError):
+                    # Empty, unmappable, or too large for the address space
+                    self.use_map = False
+                    return None
+                mapped = self.__map
+        return mapped
+    
+    def read(self, offset, size):
+        """Read up to <size> bytes from <offset> in the stream"""
+        if size <= 0:
+            return ''
+        data = None
+        if self.__fileno is not None and hasattr(os, 'pread'):
+            data = os.pread(self.__fileno, size, offset)
+        elif self.__fileno is not None and self.use_map:
+            mapped = self.__get_map(offset + size)
+            if mapped is not None:
+                data = mapped[offset:offset + size]
+        
+        if data is None:
+            with self.__lock:
+                stream = self.stream
+                initial_position = stream.tell()
+                stream.seek(offset)
+                data = stream.read(size)
+                stream.seek(initial_position)
+        IO_COUNTERS['reads'] += 1
+        IO_COUNTERS['bytes'] += len(data)
+        return data
+    
+    def readinto(self, offset, buffer):
+        """Read from <offset> in the stream into <buffer>; return the
+           number of bytes read.
+        """
+        with self.__lock:
+            stream = self.stream
+            initial_position = stream.tell()
+            stream.seek(offset)
+            count = readinto(stream, buffer)
+            stream.seek(initial_position)
+        IO_COUNTERS['reads'] += 1
+        IO_COUNTERS['bytes'] += count
+        return count
+    
+    def get_size(self):
+        """Get the current size of the stream"""
+        if self.__fileno is not None:
+            return os.fstat(self.__fileno).st_size
+        with self.__lock:
+            stream = self.stream
+            initial_position = stream.tell()
+            stream.seek(0, os.SEEK_END)
+            size = stream.tell()
+            stream.seek(initial_position)
+        return size
+    
+    def close(self):
+        """Drop the map of the file, if any; later reads use the stream"""
+        with self.__lock:
+            self.use_map = False
+            if self.__map is not None:
+                self.__map.close()
+                self.__map = None
+
+# One reader per source stream, so atoms sharing a stream share its map
+SOURCE_READERS = weakref.WeakKeyDictionary()
+
+def get_source_reader(stream, use_map=True):
+    """Get the SourceReader shared by every atom loaded from <stream>,
+       making one (which maps files only if <use_map> is set) if there is
+       none yet
+    """
+    try:
+        reader = SOURCE_READERS.get(stream)
+        if reader is None:
+            reader = SOURCE_READERS.setdefault(stream,
+                                               SourceReader(stream, use_map))
+        return reader
+    except TypeError:
+        # Streams that can't be weakly referenced (cStringIO, say)
+        return SourceReader(stream, use_map)
+
+def close_source(stream):
+    """Close <stream> and drop the map of its SourceReader, if it has one"""
+    try:
+        reader = SOURCE_READERS.get(stream)
+    except TypeError:
+        reader = None
+    if reader is not None:
+        reader.close()
+    stream.close()
+
+def get_atom_at_path(atoms, path):
+    """Find the atom at <path> (as generated by walk_atoms, eg.
+       'moov/udta/meta/ilst' or 'moov/trak[2]/mdia') among <atoms> and
+       their descendants; return None if there is none.
+    """
+    atom = None
+    for step in path.split('/'):
+        (type, index) = (step, 1)
+        if step.endswith(']') and '[' in step:
+            (type, index) = step[:-1].split('[')
+            index = int(index)
+        matches = [child for child in atoms if child.type == type]
+        if len(matches) < index:
+            return None
+        atom = matches[index - 1]
+        atoms = atom.is_container() and atom or []
+    return atom
+
+
+class HeaderScanner(object):
+    """Parse the atom headers of a stream a block at a time.
+    
+    Every header within a block of <block_size> bytes is parsed from that
+    block, so loading a tree of small atoms needs a read per block rather
+    than a seek and read per atom. A new block is read only when a header
+    crosses the end of the current one, or lies beyond it (after skipping
+    a large atom's content, say). Reads are positional, so the stream's
+    position is never moved.
+    """
+    def __init__(self, stream, block_size=HEADER_BLOCK_SIZE):
+        self.stream = stream
+        self.block_size = block_size
+        self.__reader = get_source_reader(stream)
+        self.__block = ''
+        self.__block_offset = 0
+        self.__block_is_last = False
+    
+    def read(self, offset, size):
+        """Read up to <size> bytes from <offset>, from the current block if
+           it holds them all
+        """
+        start = offset - self.__block_offset
+        if 0 <= start and (start + size <= len(self.__block) \
+         or (self.__block_is_last and start <= len(self.__block))):
+            # Either the block holds it all, or the stream ends in the block
+            return self.__block[start:start + size]
+        if self.block_size < size:
+            return self.__reader.read(offset, size)
+        
+        self.__block = self.__reader.read(offset, self.block_size)
+        self.__block_offset = offset
+        self.__block_is_last = len(self.__block) < self.block_size
+        return self.__block[:size]
+    
+    def get_stream_size(self):
+        return self.__reader.get_size()
+    
+    def parse(self, offset):
+        """Parse the atom header at <offset>; return the atom's type, the
+           size of its content and the size of its header
+        """
+        header = self.read(offset, LARGE_HEADER.size)
+        if len(header) < BASIC_HEADER.size:
+            raise EOFError, 'Incomplete atom header at offset %d' % offset
+        
+        (atom_size, atom_type) = BASIC_HEADER.unpack_from(header)
+        header_size = BASIC_HEADER.size
+        if 1 == atom_size:
+            if len(header) < LARGE_HEADER.size:
+                raise EOFError, 'Incomplete atom header at offset %d' % offset
+            atom_size = LARGE_HEADER.unpack(header)[2]
+            header_size = LARGE_HEADER.size
+        
+        if 0 == atom_size:
+            # A zero size means the atom extends to the end of the stream
+            return (atom_type, self.get_stream_size() - (offset + header_size),
+                    header_size)
+        return (atom_type, atom_size - header_size, header_size)
+
+def walk_atom_headers(stream, max_depth=None, scanner=None, offset=0,
+                      end=None, parent_path=''):
+    """Iterate over (path, type, offset, header size, content size) of the
+       atoms in <stream> from <offset>, and of their descendants down to
+       <max_depth> levels below them (or all of them), reading only their
+       headers. Paths are as generated by walk_atoms.
+    """
+    if scanner is None:
+        scanner = HeaderScanner(stream)
+    if end is None:
+        end = scanner.get_stream_size()
+    
+    siblings = []
+    while calcsize(ATOM_HEADER['basic']) <= end - offset:
+        try:
+            (type, size, header_size) = scanner.parse(offset)
+        except EOFError:
+            break
+        siblings.append((type, offset, header_size, size))
+        offset += header_size + max(0, size)
+    
+    type_counts = {}
+    for sibling in siblings:
+        type_counts[sibling[0]] = type_counts.get(sibling[0], 0) + 1
+    type_indices = {}
+    for (type, offset, header_size, size) in siblings:
+        path = parent_path + type
+        if 1 < type_counts[type]:
+            type_indices[type] = type_indices.get(type, 0) + 1
+            path += '[%d]' % type_indices[type]
+        
+        yield (path, type, offset, header_size, size)
+        is_container = type in ATOM_CONTAINER_TYPES \
+            or type in ATOM_SPECIAL_CONTAINER_TYPES
+        if is_container and (max_depth is None or 0 < max_depth):
+            children_offset = offset + header_size
+            if type in ATOM_SPECIAL_CONTAINER_TYPES:
+                children_offset += ATOM_SPECIAL_CONTAINER_TYPES[type]['padding']
+            child_depth = max_depth
+            if max_depth is not None:
+                child_depth -= 1
+            children = walk_atom_headers(stream, child_depth, scanner,
+                children_offset, min(end, offset + header_size + size),
+                path + '/')
+            for child in children:
+                yield child
+
+
 class Atom(list):
-    def __init__(self, stream=None, offset=0, type=None):
+    def __init__(self, stream=None, offset=0, type=None, load_children=True,
+                 scanner=None):
+        """Load the atom at <offset> in <stream>, or create an empty atom of
+           <type>. Headers are read through <scanner> (a HeaderScanner of
+           <stream>), if given, which leaves the stream where it was;
+           otherwise the stream is left at the end of the atom.
+        """
+        self.__digests = {}
+        self.__revision = 0
         if stream is not None:
-            (self.type, self.__size) = parse_atom_header(stream, offset)
-            self.__offset = stream.tell()
+            skip_to_end = scanner is None
+            if scanner is None:
+                scanner = HeaderScanner(stream)
+            (self.type, self.__size, header_size) = scanner.parse(offset)
+            self.__header_offset = offset
+            self.__offset = offset + header_size
             self.__source_stream = stream
+            self.__source_reader = get_source_reader(stream)
+            self.__position = 0
             
-            # Recursively build the tree; don't try to skip containers, 
-            # as their leaf data atoms will do all the skipping for us
+            # Recursively build the tree
             if self.is_special_container():
+                # Keep the padding, as it holds the container's own fields
                 padding = ATOM_SPECIAL_CONTAINER_TYPES[self.type]['padding']
-                self.__source_stream.seek(padding, os.SEEK_CUR)
-                self.__load_children()
-            elif self.is_container():
-                self.__load_children()
+                self.__padding = scanner.read(self.__offset, padding)
+                if load_children:
+                    self.__load_children(scanner)
+            elif self.is_container() and load_children:
+                self.__load_children(scanner)
             
             # Skip over the rest of the atom
-            self.__source_stream.seek(self.__offset + self.__size)
+            if skip_to_end:
+                self.__source_stream.seek(self.__offset + self.__size)
         elif type is not None:
             self.type = type
+            if self.is_special_container():
+                padding = ATOM_SPECIAL_CONTAINER_TYPES[self.type]['padding']
+                self.__padding = pack('%dx' % padding)
+    
+    def __get_children_offset(self):
+        return self.__offset + len(self.get_padding())
     
-    def __load_children(self):
+    def __load_children(self, scanner):
+        position = self.__get_children_offset()
+        end = self.__offset + self.__size
         # If we don't have enough data left for another atom, abort
-        while calcsize(ATOM_HEADER['basic']) <= (self.__size - self.tell()):
-            child = Atom(stream=self.__source_stream, offset=self.__source_stream.tell())
+        while calcsize(ATOM_HEADER['basic']) <= end - position:
+            try:
+                child = Atom(stream=self.__source_stream, offset=position,
+                             scanner=scanner)
+            except EOFError:
+                # The stream ends before this container says it does
+                break
             self.append(child)
+            position = child.__offset + max(0, child.__size)
+    
+    def __get_child_offsets(self):
+        """Find the offset of each child's header without loading them"""
+        scanner = HeaderScanner(self.__source_stream)
+        offsets = []
+        position = self.__get_children_offset()
+        end = self.__offset + self.__size
+        while calcsize(ATOM_HEADER['basic']) <= end - position:
+            try:
+                (type, size, header_size) = scanner.parse(position)
+            except EOFError:
+                break
+            offsets.append(position)
+            position += header_size + max(0, size)
+        return offsets
+    
+    def load_children_concurrently(self, threads, prepare=None):
+        """Load the subtree of each of this container's children on one of
+           <threads> threads, for a container loaded with
+           load_children=False.
+           
+           Every thread reads from this container's own stream, as reads
+           are positional, but through a HeaderScanner of its own. If given,
+           <prepare>(child) is called on the same thread once each child is
+           loaded (to decode its content, say); return a list of its
+           results.
+        """
+        offsets = self.__get_child_offsets()
+        thread_scanners = threading.local()
+        
+        def load_child(offset):
+            if not hasattr(thread_scanners, 'scanner'):
+                thread_scanners.scanner = HeaderScanner(self.__source_stream)
+            child = Atom(stream=self.__source_stream, offset=offset,
+                         scanner=thread_scanners.scanner)
+            if prepare is None:
+                return (child, None)
+            return (child, prepare(child))
+        
+        pool = ThreadPool(threads)
+        try:
+            loaded = pool.map(load_child, offsets)
+        finally:
+            pool.close()
+            pool.join()
+        
+        self[0:] = [child for (child, prepared) in loaded]
+        self.__source_stream.seek(self.__offset + self.__size)
+        return [prepared for (child, prepared) in loaded]
     
     def __del__(self):
         if hasattr(self, '_Atom__data'):
@@ -166,25 +591,97 @@ class Atom(list):
         return repr
     
     def __eq__(self, other):
-        equal = False
-        
         # If types match on a container, delegate checking to the base
-        # If types match for a data atom, delegate to __data if it exists
-        # TODO: Equality for loaded data atoms
-        if other.type != self.type:
-            equal = False
-        if (other.type == self.type) and self.is_container():
-            equal = super(Atom, self).__eq__(other)
-        elif (other.type == self.type) \
-         and hasattr(self, '_Atom__data') \
-         and hasattr(other, '_Atom__data'):
-            equal = (self.__data == other.__data)
-        elif (other.type == self.type) \
-         and not hasattr(self, '_Atom__data') \
-         and not hasattr(other, '_Atom__data'):
-            equal = True
+        # If types match for a data atom, compare sizes and then content
+        if not isinstance(other, Atom) or other.type != self.type:
+            return False
+        if self.is_container():
+            return self.get_padding() == other.get_padding() \
+                and super(Atom, self).__eq__(other)
+        if self.get_content_size() != other.get_content_size():
+            return False
+        
+        # Differing digests prove inequality without reading any content
+        for (algorithm, digest) in self.__digests.items():
+            if other.__digests.get(algorithm, digest) != digest:
+                return False
+        
+        for (chunk, other_chunk) in \
+         izip(self.iter_chunks(), other.iter_chunks()):
+            if chunk != other_chunk:
+                return False
+        return True
+    
+    def __ne__(self, other):
+        return not self.__eq__(other)
+    
+    def get_padding(self):
+        """Get the fields a special container holds ahead of its children"""
+        if hasattr(self, '_Atom__padding'):
+            return self.__padding
+        return ''
+    
+    def __readinto_at(self, position, buffer):
+        """Read content from <position> into <buffer> without moving the
+           atom's position; return the number of bytes read.
+        """
+        if hasattr(self, '_Atom__data'):
+            initial_position = self.__data.tell()
+            self.__data.seek(position)
+            count = readinto(self.__data, buffer)
+            self.__data.seek(initial_position)
+            return count
+        elif hasattr(self, '_Atom__source_stream'):
+            return self.__source_reader.readinto(self.__offset + position,
+                                                 buffer)
+        return 0
+    
+    def iter_chunks(self, size=CONTENT_BLOCK_SIZE, buffer=None, offset=0):
+        """Iterate over the content from <offset> (by default, all of it) in
+           chunks of up to <size> bytes, without moving the atom's position.
+           
+           Each chunk is a memoryview onto a single buffer (<buffer>, if
+           given) that is reused for every chunk, so a chunk is only valid
+           until the next one is read.
+        """
+        if buffer is None:
+            buffer = bytearray(size)
+        view = memoryview(buffer)
+        
+        content_size = self.get_content_size()
+        position = offset
+        while position < content_size:
+            count = self.__readinto_at(position, \
+                view[:min(len(view), content_size - position)])
+            if 0 == count:
+                break
+            position += count
+            yield view[:count]
+    
+    def digest(self, algorithm='sha1'):
+        """Return the <algorithm> (any hashlib algorithm) digest of this
+           atom's content. Content is hashed in blocks, and the digest is
+           kept until the atom is next modified.
+        """
+        if self.is_container():
+            raise ValueError, 'Cannot digest container atoms'
         
-        return equal
+        if algorithm not in self.__digests:
+            content_hash = hashlib.new(algorithm)
+            for chunk in self.iter_chunks():
+                content_hash.update(chunk)
+            self.__digests[algorithm] = content_hash.digest()
+        return self.__digests[algorithm]
+    
+    def __modified(self):
+        self.__digests.clear()
+        self.__revision += 1
+    
+    def get_revision(self):
+        """Return a number that changes whenever this atom's content is
+           written, so values derived from its content can be cached.
+        """
+        return self.__revision
     
     # Container/Sequence behaviours
     
@@ -254,6 +751,58 @@ class Atom(list):
         return descendants
     
     
+    # Source location
+    
+    def get_source_offset(self):
+        """Return the offset of this atom's header within the stream it was
+           loaded from, or None if it wasn't loaded from a stream.
+        """
+        if hasattr(self, '_Atom__source_stream'):
+            return self.__header_offset
+        return None
+    
+    def get_content_offset(self):
+        """Return the offset of this atom's content within the stream it
+           was loaded from, or None if it wasn't loaded from a stream.
+        """
+        if hasattr(self, '_Atom__source_stream'):
+            return self.__offset
+        return None
+    
+    def get_source_size(self):
+        """Return the content size declared by this atom's header in the
+           stream it was loaded from, or None if it wasn't loaded from a
+           stream.
+        """
+        if hasattr(self, '_Atom__source_stream'):
+            return self.__size
+        return None
+    
+    def get_content_size(self):
+        """Return the size (bytes) of this atom's content, excluding its
+           header.
+        """
+        if self.is_container():
+            size = sum([child.get_size() for child in self])
+            if hasattr(self, '_Atom__padding'):
+                size += len(self.__padding)
+            return size
+        elif hasattr(self, '_Atom__data'):
+            initial_position = self.__data.tell()
+            self.__data.seek(0, os.SEEK_END)
+            size = self.__data.tell()
+            self.__data.seek(initial_position)
+            return size
+        elif hasattr(self, '_Atom__source_stream'):
+            return self.__size
+        return 0
+    
+    def get_size(self):
+        """Return the size (bytes) of this atom, including its header"""
+        content_size = self.get_content_size()
+        return get_header_size(content_size) + content_size
+    
+    
     # File-like behaviours
     
     def next(self):
@@ -265,21 +814,38 @@ class Atom(list):
         if hasattr(self, '_Atom__data'):
             return self.__data.tell()
         elif hasattr(self, '_Atom__source_stream'):
-            return self.__source_stream.tell() - self.__offset
+            return self.__position
         return 0
     
     def read(self, size=-1):
         if hasattr(self, '_Atom__data'):
             return self.__data.read(size)
         elif hasattr(self, '_Atom__source_stream'):
-            if 0 == self.tell():
-                self.seek(0)
-            elif self.tell() == self.__size:
-                self.seek(0, os.SEEK_END)
-            
-            return self.__source_stream.read(self.__size - self.tell())
+            remaining = max(0, self.__size - self.__position)
+            if size < 0 or remaining < size:
+                size = remaining
+            data = self.__source_reader.read(self.__offset + self.__position,
+                                             size)
+            self.__position += len(data)
+            return data
         return ''
     
+    def readinto(self, buffer):
+        """Read content from the current position into <buffer>; return the
+           number of bytes read.
+        """
+        if hasattr(self, '_Atom__data'):
+            return readinto(self.__data, buffer)
+        elif hasattr(self, '_Atom__source_stream'):
+            count = min(len(buffer), self.__size - self.__position)
+            if count <= 0:
+                return 0
+            count = self.__source_reader.readinto( \
+                self.__offset + self.__position, memoryview(buffer)[:count])
+            self.__position += count
+            return count
+        return 0
+    
     def readline(self, size=-1):
         if hasattr(self, '_Atom__data'):
             return self.__data.readline(size)
@@ -295,20 +861,19 @@ class Atom(list):
             self.__data.seek(offset, whence)
         elif hasattr(self, '_Atom__source_stream') \
         and os.SEEK_SET == whence:
-            self.__source_stream.seek(self.__offset + offset, whence)
+            self.__position = offset
         elif hasattr(self, '_Atom__source_stream') \
         and os.SEEK_END == whence:
-            source_offset = self.__offset + self.__size + offset
-            self.__source_stream.seek(source_offset)
+            self.__position = self.__size + offset
         elif hasattr(self, '_Atom__source_stream') \
         and os.SEEK_CUR == whence:
-            source_offset = self.__offset + self.tell() + offset
-            self.__source_stream.seek(source_offset)
+            self.__position += offset
     
     def truncate(self, size=None):
         if size is None:
             size = self.tell()
         if hasattr(self, '_Atom__data'):
+            self.__modified()
             self.__data.truncate(size)
     
     def write(self, str):
@@ -319,16 +884,17 @@ class Atom(list):
             # Store starting location in case we already have content
             initial_location = self.tell()
             
-            # Store in a file in case of large data
-            self.__data = tempfile.TemporaryFile()
+            # Store in scratch storage, which spills to disk for large data
+            data = scratch.DEFAULT_ARENA.allocate()
             
-            # Copy old data to tempfile
+            # Copy old data to scratch storage
             if hasattr(self, '_Atom__source_stream'):
-                self.__source_stream.seek(get_header_size(self.__size))
-                self.__data.write(self.__source_stream.read(self.__size))
-                self.__data.seek(0)
-                self.seek(initial_location)
+                for chunk in self.iter_chunks():
+                    data.write(chunk.tobytes())
+            self.__data = data
+            self.seek(initial_location)
         
+        self.__modified()
         self.__data.write(str)
     
     def writelines(self, sequence):
@@ -336,9 +902,10 @@ class Atom(list):
             raise ValueError, 'Cannot write data to container atoms'
         
         if not hasattr(self, '_Atom__data'):
-            # Store in a file in case of large data
-            self.__data = tempfile.TemporaryFile()
+            # Store in scratch storage, which spills to disk for large data
+            self.__data = scratch.DEFAULT_ARENA.allocate()
         
+        self.__modified()
         self.__data.writelines(sequence)
     
     # Sequence and file-like behaviours
@@ -347,41 +914,42 @@ class Atom(list):
         if not self.is_container() and hasattr(self, '_Atom__data'):
             return iter(self.__data)
         elif not self.is_container() and hasattr(self, '_Atom__source_stream'):
-            # HACK: Slurp data into a temporary stream
-            iterable_stream = StringIO.StringIO()
-            prior_pos = self.__source_stream.tell()
-            self.seek(0)
-            iterable_stream.write(self.read())
-            iterable_stream.seek(0)
-            self.__source_stream.seek(prior_pos)
-            return iter(iterable_stream)
+            return self.__iter_lines()
         
         return super(Atom, self).__iter__()
     
+    def __iter_lines(self):
+        # Split lines out of chunks, rather than copying the whole content
+        partial_line = ''
+        for chunk in self.iter_chunks():
+            lines = (partial_line + chunk.tobytes()).split('\n')
+            partial_line = lines.pop()
+            for line in lines:
+                yield line + '\n'
+        if partial_line:
+            yield partial_line
+    
     # Storage
     
     def save(self, stream):
+        if not self.is_container():
+            # Stream content across, so large atoms aren't held in memory
+            content_size = self.get_content_size()
+            stream.write(render_atom_header(self.type, content_size))
+            offset = skip_written(stream, content_size)
+            for chunk in self.iter_chunks(offset=offset):
+                stream.write(chunk.tobytes())
+            return
+        
         # HACK: Dumping into content allows us to use len() to get content
         #       size easily, but will fall over for large content
-        content = ''
+        content_stream = StringIO.StringIO()
+        if hasattr(self, '_Atom__padding'):
+            content_stream.write(self.__padding)
+        [atom.save(content_stream) for atom in self]
         
-        # Get content for this atom
-        if self.is_container():
-            content_stream = StringIO.StringIO()
-            [atom.save(content_stream) for atom in self]
-            
-            content_stream.seek(0)
-            content = content_stream.read()
-        elif hasattr(self, '_Atom__data') \
-        or hasattr(self, '_Atom__source_stream'):
-            # Store the initial position so we can seek back to there for
-            # other users of our data
-            initial_position = self.tell()
-            
-            self.seek(0)
-            content = self.read()
-            
-            self.seek(initial_position)
+        content_stream.seek(0)
+        content = content_stream.read()
         
         stream.write(render_atom_header(self.type, len(content)))
         if 0 < len(content):
@@ -9,14 +9,15 @@ __copyright__ = "Copyright (c) 2008 Steve Marshall"
 __license__ = "Python"
 
 import atom
+import hashlib
 import os
 import signal
 import StringIO
 import struct
+import tempfile
+import threading
 import unittest
 
-# TODO: Data atom equality based on content? Currently based on tempfile ref.
-
 class SimpleContainerAtom(unittest.TestCase):
     type='moov'
     
@@ -538,6 +539,16 @@ class LoadSpecialContainerAtom(unittest.TestCase):
         self.assertEqual(1, len(self.atom))
         self.assertEqual(self.child_type, self.atom[0].type)
         self.assertEqual(0, len(self.atom[0]))
+    
+    def testSavePreservesPadding(self):
+        save_stream = StringIO.StringIO()
+        self.atom.save(save_stream)
+        save_stream.seek(0)
+        
+        self.assertEqual(self.rendered_atom, save_stream.read())
+    
+    def testContentSizeIncludesPadding(self):
+        self.assertEqual(len(self.rendered_atom), self.atom.get_size())
 
 class SimpleDataAtom(unittest.TestCase):
     type = 'free'
@@ -681,6 +692,56 @@ class DataAtomManipulation(unittest.TestCase):
         
         self.assertNotEqual(other, self.atom)
     
+    def testDataWithSameContentIsEqual(self):
+        self.atom.write(self.content)
+        other = atom.Atom(type=self.type)
+        other.write(self.content)
+        
+        self.assertEqual(other, self.atom)
+    
+    def testDataWithSameSizeIsNotEqual(self):
+        self.atom.write(self.content)
+        other = atom.Atom(type=self.type)
+        other.write(self.content[::-1])
+        
+        self.assertNotEqual(other, self.atom)
+    
+    def testEqualityKeepsPosition(self):
+        self.atom.write(self.content)
+        self.atom.seek(2)
+        other = atom.Atom(type=self.type)
+        other.write(self.content)
+        
+        self.assertEqual(other, self.atom)
+        self.assertEqual(2, self.atom.tell())
+    
+    def testDigestIsOfContent(self):
+        self.atom.write(self.content)
+        
+        self.assertEqual(hashlib.sha1(self.content).digest(),
+                         self.atom.digest())
+        self.assertEqual(hashlib.md5(self.content).digest(),
+                         self.atom.digest('md5'))
+    
+    def testDigestChangesAfterWrite(self):
+        self.atom.write(self.content)
+        self.atom.digest()
+        self.atom.write(self.content)
+        
+        self.assertEqual(hashlib.sha1(self.content * 2).digest(),
+                         self.atom.digest())
+    
+    def testDigestChangesAfterTruncate(self):
+        self.atom.write(self.content)
+        self.atom.digest()
+        self.atom.truncate(2)
+        
+        self.assertEqual(hashlib.sha1(self.content[:2]).digest(),
+                         self.atom.digest())
+    
+    def testCannotDigestContainer(self):
+        self.assertRaises(ValueError, atom.Atom(type='moov').digest)
+    
 
 class DataAtomExtendedManipulation(unittest.TestCase):
     type = 'free'
@@ -740,6 +801,20 @@ class DataAtomExtendedManipulation(unittest.TestCase):
             [len(line) for line in self.content.splitlines(True)],
             [len(line) for line in self.atom])
     
+    def testCanIterateOverChunks(self):
+        self.atom.write(self.content)
+        chunks = [chunk.tobytes() for chunk in self.atom.iter_chunks(16)]
+        
+        self.assertEqual(self.content, ''.join(chunks))
+    
+    def testCanReadInto(self):
+        self.atom.write(self.content)
+        self.atom.seek(0)
+        buffer = bytearray(4)
+        
+        self.assertEqual(4, self.atom.readinto(buffer))
+        self.assertEqual(self.content[:4], str(buffer))
+    
     def testCanGetNextLine(self):
         self.atom.write(self.content)
         self.atom.seek(0)
@@ -855,6 +930,69 @@ class LoadSimpleDataAtom(unittest.TestCase):
         data_atom.seek(7)
         self.assertEqual(self.content[7:], data_atom.read())
     
+    def testIsEqualToWrittenAtomWithSameContent(self):
+        data_atom = atom.Atom(self.atom_stream_with_content)
+        written_atom = atom.Atom(type=self.type)
+        written_atom.write(self.content)
+        self.assertEqual(written_atom, data_atom)
+    
+    def testIsNotEqualToLoadedAtomWithOtherContent(self):
+        data_atom = atom.Atom(self.atom_stream_with_content)
+        other_atom = atom.Atom(self.atom_stream)
+        self.assertNotEqual(other_atom, data_atom)
+    
+    def testDigestIsOfContent(self):
+        data_atom = atom.Atom(self.atom_stream_with_content)
+        self.assertEqual(hashlib.sha1(self.content).digest(),
+                         data_atom.digest())
+    
+    def testCanIterateOverLines(self):
+        data_atom = atom.Atom(self.atom_stream_with_content)
+        self.assertEqual(self.content.splitlines(True), list(data_atom))
+    
+    def testCanIterateOverChunks(self):
+        data_atom = atom.Atom(self.atom_stream_with_content)
+        chunks = [chunk.tobytes() for chunk in data_atom.iter_chunks(4)]
+        
+        self.assertEqual(self.content, ''.join(chunks))
+        self.assertEqual(4, len(chunks[0]))
+    
+    def testIteratingOverChunksReusesBuffer(self):
+        data_atom = atom.Atom(self.atom_stream_with_content)
+        buffer = bytearray(4)
+        for chunk in data_atom.iter_chunks(buffer=buffer):
+            self.assertEqual(chunk.tobytes(), str(buffer[:len(chunk)]))
+    
+    def testIteratingOverChunksKeepsPosition(self):
+        data_atom = atom.Atom(self.atom_stream_with_content)
+        data_atom.seek(3)
+        list(data_atom.iter_chunks(4))
+        self.assertEqual(3, data_atom.tell())
+    
+    def testCanReadInto(self):
+        data_atom = atom.Atom(self.atom_stream_with_content)
+        data_atom.seek(2)
+        buffer = bytearray(3)
+        
+        self.assertEqual(3, data_atom.readinto(buffer))
+        self.assertEqual(self.content[2:5], str(buffer))
+        self.assertEqual(5, data_atom.tell())
+    
+    def testReadIntoStopsAtEndOfContent(self):
+        data_atom = atom.Atom(self.atom_stream_with_content)
+        self.atom_stream_with_content.write('trailing data')
+        data_atom.seek(0)
+        buffer = bytearray(len(self.content) + 4)
+        
+        self.assertEqual(len(self.content), data_atom.readinto(buffer))
+        self.assertEqual(0, data_atom.readinto(buffer))
+    
+    def testCanReadSegment(self):
+        data_atom = atom.Atom(self.atom_stream_with_content)
+        data_atom.seek(2)
+        self.assertEqual(self.content[2:5], data_atom.read(3))
+        self.assertEqual(self.content[5:], data_atom.read())
+    
 
 class ManipulateLoadedDataAtom(unittest.TestCase):
     type = 'free'
@@ -906,6 +1044,128 @@ class ManipulateLoadedDataAtom(unittest.TestCase):
         self.assertEqual(rendered_atom, save_stream.read())
     
 
+class SharedSourceReads(unittest.TestCase):
+    contents = ['first atom content', 'second atom, with other content']
+    
+    def load_atoms(self, stream):
+        for content in self.contents:
+            stream.write(atom.render_atom_header('free', len(content)))
+            stream.write(content)
+        stream.seek(0)
+        first = atom.Atom(stream)
+        second = atom.Atom(stream, offset=stream.tell())
+        return (first, second)
+    
+    def testAtomsHaveOwnPositions(self):
+        (first, second) = self.load_atoms(StringIO.StringIO())
+        first.seek(6)
+        self.assertEqual('second', second.read(6))
+        self.assertEqual('atom', first.read(4))
+        self.assertEqual(10, first.tell())
+        self.assertEqual(6, second.tell())
+    
+    def testReadsDoNotMoveSourceStream(self):
+        stream = StringIO.StringIO()
+        (first, second) = self.load_atoms(stream)
+        end = stream.tell()
+        first.read()
+        second.seek(3)
+        self.assertEqual(end, stream.tell())
+    
+    def testAtomsShareSourceReader(self):
+        stream = StringIO.StringIO()
+        self.load_atoms(stream)
+        self.assertTrue(atom.get_source_reader(stream) \
+            is atom.get_source_reader(stream))
+    
+    def testConcurrentReadsFromFile(self):
+        stream = tempfile.TemporaryFile()
+        (first, second) = self.load_atoms(stream)
+        # Load each atom again for each thread, to give each its own cursor
+        atoms = []
+        for copy in range(4):
+            atoms.append(atom.Atom(stream, offset=0))
+            atoms.append(atom.Atom(stream, offset=first.get_size()))
+        errors = []
+        
+        def read_repeatedly(data_atom, content):
+            for offset in range(len(content)) * 20:
+                data_atom.seek(offset)
+                if content[offset:] != data_atom.read():
+                    errors.append(offset)
+        
+        threads = [threading.Thread(target=read_repeatedly, args=pair) \
+            for pair in zip(atoms, self.contents * 4)]
+        [thread.start() for thread in threads]
+        [thread.join() for thread in threads]
+        stream.close()
+        self.assertEqual([], errors)
+    
+
+class CountingStream(StringIO.StringIO):
+    reads = 0
+    
+    def read(self, size=-1):
+        self.reads += 1
+        return StringIO.StringIO.read(self, size)
+
+
+class ScanAtomHeaders(unittest.TestCase):
+    def testParsesBasicHeader(self):
+        stream = StringIO.StringIO(atom.render_atom_header('free', 4) + 'abcd')
+        self.assertEqual(('free', 4, 8), atom.HeaderScanner(stream).parse(0))
+    
+    def testParsesLargeHeader(self):
+        stream = StringIO.StringIO(struct.pack(atom.ATOM_HEADER['large'], \
+            1, 'mdat', 20) + 'abcd')
+        self.assertEqual(('mdat', 4, 16), atom.HeaderScanner(stream).parse(0))
+    
+    def testZeroSizeExtendsToEndOfStream(self):
+        stream = StringIO.StringIO(struct.pack('>L4s', 0, 'mdat') + 'abcdef')
+        self.assertEqual(('mdat', 6, 8), atom.HeaderScanner(stream).parse(0))
+    
+    def testIncompleteHeaderIsEOF(self):
+        stream = StringIO.StringIO('\0\0\0')
+        self.assertRaises(EOFError, atom.HeaderScanner(stream).parse, 0)
+    
+    def testDoesNotMoveStream(self):
+        stream = StringIO.StringIO(atom.render_atom_header('free', 0) * 2)
+        stream.seek(3)
+        atom.HeaderScanner(stream).parse(8)
+        self.assertEqual(3, stream.tell())
+    
+    def testReadsManyHeadersPerBlock(self):
+        children = atom.render_atom_header('free', 0) * 1000
+        stream = CountingStream(atom.render_atom_header('moov', \
+            len(children)) + children)
+        container = atom.Atom(stream)
+        self.assertEqual(1000, len(container))
+        self.assertEqual(1, stream.reads)
+    
+    def testRefillsWhenHeaderCrossesBlock(self):
+        stream = StringIO.StringIO(atom.render_atom_header('free', 4) \
+            + 'abcd' + atom.render_atom_header('skip', 0))
+        scanner = atom.HeaderScanner(stream, block_size=16)
+        scanner.parse(0)
+        self.assertEqual(('skip', 0, 8), scanner.parse(12))
+    
+    def testWalksHeadersWithoutLoading(self):
+        trak = atom.render_atom_header('tkhd', 0) * 2
+        moov = atom.render_atom_header('trak', len(trak)) + trak
+        moov = moov * 2
+        stream = StringIO.StringIO(atom.render_atom_header('moov', \
+            len(moov)) + moov + atom.render_atom_header('free', 3) + 'abc')
+        
+        walked = [(path, offset, size) for (path, type, offset, header_size, \
+            size) in atom.walk_atom_headers(stream)]
+        self.assertEqual(('moov', 0, len(moov)), walked[0])
+        self.assertEqual(('moov/trak[2]/tkhd[1]', 40, 0), walked[5])
+        self.assertEqual(('free', 8 + len(moov), 3), walked[-1])
+        self.assertEqual(['moov', 'moov/trak[1]', 'moov/trak[2]', 'free'],
+            [path for (path, type, offset, header_size, size) \
+            in atom.walk_atom_headers(stream, max_depth=1)])
+    
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Bitrate profiles of tracks, computed from their sample tables alone.
+
+A track's samples are bucketed into windows by decode time, using the
+sizes in stsz and the times in stts, so no media is read. Each window's
+bytes are summed from a slice of the sample sizes, found by bisecting
+the decode times, so the work done in Python grows with the number of
+windows rather than the number of samples.
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+
+# Default window length, in seconds
+WINDOW = 1.0
+
+VbvResult = namedtuple('VbvResult',
+                       'underflows first_underflow minimum_fullness')
+
+
+def get_percentile(values, percentile):
+    """Get the <percentile> (from 0 to 100) of <values>, interpolating
+       between the nearest ranks
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * percentile / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+class BitrateProfile(object):
+    """The bitrate of a track over windows of <window> seconds, starting
+       every <step> seconds (by default, every <window> seconds)
+    """
+    def __init__(self, track, window=WINDOW, step=None):
+        if step is None:
+            step = window
+        if window <= 0 or step <= 0:
+            raise ValueError, 'Windows must be longer than 0 seconds'
+        self.window = window
+        self.step = step
+        self.timescale = track.get_timescale()
+
+        table = track.get_sample_table()
+        self.__sizes = table.get_sample_sizes()
+        self.__decode_times = table.get_decode_times()
+        self.__duration = table.get_duration()
+        self.bitrates = self.__get_bitrates()
+
+    def __get_bitrates(self):
+        """Get the bits per second of each window"""
+        sizes = self.__sizes
+        decode_times = self.__decode_times
+        (window, step) = (self.window * self.timescale,
+                          self.step * self.timescale)
+        bitrates = array('d')
+        start = 0
+        while start < self.__duration \
+         or (0 == len(bitrates) and 0 < len(sizes)):
+            first = bisect_left(decode_times, start)
+            last = bisect_left(decode_times, start + window)
+            bitrates.append(sum(sizes[first:last]) * 8.0 / self.window)
+            start += step
+        return bitrates
+
+    def get_total_size(self):
+        return sum(self.__sizes)
+
+    def get_peak(self):
+        """Get the highest bitrate of any window"""
+        if not self.bitrates:
+            return 0.0
+        return max(self.bitrates)
+
+    def get_average(self):
+        """Get the bitrate over the whole track"""
+        if 0 == self.__duration:
+            return 0.0
+        return self.get_total_size() * 8.0 * self.timescale / self.__duration
+
+    def get_percentile(self, percentile):
+        """Get the <percentile> (from 0 to 100) of the windows' bitrates"""
+        return get_percentile(self.bitrates, percentile)
+
+    def simulate_vbv(self, rate, buffer_size, initial_fullness=None):
+        """Simulate a decoder buffer of <buffer_size> bits, filled at <rate>
+           bits per second from <initial_fullness> bits (by default, full),
+           from which each sample is taken whole at its decode time; return
+           a VbvResult of the number of samples that weren't yet wholly in
+           the buffer, the first of them, and the least the buffer held
+           just before a sample was taken
+        """
+        if initial_fullness is None:
+            initial_fullness = buffer_size
+        fill_rate = float(rate) / self.timescale
+        fullness = float(initial_fullness)
+        minimum = fullness
+        (underflows, first_underflow) = (0, None)
+        previous_time = 0
+        for (sample, (time, size)) in \
+         enumerate(zip(self.__decode_times, self.__sizes)):
+            fullness = min(buffer_size,
+                           fullness + (time - previous_time) * fill_rate)
+            previous_time = time
+            minimum = min(minimum, fullness)
+            if fullness < size * 8:
+                underflows += 1
+                if first_underflow is None:
+                    first_underflow = sample
+                # The decoder waits for the rest of the sample
+                fullness = 0.0
+            else:
+                fullness -= size * 8
+        return VbvResult(underflows, first_underflow, minimum)
+
+
+def get_bitrate_profiles(mp4file, window=WINDOW, step=None):
+    """Get a BitrateProfile of each track of <mp4file>, keyed by track id"""
+    return dict([(track.get_track_id(), BitrateProfile(track, window, step)) \
+        for track in mp4file.get_tracks()])
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Unit tests for bitrate.py
+
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import atom
+from bitrate import BitrateProfile, VbvResult, get_percentile
+from mp4file import Mp4File
+from remuxtest import render_movie
+
+class ProfileBitrate(unittest.TestCase):
+    # Two seconds of video, four times larger in the second second
+    tracks = [
+        [('v' * 100, 250, True)] * 4 + [('V' * 400, 250, True)] * 4,
+        [('a' * 10, 500, True)] * 4,
+    ]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'file.mp4')
+        open(self.path, 'wb').write(render_movie(self.tracks))
+        self.mp4file = Mp4File(self.path)
+        self.video = self.mp4file.get_tracks()[0]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testProfilesEachTrack(self):
+        profiles = self.mp4file.get_bitrate_profiles()
+        self.assertEqual([1, 2], sorted(profiles))
+        self.assertEqual([160.0, 160.0], list(profiles[2].bitrates))
+
+    def testSumsWindows(self):
+        profile = BitrateProfile(self.video)
+        self.assertEqual([3200.0, 12800.0], list(profile.bitrates))
+        self.assertEqual(12800.0, profile.get_peak())
+        self.assertEqual(8000.0, profile.get_average())
+        self.assertEqual(8000.0, profile.get_percentile(50))
+
+    def testSlidesWindows(self):
+        profile = BitrateProfile(self.video, window=1, step=0.5)
+        self.assertEqual([3200.0, 8000.0, 12800.0, 6400.0],
+                         list(profile.bitrates))
+
+    def testRejectsEmptyWindows(self):
+        self.assertRaises(ValueError, BitrateProfile, self.video, 0)
+
+    def testReadsNoMedia(self):
+        mp4file = Mp4File(self.path)
+        media_size = mp4file.get_children_of_type('mdat')[0].get_content_size()
+        read = atom.IO_COUNTERS['bytes']
+        mp4file.get_bitrate_profiles(0.25)
+        self.assertTrue(atom.IO_COUNTERS['bytes'] - read < media_size)
+
+    def testSimulatesBufferUnderflow(self):
+        profile = BitrateProfile(self.video)
+        self.assertEqual(VbvResult(3, 5, 2000.0),
+                         profile.simulate_vbv(8000, 4000))
+        self.assertEqual(VbvResult(0, None, 4000.0),
+                         profile.simulate_vbv(16000, 4000))
+
+    def testInterpolatesPercentiles(self):
+        self.assertEqual(2.5, get_percentile([4, 1, 3, 2], 50))
+        self.assertEqual(4, get_percentile([4, 1, 3, 2], 100))
+        self.assertEqual(0.0, get_percentile([], 90))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Decoding of the boxes of Common Encryption (ISO 23001-7).
+
+tenc gives a track's default key and IV size, pssh the data a DRM
+system needs to license a key, saiz and saio the sizes and locations of
+per-sample auxiliary information, and senc that information itself: each
+sample's IV and its subsample map of clear and encrypted byte counts.
+
+Tables are decoded into typed arrays in one pass over their content. A
+sample encryption box's subsample maps are kept flattened, as arrays of
+clear and encrypted byte counts for every subsample of every sample,
+with the index of each sample's first subsample alongside.
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+from array import array
+from collections import namedtuple
+from struct import calcsize, unpack
+
+from sampletable import FULL_BOX_HEADER, TABLE_HEADER, UINT32, UINT64, \
+    get_array_typecode, get_entries, read_content, unpack_array, \
+    unpack_header
+
+UINT8 = get_array_typecode(1)
+UINT16 = get_array_typecode(2)
+
+# saiz and saio flag: the information's type follows the flags
+AUX_INFO_TYPE_PRESENT = 0x1
+# senc flag: each sample's IV is followed by a subsample map
+USE_SUBSAMPLE_ENCRYPTION = 0x2
+TENC_FIELDS = '>xBBB16s'
+PSSH_SYSTEM_ID = '>16s'
+# Sample entries that protected samples are described by
+PROTECTED_ENTRY_TYPES = ('encv', 'enca')
+# Names of some well-known DRM systems, by system ID
+SYSTEM_NAMES = {
+    '1077efecc0b24d02ace33c1e52e2fb4b': 'Common (clear key)',
+    '9a04f07998404286ab92e65be0885f95': 'PlayReady',
+    '94ce86fb07ff4f43adb893d2fa968ca2': 'FairPlay',
+    'edef8ba979d64acea3c827dcd51d21ed': 'Widevine',
+}
+
+TrackEncryption = namedtuple('TrackEncryption', 'is_protected iv_size ' \
+    'key_id crypt_byte_block skip_byte_block constant_iv')
+ProtectionSystem = namedtuple('ProtectionSystem', 'system_id key_ids data')
+SampleInfoSizes = namedtuple('SampleInfoSizes',
+                             'aux_info_type aux_info_parameter sizes')
+SampleInfoOffsets = namedtuple('SampleInfoOffsets',
+                               'aux_info_type aux_info_parameter offsets')
+
+
+def unpack_aux_info_type(content, flags, position):
+    """Unpack the optional (type, parameter) of saiz or saio <content>
+       from <position>; return (type, parameter, position after them)
+    """
+    if not flags & AUX_INFO_TYPE_PRESENT:
+        return (None, None, position)
+    (aux_info_type, parameter) = \
+        unpack('>4sL', get_entries(content, position, 8))
+    return (aux_info_type, parameter, position + 8)
+
+def get_flags(packed_flags):
+    return unpack('>L', '\0' + packed_flags)[0]
+
+def decode_tenc(content):
+    """Decode track encryption content into a TrackEncryption"""
+    (version, flags) = unpack_header(FULL_BOX_HEADER, content)
+    (pattern, is_protected, iv_size, key_id) = unpack(TENC_FIELDS,
+        get_entries(content, 4, calcsize(TENC_FIELDS)))
+    (crypt_byte_block, skip_byte_block) = (0, 0)
+    if 0 < version:
+        (crypt_byte_block, skip_byte_block) = (pattern >> 4, pattern & 0xf)
+
+    constant_iv = None
+    position = 4 + calcsize(TENC_FIELDS)
+    if is_protected and 0 == iv_size:
+        constant_iv_size = ord(get_entries(content, position, 1))
+        constant_iv = get_entries(content, position + 1, constant_iv_size)
+    return TrackEncryption(is_protected, iv_size, key_id, crypt_byte_block,
+                           skip_byte_block, constant_iv)
+
+def decode_pssh(content):
+    """Decode protection system specific header content into a
+       ProtectionSystem, whose system ID is in hex
+    """
+    (version, flags) = unpack_header(FULL_BOX_HEADER, content)
+    (system_id,) = unpack(PSSH_SYSTEM_ID,
+        get_entries(content, 4, calcsize(PSSH_SYSTEM_ID)))
+    position = 4 + calcsize(PSSH_SYSTEM_ID)
+    key_ids = []
+    if 0 < version:
+        (key_count,) = unpack('>L', get_entries(content, position, 4))
+        position += 4
+        key_table = get_entries(content, position, key_count * 16)
+        key_ids = [key_table[start:start + 16] \
+            for start in range(0, len(key_table), 16)]
+        position += key_count * 16
+    (data_size,) = unpack('>L', get_entries(content, position, 4))
+    position += 4
+    return ProtectionSystem(system_id.encode('hex'), key_ids,
+                            get_entries(content, position, data_size))
+
+def decode_saiz(content):
+    """Decode sample auxiliary information size content into
+       SampleInfoSizes, with sizes holding one entry per sample even if
+       they are uniform
+    """
+    (version, flags) = unpack_header(FULL_BOX_HEADER, content)
+    (aux_info_type, parameter, position) = \
+        unpack_aux_info_type(content, get_flags(flags), 4)
+    (default_size, sample_count) = \
+        unpack('>BL', get_entries(content, position, 5))
+    position += 5
+    if 0 != default_size:
+        sizes = array(UINT8, [default_size]) * sample_count
+    else:
+        sizes = array(UINT8, get_entries(content, position, sample_count))
+    return SampleInfoSizes(aux_info_type, parameter, sizes)
+
+def decode_saio(content):
+    """Decode sample auxiliary information offset content into
+       SampleInfoOffsets, with 64-bit offsets
+    """
+    (version, flags) = unpack_header(FULL_BOX_HEADER, content)
+    (aux_info_type, parameter, position) = \
+        unpack_aux_info_type(content, get_flags(flags), 4)
+    (entry_count,) = unpack('>L', get_entries(content, position, 4))
+    position += 4
+    if 0 == version:
+        offsets = array(UINT64, unpack_array(UINT32,
+            get_entries(content, position, entry_count * 4)))
+    else:
+        offsets = unpack_array(UINT64,
+            get_entries(content, position, entry_count * 8))
+    return SampleInfoOffsets(aux_info_type, parameter, offsets)
+
+def decode_senc(content, iv_size):
+    """Decode sample encryption content, in which each sample's IV is
+       <iv_size> bytes (as its track's tenc gives), into a
+       SampleEncryption
+    """
+    (version, flags, sample_count) = unpack_header(TABLE_HEADER, content)
+    position = calcsize(TABLE_HEADER)
+    ivs = []
+    first_subsamples = array(UINT32)
+    clear_bytes = array(UINT16)
+    encrypted_bytes = array(UINT32)
+    has_subsamples = get_flags(flags) & USE_SUBSAMPLE_ENCRYPTION
+    # Check the least the samples can take before decoding any of them
+    smallest_sample = iv_size
+    if has_subsamples:
+        smallest_sample += 2
+    get_entries(content, position, sample_count * smallest_sample)
+
+    for sample in xrange(sample_count):
+        ivs.append(get_entries(content, position, iv_size))
+        position += iv_size
+        first_subsamples.append(len(clear_bytes))
+        if has_subsamples:
+            (subsample_count,) = \
+                unpack('>H', get_entries(content, position, 2))
+            # Each map is unpacked whole, then split into its two columns
+            entries = unpack('>' + 'HL' * subsample_count,
+                get_entries(content, position + 2, 6 * subsample_count))
+            clear_bytes.extend(entries[0::2])
+            encrypted_bytes.extend(entries[1::2])
+            position += 2 + 6 * subsample_count
+    return SampleEncryption(ivs, first_subsamples, clear_bytes,
+                            encrypted_bytes)
+
+
+class SampleEncryption(object):
+    """The IVs and subsample maps of a run of encrypted samples"""
+    def __init__(self, ivs, first_subsamples, clear_bytes, encrypted_bytes):
+        self.ivs = ivs
+        self.first_subsamples = first_subsamples
+        self.clear_bytes = clear_bytes
+        self.encrypted_bytes = encrypted_bytes
+
+    def __len__(self):
+        return len(self.ivs)
+
+    def has_subsamples(self):
+        return 0 < len(self.clear_bytes)
+
+    def get_subsample_range(self, sample):
+        """Get (first, last) such that the subsamples of (0-based)
+           <sample> are at indices <first> up to (but excluding) <last>
+        """
+        first = self.first_subsamples[sample]
+        if sample + 1 < len(self.first_subsamples):
+            return (first, self.first_subsamples[sample + 1])
+        return (first, len(self.clear_bytes))
+
+    def get_subsamples(self, sample):
+        """Get the (clear bytes, encrypted bytes) of each subsample of
+           (0-based) <sample>
+        """
+        (first, last) = self.get_subsample_range(sample)
+        return zip(self.clear_bytes[first:last],
+                   self.encrypted_bytes[first:last])
+
+
+def get_track_encryption(track):
+    """Decode the tenc of a <track>'s first protected sample entry; return
+       a TrackEncryption, or None if its samples aren't protected
+    """
+    description = track.get_sample_table().get_sample_description()
+    if description is None:
+        return None
+    for entry in description:
+        if entry.type in PROTECTED_ENTRY_TYPES:
+            tencs = entry.get_descendants_of_type('tenc')
+            if tencs:
+                return decode_tenc(read_content(tencs[0]))
+    return None
+
+def get_protection_systems(atoms):
+    """Decode every pssh among the root <atoms> (of an Mp4File, say) and
+       their descendants, such as those of the moov and of each moof
+    """
+    systems = []
+    for atom in atoms:
+        if 'pssh' == atom.type:
+            systems.append(decode_pssh(read_content(atom)))
+        elif atom.is_container():
+            systems.extend([decode_pssh(read_content(pssh)) \
+                for pssh in atom.get_descendants_of_type('pssh')])
+    return systems
+
+def get_sample_encryption(container, iv_size):
+    """Decode the senc within <container> (a traf, or a trak's stbl) with
+       IVs of <iv_size> bytes; return a SampleEncryption, or None if it
+       has none
+    """
+    sencs = container.get_children_of_type('senc')
+    if not sencs:
+        return None
+    return decode_senc(read_content(sencs[0]), iv_size)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Unit tests for cenc.py
+
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+from struct import pack
+import StringIO
+import unittest
+
+from atom import Atom
+import cenc
+from remuxtest import render
+from track import Track
+
+KEY_ID = '0123456789abcdef'
+WIDEVINE = 'edef8ba979d64acea3c827dcd51d21ed'
+
+def render_full(type, content, version=0, flags=0):
+    return render(type, pack('>L', version << 24 | flags) + content)
+
+def render_tenc(iv_size=8, version=0, pattern=0, constant_iv=None):
+    content = pack(cenc.TENC_FIELDS, pattern, 1, iv_size, KEY_ID)
+    if constant_iv is not None:
+        content += chr(len(constant_iv)) + constant_iv
+    return render_full('tenc', content, version)
+
+def render_senc(samples, iv_size, subsamples=True):
+    """Render an senc of <samples>, each (iv, [(clear, encrypted)])"""
+    content = pack('>L', len(samples))
+    for (iv, entries) in samples:
+        content += iv
+        if subsamples:
+            content += pack('>H', len(entries)) + ''.join([pack('>HL', *entry) \
+                for entry in entries])
+    flags = subsamples and cenc.USE_SUBSAMPLE_ENCRYPTION or 0
+    return render_full('senc', content, flags=flags)
+
+
+class DecodeBoxes(unittest.TestCase):
+    def testDecodesTrackEncryption(self):
+        self.assertEqual(cenc.TrackEncryption(1, 8, KEY_ID, 0, 0, None),
+                         cenc.decode_tenc(render_tenc()[8:]))
+
+    def testDecodesPatternAndConstantIv(self):
+        tenc = render_tenc(0, version=1, pattern=0x19, constant_iv='c' * 16)
+        self.assertEqual(cenc.TrackEncryption(1, 0, KEY_ID, 1, 9, 'c' * 16),
+                         cenc.decode_tenc(tenc[8:]))
+
+    def testDecodesProtectionSystems(self):
+        system_id = WIDEVINE.decode('hex')
+        pssh = render_full('pssh', system_id + pack('>L', 4) + 'data')
+        self.assertEqual(cenc.ProtectionSystem(WIDEVINE, [], 'data'),
+                         cenc.decode_pssh(pssh[8:]))
+        pssh = render_full('pssh', system_id + pack('>L', 2) + KEY_ID * 2 \
+            + pack('>L', 0), version=1)
+        self.assertEqual(cenc.ProtectionSystem(WIDEVINE, [KEY_ID] * 2, ''),
+                         cenc.decode_pssh(pssh[8:]))
+        self.assertEqual('Widevine', cenc.SYSTEM_NAMES[WIDEVINE])
+
+    def testDecodesSampleInfoSizes(self):
+        saiz = render_full('saiz', pack('>BL', 0, 3) + '\x08\x10\x16')
+        sizes = cenc.decode_saiz(saiz[8:])
+        self.assertEqual((None, None), sizes[:2])
+        self.assertEqual([8, 16, 22], list(sizes.sizes))
+        saiz = render_full('saiz', pack('>4sLBL', 'cenc', 0, 8, 4),
+                           flags=cenc.AUX_INFO_TYPE_PRESENT)
+        sizes = cenc.decode_saiz(saiz[8:])
+        self.assertEqual(('cenc', 0), sizes[:2])
+        self.assertEqual([8] * 4, list(sizes.sizes))
+
+    def testDecodesSampleInfoOffsets(self):
+        saio = render_full('saio', pack('>LLL', 2, 100, 200))
+        self.assertEqual([100, 200], list(cenc.decode_saio(saio[8:]).offsets))
+        saio = render_full('saio', pack('>4sLLQ', 'cenc', 0, 1, 2**40),
+                           version=1, flags=cenc.AUX_INFO_TYPE_PRESENT)
+        offsets = cenc.decode_saio(saio[8:])
+        self.assertEqual('cenc', offsets.aux_info_type)
+        self.assertEqual([2**40], list(offsets.offsets))
+
+    def testDecodesSubsampleMaps(self):
+        samples = [('a' * 8, [(10, 100), (5, 50)]), ('b' * 8, []),
+                   ('c' * 8, [(20, 200)])]
+        encryption = cenc.decode_senc(render_senc(samples, 8)[8:], 8)
+        self.assertEqual(3, len(encryption))
+        self.assertTrue(encryption.has_subsamples())
+        self.assertEqual(['a' * 8, 'b' * 8, 'c' * 8], encryption.ivs)
+        self.assertEqual([10, 5, 20], list(encryption.clear_bytes))
+        self.assertEqual([100, 50, 200], list(encryption.encrypted_bytes))
+        self.assertEqual([(10, 100), (5, 50)], encryption.get_subsamples(0))
+        self.assertEqual([], encryption.get_subsamples(1))
+        self.assertEqual([(20, 200)], encryption.get_subsamples(2))
+
+    def testDecodesWholeSampleEncryption(self):
+        samples = [('a' * 16, None), ('b' * 16, None)]
+        encryption = cenc.decode_senc( \
+            render_senc(samples, 16, subsamples=False)[8:], 16)
+        self.assertEqual(['a' * 16, 'b' * 16], encryption.ivs)
+        self.assertFalse(encryption.has_subsamples())
+        self.assertEqual([], encryption.get_subsamples(1))
+
+
+    def testShortBoxesAreErrors(self):
+        saiz = render_full('saiz', pack('>BL', 0, 10) + '\x08\x10\x16')
+        self.assertRaises(ValueError, cenc.decode_saiz, saiz[8:])
+        saio = render_full('saio', pack('>LLL', 3, 100, 200))
+        self.assertRaises(ValueError, cenc.decode_saio, saio[8:])
+        senc = render_senc([('a' * 8, [(10, 100), (5, 50)])], 8)
+        self.assertRaises(ValueError, cenc.decode_senc, senc[8:-3], 8)
+        self.assertRaises(ValueError, cenc.decode_senc, senc[8:14], 8)
+        tenc = render_full('tenc', pack('>xBBB16s', 0, 1, 8, KEY_ID))
+        self.assertRaises(ValueError, cenc.decode_tenc, tenc[8:-1])
+
+
+class FindBoxes(unittest.TestCase):
+    def testFindsTrackEncryption(self):
+        sinf = render('sinf', render('frma', 'avc1') + render('schi', \
+            render_tenc()))
+        encv = render('encv', '\0' * 78 + sinf)
+        stsd = render_full('stsd', pack('>L', 1) + encv)
+        trak = render('trak', render('mdia', render('minf', \
+            render('stbl', stsd))))
+        track = Track(Atom(StringIO.StringIO(trak)))
+        self.assertEqual(KEY_ID, cenc.get_track_encryption(track).key_id)
+
+    def testUnprotectedTrackHasNoEncryption(self):
+        stsd = render_full('stsd', pack('>L', 1) + render('mp4a', '\0' * 28))
+        trak = render('trak', render('mdia', render('minf', \
+            render('stbl', stsd))))
+        track = Track(Atom(StringIO.StringIO(trak)))
+        self.assertEqual(None, cenc.get_track_encryption(track))
+
+    def testFindsProtectionSystems(self):
+        pssh = render_full('pssh', WIDEVINE.decode('hex') + pack('>L', 0))
+        moov = Atom(StringIO.StringIO(render('moov', pssh)))
+        moof = Atom(StringIO.StringIO(render('moof', render('traf', pssh))))
+        self.assertEqual([WIDEVINE] * 2, [system.system_id for system \
+            in cenc.get_protection_systems([moov, moof])])
+
+    def testFindsSampleEncryption(self):
+        senc = render_senc([('i' * 8, [(1, 2)])], 8)
+        traf = Atom(StringIO.StringIO(render('traf', senc)))
+        self.assertEqual([(1, 2)],
+            cenc.get_sample_encryption(traf, 8).get_subsamples(0))
+        self.assertEqual(None, cenc.get_sample_encryption(
+            Atom(StringIO.StringIO(render('traf', ''))), 8))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Structural comparison of the atom trees of two MP4 files.
+
+Every atom is given a Merkle-style hash: a data atom's hash covers its
+type and content, and a container's covers its type, its own fields and
+its children's hashes. Trees are compared from the root down, descending
+only into subtrees whose hashes differ.
+
+Media atoms (mdat, by default) are hashed by their type and size alone,
+so huge files can be compared without reading their media.
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+from collections import namedtuple
+import hashlib
+from struct import pack
+
+from atom import get_atom_paths
+
+ADDED = 'added'
+REMOVED = 'removed'
+MODIFIED = 'modified'
+# Atoms compared by size rather than content
+SHALLOW_TYPES = ('mdat',)
+HASH_ALGORITHM = 'sha1'
+
+Difference = namedtuple('Difference', 'change path')
+
+
+class DiffReport(list):
+    """The differences between two trees, in the order they were found"""
+    def add(self, change, path):
+        self.append(Difference(change, path))
+
+    def get_added(self):
+        return [difference for difference in self \
+            if ADDED == difference.change]
+
+    def get_removed(self):
+        return [difference for difference in self \
+            if REMOVED == difference.change]
+
+    def get_modified(self):
+        return [difference for difference in self \
+            if MODIFIED == difference.change]
+
+    def is_identical(self):
+        return 0 == len(self)
+
+    def __str__(self):
+        return '\n'.join(['%s: %s' % difference for difference in self])
+
+
+class SubtreeHasher(object):
+    """Hash atoms and their subtrees, hashing each atom only once"""
+    def __init__(self, shallow_types=SHALLOW_TYPES):
+        self.shallow_types = shallow_types
+        self.__hashes = {}
+
+    def get_hash(self, atom):
+        # Keep the atom with its hash, so its id can't be reused
+        if id(atom) not in self.__hashes:
+            self.__hashes[id(atom)] = (atom, self.__hash(atom))
+        return self.__hashes[id(atom)][1]
+
+    def __hash(self, atom):
+        subtree_hash = hashlib.new(HASH_ALGORITHM, atom.type)
+        if atom.is_container():
+            # Special containers keep their own fields ahead of children
+            padding = atom.get_padding()
+            subtree_hash.update(pack('>L', len(padding)) + padding)
+            subtree_hash.update(pack('>L', len(atom)))
+            for child in atom:
+                subtree_hash.update(self.get_hash(child))
+        elif atom.type in self.shallow_types:
+            subtree_hash.update(pack('>Q', atom.get_content_size()))
+        else:
+            subtree_hash.update(atom.digest(HASH_ALGORITHM))
+        return subtree_hash.digest()
+
+
+def diff_atoms(first_atoms, second_atoms, hasher, report, parent_path=''):
+    first_paths = get_atom_paths(first_atoms, parent_path)
+    second_paths = get_atom_paths(second_atoms, parent_path)
+    (first_children, second_children) = (dict(first_paths),
+                                         dict(second_paths))
+    for (path, first) in first_paths:
+        if path not in second_children:
+            report.add(REMOVED, path)
+            continue
+
+        second = second_children[path]
+        if hasher.get_hash(first) == hasher.get_hash(second):
+            continue
+        if first.is_container() and second.is_container():
+            found = len(report)
+            diff_atoms(first, second, hasher, report, path + '/')
+            if found == len(report):
+                # Only the container's own fields differ
+                report.add(MODIFIED, path)
+        else:
+            report.add(MODIFIED, path)
+
+    for (path, second) in second_paths:
+        if path not in first_children:
+            report.add(ADDED, path)
+
+def diff(first, second, shallow_types=SHALLOW_TYPES):
+    """Compare the atoms of <first> and <second> (such as two Mp4Files);
+       return a DiffReport of the atoms added, removed and modified in
+       <second>. Atoms of <shallow_types> are compared by size alone.
+    """
+    report = DiffReport()
+    diff_atoms(first, second, SubtreeHasher(shallow_types), report)
+    return report
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Unit tests for diff.py
+
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+import StringIO
+import unittest
+
+import atom
+from atom import Atom, render_atom_header
+import diff
+from remuxtest import render_movie
+import tags
+from tagstest import render_tagged_movie
+
+def load_atoms(rendered):
+    stream = StringIO.StringIO(rendered)
+    atoms = []
+    while stream.tell() < len(rendered):
+        atoms.append(Atom(stream, offset=stream.tell()))
+    return atoms
+
+class DiffTrees(unittest.TestCase):
+    tracks = [
+        [('v1a', 40, True), ('v1bb', 40, False), ('v1c', 40, True)],
+        [('a1a', 20, True), ('a1bb', 20, True)],
+    ]
+
+    def testIdenticalFiles(self):
+        report = diff.diff(load_atoms(render_movie(self.tracks)),
+                           load_atoms(render_movie(self.tracks)))
+        self.assertTrue(report.is_identical())
+
+    def testFindsModifiedTag(self):
+        first = load_atoms(render_tagged_movie([
+            ('\xa9nam', [(tags.UTF8, 'Title')]),
+            ('\xa9ART', [(tags.UTF8, 'Artist')])]))
+        second = load_atoms(render_tagged_movie([
+            ('\xa9nam', [(tags.UTF8, 'Other')]),
+            ('\xa9ART', [(tags.UTF8, 'Artist')])]))
+        self.assertEqual([(diff.MODIFIED, 'moov/udta/meta/ilst/\xa9nam/data')],
+                         diff.diff(first, second))
+
+    def testFindsAddedAndRemovedAtoms(self):
+        first = load_atoms(render_tagged_movie([
+            ('\xa9nam', [(tags.UTF8, 'Title')])]))
+        second = load_atoms(render_tagged_movie([
+            ('\xa9ART', [(tags.UTF8, 'Artist')])]))
+        report = diff.diff(first, second)
+        self.assertEqual([(diff.REMOVED, 'moov/udta/meta/ilst/\xa9nam')],
+                         report.get_removed())
+        self.assertEqual([(diff.ADDED, 'moov/udta/meta/ilst/\xa9ART')],
+                         report.get_added())
+
+    def testFindsAddedTrack(self):
+        first = load_atoms(render_movie(self.tracks))
+        second = load_atoms(render_movie(self.tracks + [[('t', 10, True)]]))
+        report = diff.diff(first, second)
+        self.assertEqual([(diff.ADDED, 'moov/trak[3]')], report.get_added())
+        self.assertTrue((diff.MODIFIED, 'mdat') in report.get_modified())
+
+    def testFindsModifiedSpecialContainerFields(self):
+        first = load_atoms(render_atom_header('meta', 4) + '\0\0\0\0')
+        second = load_atoms(render_atom_header('meta', 4) + '\0\0\0\1')
+        self.assertEqual([(diff.MODIFIED, 'meta')], diff.diff(first, second))
+
+    def testMediaIsComparedBySizeWithoutReading(self):
+        size = 1024 * 1024
+        first = load_atoms(render_atom_header('mdat', size) + 'a' * size)
+        second = load_atoms(render_atom_header('mdat', size) + 'b' * size)
+        bytes_read = atom.IO_COUNTERS['bytes']
+        self.assertTrue(diff.diff(first, second).is_identical())
+        self.assertTrue(atom.IO_COUNTERS['bytes'] - bytes_read < size)
+
+        self.assertEqual([(diff.MODIFIED, 'mdat')],
+                         diff.diff(first, second, shallow_types=()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Conversion of progressive MP4 files into fragmented ones, as used for
+HLS and DASH (CMAF) packaging.
+
+Fragmenting produces an init segment (ftyp and a moov with empty sample
+tables and an mvex) and then media segments (a moof and its mdat), each
+of which is generated from slices of the source's sample tables and
+emitted as soon as it is complete.
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+from array import array
+from bisect import bisect_left
+from struct import pack
+
+from atom import render_atom_header
+from muxer import load_atom, render_full_atom
+from remux import copy_atom, render_atom
+from sampletable import UINT32, interleave, make_sample_table_atoms, \
+    pack_array
+from track import Track, set_header_duration
+
+# tfhd flag: data offsets are relative to the start of the moof
+DEFAULT_BASE_IS_MOOF = 0x020000
+# trun flags
+DATA_OFFSET_PRESENT = 0x000001
+SAMPLE_DURATION_PRESENT = 0x000100
+SAMPLE_SIZE_PRESENT = 0x000200
+SAMPLE_FLAGS_PRESENT = 0x000400
+SAMPLE_COMPOSITION_OFFSET_PRESENT = 0x000800
+# Sample flags for samples that do and do not depend on others
+SYNC_SAMPLE_FLAGS = 0x02000000
+NON_SYNC_SAMPLE_FLAGS = 0x01010000
+
+def get_reference_track(tracks):
+    """Choose the track whose sync samples segments are cut at: the first
+       video track, if there is one
+    """
+    for track in tracks:
+        if 'vide' == track.get_handler_type():
+            return track
+    return tracks[0]
+
+def get_sync_flags(table):
+    """Return the trun sample flags for each sample in <table>"""
+    sync_samples = table.get_sync_samples()
+    if sync_samples is None:
+        return array(UINT32, [SYNC_SAMPLE_FLAGS]) * table.get_sample_count()
+
+    flags = array(UINT32, [NON_SYNC_SAMPLE_FLAGS]) * table.get_sample_count()
+    for sample_number in sync_samples:
+        flags[sample_number - 1] = SYNC_SAMPLE_FLAGS
+    return flags
+
+def get_cut_times(track, target_duration):
+    """Choose segment start times (in seconds) at <track>'s sync samples,
+       cutting at the first sync sample at least <target_duration> seconds
+       after the start of each segment
+    """
+    table = track.get_sample_table()
+    timescale = float(track.get_timescale())
+    decode_times = table.get_decode_times()
+    sync_samples = table.get_sync_samples()
+    if sync_samples is None:
+        sync_times = decode_times
+    else:
+        sync_times = [decode_times[number - 1] for number in sync_samples]
+
+    cut_times = [0.0]
+    target = target_duration * timescale
+    index = bisect_left(sync_times, target)
+    while index < len(sync_times):
+        cut_times.append(sync_times[index] / timescale)
+        index = bisect_left(sync_times, sync_times[index] + target)
+    return cut_times
+
+def get_segment_boundaries(tracks, cut_times):
+    """Find the index of the first sample of each of <tracks> in every
+       segment starting at <cut_times>, followed by each track's sample
+       count
+    """
+    track_boundaries = []
+    for track in tracks:
+        table = track.get_sample_table()
+        decode_times = table.get_decode_times()
+        timescale = track.get_timescale()
+        boundaries = [bisect_left(decode_times, int(round(time * timescale))) \
+            for time in cut_times]
+        track_boundaries.append(boundaries + [table.get_sample_count()])
+    return track_boundaries
+
+def render_init_segment(mp4file, tracks=None, brands=('iso6', 'mp41')):
+    """Render an init segment for fragments of <tracks> (by default, every
+       track) of <mp4file>
+    """
+    if tracks is None:
+        tracks = mp4file.get_tracks()
+    track_ids = [track.get_track_id() for track in tracks]
+
+    movie = copy_atom(mp4file.get_movie())
+    movie[0:] = [atom for atom in movie if 'trak' != atom.type \
+        or Track(atom).get_track_id() in track_ids]
+    set_header_duration(movie.get_children_of_type('mvhd')[0], 0)
+
+    trex = ''
+    empty = array(UINT32)
+    for trak in movie.get_children_of_type('trak'):
+        track = Track(trak)
+        set_header_duration(track.get_track_header(), 0)
+        set_header_duration(track.get_media_header(), 0)
+        stbl = track.get_sample_table_atom()
+        stbl[0:] = stbl.get_children_of_type('stsd') \
+            + make_sample_table_atoms(empty, (empty, empty),
+                                      (empty, empty, empty), empty)
+        trex += render_full_atom('trex', \
+            pack('>LLLLL', track.get_track_id(), 1, 0, 0, 0))
+    movie.append(load_atom(render_atom_header('mvex', len(trex)) + trex))
+
+    ftyp = pack('>4sL', brands[0], 0) + ''.join(brands)
+    return render_atom_header('ftyp', len(ftyp)) + ftyp + render_atom(movie)
+
+def render_track_fragment(track_id, decode_time, durations, sizes, flags,
+                          composition_offsets, data_offset):
+    """Render a traf for a run of samples starting at <decode_time>, whose
+       data starts <data_offset> bytes after the start of the moof
+    """
+    tfhd = render_full_atom('tfhd', pack('>L', track_id),
+                            flags=DEFAULT_BASE_IS_MOOF)
+    tfdt = render_full_atom('tfdt', pack('>Q', decode_time), version=1)
+
+    run_flags = DATA_OFFSET_PRESENT | SAMPLE_DURATION_PRESENT \
+        | SAMPLE_SIZE_PRESENT | SAMPLE_FLAGS_PRESENT
+    columns = [durations, sizes, flags]
+    version = 0
+    if 0 < len(composition_offsets) and (0 != min(composition_offsets) \
+     or 0 != max(composition_offsets)):
+        run_flags |= SAMPLE_COMPOSITION_OFFSET_PRESENT
+        if min(composition_offsets) < 0:
+            version = 1
+        # Store signed offsets by their two's complement bits
+        columns.append(array(UINT32, \
+            [offset & 0xffffffff for offset in composition_offsets]))
+    trun = render_full_atom('trun', \
+        pack('>Ll', len(sizes), data_offset) \
+        + pack_array(interleave(*columns)), version=version, flags=run_flags)
+
+    content = tfhd + tfdt + trun
+    return render_atom_header('traf', len(content)) + content
+
+def render_segment(sequence_number, runs):
+    """Render a moof and mdat for <runs> of samples, each a tuple of
+       (track_id, decode_time, durations, sizes, flags,
+       composition_offsets, data)
+    """
+    mfhd = render_full_atom('mfhd', pack('>L', sequence_number))
+    media_size = sum([len(run[-1]) for run in runs])
+    media_header = render_atom_header('mdat', media_size)
+
+    # Render once to find the moof's size, which data offsets depend on
+    data_offset = 0
+    for attempt in range(2):
+        trafs = []
+        run_offset = data_offset
+        for run in runs:
+            trafs.append(render_track_fragment(*(run[:-1] + (run_offset,))))
+            run_offset += len(run[-1])
+        content = mfhd + ''.join(trafs)
+        moof = render_atom_header('moof', len(content)) + content
+        data_offset = len(moof) + len(media_header)
+
+    return moof + media_header + ''.join([run[-1] for run in runs])
+
+def iter_segments(mp4file, target_duration=6.0, tracks=None):
+    """Generate media segments holding <tracks> (by default, every track)
+       of <mp4file>, each starting at a sync sample of the reference track
+       (see get_reference_track) about <target_duration> seconds after the
+       previous segment's start.
+
+       Each segment is yielded as soon as its samples have been read, so
+       output starts immediately and only one segment's media is held in
+       memory at a time.
+    """
+    if target_duration <= 0:
+        raise ValueError, 'Segments must have a positive target duration'
+    if tracks is None:
+        tracks = mp4file.get_tracks()
+    cut_times = get_cut_times(get_reference_track(tracks), target_duration)
+
+    track_boundaries = get_segment_boundaries(tracks, cut_times)
+    track_flags = [get_sync_flags(track.get_sample_table()) \
+        for track in tracks]
+
+    source = open(mp4file.filename, 'rb')
+    try:
+        for segment in range(len(cut_times)):
+            runs = []
+            for (track, boundaries, flags) in \
+             zip(tracks, track_boundaries, track_flags):
+                (first, last) = boundaries[segment:segment + 2]
+                if first == last:
+                    continue
+
+                table = track.get_sample_table()
+                data = []
+                for (offset, size) in table.get_byte_ranges(first, last):
+                    source.seek(offset)
+                    data.append(source.read(size))
+                runs.append((track.get_track_id(),
+                    table.get_decode_times()[first],
+                    table.get_sample_durations()[first:last],
+                    table.get_sample_sizes()[first:last],
+                    flags[first:last],
+                    table.get_sample_composition_offsets()[first:last],
+                    ''.join(data)))
+            if runs:
+                yield render_segment(segment + 1, runs)
+    finally:
+        source.close()
+
+def fragment(mp4file, stream, target_duration=6.0, tracks=None):
+    """Write a fragmented copy of <mp4file> to <stream>: its init segment
+       followed by each of its media segments
+    """
+    stream.write(render_init_segment(mp4file, tracks))
+    for segment in iter_segments(mp4file, target_duration, tracks):
+        stream.write(segment)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Unit tests for fragment.py
+
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+from struct import unpack
+import os
+import shutil
+import tempfile
+import unittest
+
+import fragment
+from mp4file import Mp4File
+from muxertest import write_movie
+from sampletable import read_content
+
+def read_fragments(mp4file):
+    """Read each track's samples, as (data, duration, sync), from the
+       moofs of a fragmented <mp4file>
+    """
+    tracks = {}
+    stream = open(mp4file.filename, 'rb')
+    for moof in mp4file.get_children_of_type('moof'):
+        moof_offset = moof.get_content_offset() - 8
+        for traf in moof.get_children_of_type('traf'):
+            track_id = unpack('>L', read_content(
+                traf.get_children_of_type('tfhd')[0])[4:8])[0]
+            trun = read_content(traf.get_children_of_type('trun')[0])
+            flags = unpack('>L', '\0' + trun[1:4])[0]
+            (count, data_offset) = unpack('>Ll', trun[4:12])
+            width = 12 + (flags & fragment.SAMPLE_COMPOSITION_OFFSET_PRESENT \
+                and 4 or 0)
+            stream.seek(moof_offset + data_offset)
+            for index in range(count):
+                entry = trun[12 + index * width:12 + (index + 1) * width]
+                (duration, size, sample_flags) = unpack('>LLL', entry[:12])
+                tracks.setdefault(track_id, []).append((stream.read(size),
+                    duration, fragment.SYNC_SAMPLE_FLAGS == sample_flags))
+    stream.close()
+    return [tracks[track_id] for track_id in sorted(tracks)]
+
+
+class FragmentFile(unittest.TestCase):
+    tracks = [
+        [('v%d' % index, 40, 0 == index % 3) for index in range(9)],
+        [('a%d' % index, 30, True) for index in range(12)],
+    ]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'file.mp4')
+        self.output_path = os.path.join(self.directory, 'fragmented.mp4')
+        write_movie(self.path, self.tracks)
+        self.mp4file = Mp4File(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def fragment(self, **kwargs):
+        output = open(self.output_path, 'wb')
+        fragment.fragment(self.mp4file, output, **kwargs)
+        output.close()
+        return Mp4File(self.output_path)
+
+    def testOutputIsFragmented(self):
+        output = self.fragment(target_duration=0.1)
+        self.assertEqual(['ftyp', 'moov'] + ['moof', 'mdat'] * 3,
+                         [atom.type for atom in output])
+        self.assertEqual(2,
+            len(output.get_movie().get_descendants_of_type('trex')))
+
+    def testInitSegmentHasNoSamples(self):
+        output = self.fragment(target_duration=0.1)
+        for track in output.get_tracks():
+            self.assertEqual(0, track.get_sample_table().get_sample_count())
+
+    def testSegmentsStartAtSyncSamples(self):
+        segments = list(fragment.iter_segments(self.mp4file, 0.1))
+        self.assertEqual(3, len(segments))
+
+        output = self.fragment(target_duration=0.1)
+        video = read_fragments(output)[0]
+        self.assertEqual([True, True, True],
+            [video[index][2] for index in range(0, 9, 3)])
+
+    def testSamplesAreCarriedOver(self):
+        output = self.fragment(target_duration=0.1)
+        self.assertEqual(self.tracks, read_fragments(output))
+
+    def testFragmentsSelectedTracks(self):
+        output = self.fragment(target_duration=0.1,
+                               tracks=self.mp4file.get_tracks()[1:])
+        self.assertEqual(1, len(output.get_tracks()))
+        self.assertEqual(self.tracks[1:], read_fragments(output))
+
+    def testRejectsEmptyTargetDuration(self):
+        self.assertRaises(ValueError, list,
+                          fragment.iter_segments(self.mp4file, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""HLS playlists that serve progressive MP4 files by byte range.
+
+Segment boundaries, durations and byte ranges all come from the sample
+tables in the moov, so no media data is read. Segments are cut at the
+same sync samples as fragment.iter_segments() would use.
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+from array import array
+from itertools import imap
+from math import ceil
+from operator import add
+import os
+
+from fragment import get_cut_times, get_reference_track, \
+    get_segment_boundaries
+from sampletable import UINT64
+
+PLAYLIST_VERSION = 6
+
+def get_cache_key(filename, uri, target_duration=6.0, track_ids=None):
+    """Return a key identifying the playlist render_playlist gives for
+       <filename> at <uri>, covering the tracks with <track_ids> (by
+       default, every track), which changes whenever the file does. It can
+       be found without parsing the file, so it can be checked before a
+       cached playlist is regenerated.
+    """
+    status = os.stat(filename)
+    if track_ids is not None:
+        # Order matters, as the first video track is cut at
+        track_ids = tuple(track_ids)
+    return (os.path.abspath(filename), status.st_size, status.st_mtime,
+            uri, target_duration, track_ids)
+
+def get_header_range(mp4file):
+    """Return the (offset, length) of everything before the first sample:
+       the ftyp, moov and mdat header, which players load first.
+    """
+    movie = mp4file.get_movie()
+    media = mp4file.get_children_of_type('mdat')
+    if movie is None or 0 == len(media):
+        raise ValueError, '%s has no moov or no mdat' % mp4file.filename
+    if media[0].get_content_offset() < movie.get_content_offset():
+        raise ValueError, \
+            '%s has its moov after its mdat; move the moov first' \
+            % mp4file.filename
+    return (0, media[0].get_content_offset())
+
+def get_segments(mp4file, target_duration=6.0, tracks=None):
+    """Return (duration, offset, length) for each segment of <tracks>
+       (by default, every track) of <mp4file>: each segment starts at a
+       sync sample of the reference track and covers every byte holding
+       samples of any track between it and the next segment
+    """
+    if tracks is None:
+        tracks = mp4file.get_tracks()
+    reference = get_reference_track(tracks)
+    cut_times = get_cut_times(reference, target_duration)
+    end_time = reference.get_sample_table().get_duration() \
+        / float(reference.get_timescale())
+    track_boundaries = get_segment_boundaries(tracks, cut_times)
+
+    track_starts = []
+    track_ends = []
+    for track in tracks:
+        table = track.get_sample_table()
+        offsets = table.get_sample_offsets()
+        track_starts.append(offsets)
+        track_ends.append(array(UINT64, \
+            imap(add, offsets, table.get_sample_sizes())))
+
+    segments = []
+    for (index, start_time) in enumerate(cut_times):
+        starts = []
+        ends = []
+        for (boundaries, offsets, sample_ends) in \
+         zip(track_boundaries, track_starts, track_ends):
+            (first, last) = boundaries[index:index + 2]
+            if first < last:
+                starts.append(min(offsets[first:last]))
+                ends.append(max(sample_ends[first:last]))
+        if not starts:
+            continue
+
+        if index + 1 < len(cut_times):
+            duration = cut_times[index + 1] - start_time
+        else:
+            duration = end_time - start_time
+        segments.append((duration, min(starts), max(ends) - min(starts)))
+    return segments
+
+def render_playlist(mp4file, uri, target_duration=6.0, tracks=None):
+    """Render an HLS media playlist serving <mp4file>, found at <uri>, by
+       byte range
+    """
+    (header_offset, header_length) = get_header_range(mp4file)
+    segments = get_segments(mp4file, target_duration, tracks)
+    longest = max([0] + [duration for (duration, offset, length) \
+        in segments])
+
+    lines = [
+        '#EXTM3U',
+        '#EXT-X-VERSION:%d' % PLAYLIST_VERSION,
+        '#EXT-X-TARGETDURATION:%d' % int(ceil(longest)),
+        '#EXT-X-MEDIA-SEQUENCE:0',
+        '#EXT-X-PLAYLIST-TYPE:VOD',
+        '#EXT-X-INDEPENDENT-SEGMENTS',
+        '#EXT-X-MAP:URI="%s",BYTERANGE="%d@%d"' \
+            % (uri, header_length, header_offset),
+    ]
+    for (duration, offset, length) in segments:
+        lines.append('#EXTINF:%.3f,' % duration)
+        lines.append('#EXT-X-BYTERANGE:%d@%d' % (length, offset))
+        lines.append(uri)
+    lines.append('#EXT-X-ENDLIST')
+    return '\n'.join(lines) + '\n'
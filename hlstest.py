@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Unit tests for hls.py
+
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import hls
+from mp4file import Mp4File
+from remuxtest import render_movie
+
+class PlaylistFromFile(unittest.TestCase):
+    tracks = [
+        [('v%d' % index, 40, 0 == index % 3) for index in range(9)],
+        [('a%d' % index, 30, True) for index in range(12)],
+    ]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'file.mp4')
+        self.rendered = render_movie(self.tracks, movie_first=True)
+        open(self.path, 'wb').write(self.rendered)
+        self.mp4file = Mp4File(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testSegmentsAreCutAtSyncSamples(self):
+        segments = hls.get_segments(self.mp4file, 0.1)
+        self.assertEqual([0.12, 0.12, 0.12],
+            [round(duration, 3) for (duration, offset, length) in segments])
+
+    def testSegmentsCoverSamples(self):
+        segments = hls.get_segments(self.mp4file, 0.1)
+        video_start = self.rendered.index('v0')
+        audio_end = self.rendered.index('a11') + 3
+
+        self.assertEqual(video_start, segments[0][1])
+        # The samples are stored track by track, so segments overlap
+        self.assertEqual(audio_end, segments[-1][1] + segments[-1][2])
+        self.assertEqual('v6', self.rendered[segments[-1][1]:][:2])
+
+    def testPlaylistStartsWithHeaderRange(self):
+        playlist = hls.render_playlist(self.mp4file, 'file.mp4', 0.1)
+        header_length = self.rendered.index('v0')
+
+        self.assertTrue('#EXT-X-MAP:URI="file.mp4",BYTERANGE="%d@0"' \
+            % header_length in playlist.splitlines())
+        self.assertEqual(3, playlist.count('#EXT-X-BYTERANGE'))
+        self.assertTrue(playlist.endswith('#EXT-X-ENDLIST\n'))
+
+    def testRejectsMovieAfterMedia(self):
+        open(self.path, 'wb').write(render_movie(self.tracks))
+        self.assertRaises(ValueError, hls.render_playlist,
+                          Mp4File(self.path), 'file.mp4')
+
+    def testCacheKeyChangesWithFile(self):
+        key = hls.get_cache_key(self.path, 'file.mp4')
+        open(self.path, 'ab').write('extra')
+        self.assertNotEqual(key, hls.get_cache_key(self.path, 'file.mp4'))
+
+    def testCacheKeyChangesWithPlaylist(self):
+        key = hls.get_cache_key(self.path, 'file.mp4')
+        self.assertEqual(key, hls.get_cache_key(self.path, 'file.mp4'))
+        self.assertNotEqual(key, hls.get_cache_key(self.path, 'other.mp4'))
+        self.assertNotEqual(key, hls.get_cache_key(self.path, 'file.mp4',
+                                                   track_ids=[1]))
+        self.assertNotEqual(key, hls.get_cache_key(self.path, 'file.mp4', 2.0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Page cache advice and read-ahead for scans of files on cold storage.
+
+An IOPolicy tells the kernel how a file's regions are about to be read:
+the whole file sequentially, the moov (whose small atoms are otherwise
+read with a seek apiece) all at once and straight away, and media that
+has been streamed through not at all again, so that copying it doesn't
+push other files out of the page cache.
+
+Advice is given through os.posix_fadvise where Python has it, through
+the C library's posix_fadvise on Linux otherwise, and is silently
+skipped where neither is available; it never changes what is read.
+The kernel won't drop pages that are still mapped, so files read under
+a policy are read through their descriptors rather than a map.
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+import ctypes
+import ctypes.util
+import os
+import sys
+
+# Default size of the blocks in which headers are read ahead
+READ_AHEAD = 1024 * 1024
+
+# Advice values, as Linux defines them where os doesn't
+NORMAL = getattr(os, 'POSIX_FADV_NORMAL', 0)
+SEQUENTIAL = getattr(os, 'POSIX_FADV_SEQUENTIAL', 2)
+WILLNEED = getattr(os, 'POSIX_FADV_WILLNEED', 3)
+DONTNEED = getattr(os, 'POSIX_FADV_DONTNEED', 4)
+
+def get_fadvise():
+    """Find a posix_fadvise(fd, offset, length, advice) function, or None
+       if the platform has none
+    """
+    if hasattr(os, 'posix_fadvise'):
+        return os.posix_fadvise
+    if not sys.platform.startswith('linux'):
+        return None
+
+    library = ctypes.util.find_library('c')
+    if library is None:
+        return None
+    try:
+        libc = ctypes.CDLL(library)
+        # The 64-bit variant takes 64-bit offsets even on 32-bit systems
+        c_fadvise = libc.posix_fadvise64
+    except (OSError, AttributeError):
+        return None
+    c_fadvise.argtypes = [ctypes.c_int, ctypes.c_int64, ctypes.c_int64,
+                          ctypes.c_int]
+    def fadvise(fd, offset, length, advice):
+        # Errors are returned rather than set in errno
+        error = c_fadvise(fd, offset, length, advice)
+        if error:
+            raise OSError, (error, os.strerror(error))
+    return fadvise
+
+FADVISE = get_fadvise()
+
+
+class IOPolicy(object):
+    """How to read a file: headers are read ahead in blocks of
+       <read_ahead> bytes and, if <advise> is set, the kernel is told
+       which regions are about to be read and which are finished with
+    """
+    def __init__(self, read_ahead=READ_AHEAD, advise=True):
+        self.read_ahead = read_ahead
+        self.advise = advise and FADVISE is not None
+
+    def give_advice(self, stream, offset, size, advice):
+        """Give <advice> about <size> bytes of <stream> from <offset> (or
+           the rest of it, if <size> is 0). Advice is best-effort, so
+           failures (on a stream with no file descriptor, say) are ignored.
+        """
+        if not self.advise:
+            return
+        try:
+            FADVISE(stream.fileno(), offset, size, advice)
+        except (AttributeError, IOError, OSError, ValueError):
+            pass
+
+    def start_scan(self, stream):
+        """Advise that the whole of <stream> will be read in order"""
+        self.give_advice(stream, 0, 0, SEQUENTIAL)
+
+    def will_need(self, stream, offset, size):
+        """Advise that a region of <stream> is about to be read"""
+        self.give_advice(stream, offset, size, WILLNEED)
+
+    def done_with(self, stream, offset, size):
+        """Advise that a region of <stream> won't be read again soon"""
+        self.give_advice(stream, offset, size, DONTNEED)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Unit tests for iopolicy.py
+
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+import ctypes
+import ctypes.util
+import mmap
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import unittest
+
+import iopolicy
+from iopolicy import IOPolicy
+from mp4file import Mp4File
+import remux
+from remuxtest import read_samples, render_movie
+
+def get_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    library = ctypes.util.find_library('c')
+    if library is None:
+        return None
+    libc = ctypes.CDLL(library)
+    libc.mmap.restype = ctypes.c_void_p
+    libc.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int,
+                          ctypes.c_int, ctypes.c_int, ctypes.c_int64]
+    libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t,
+                             ctypes.c_void_p]
+    libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+    return libc
+
+LIBC = get_libc()
+
+def get_resident_fraction(path):
+    """Find the fraction of the pages of the file at <path> that are in
+       the page cache, with mincore
+    """
+    size = os.path.getsize(path)
+    pages = (size + mmap.PAGESIZE - 1) // mmap.PAGESIZE
+    stream = open(path, 'rb')
+    try:
+        address = LIBC.mmap(None, size, mmap.PROT_READ, mmap.MAP_SHARED,
+                            stream.fileno(), 0)
+        if address in (None, ctypes.c_void_p(-1).value):
+            raise OSError, 'Could not map %s' % path
+        try:
+            residency = (ctypes.c_ubyte * pages)()
+            if 0 != LIBC.mincore(address, size, residency):
+                raise OSError, 'Could not find residency of %s' % path
+        finally:
+            LIBC.munmap(address, size)
+    finally:
+        stream.close()
+    return sum([page & 1 for page in residency]) / float(pages)
+
+
+class RecordingPolicy(IOPolicy):
+    """A policy that records its advice rather than giving it"""
+    def __init__(self, read_ahead=iopolicy.READ_AHEAD):
+        IOPolicy.__init__(self, read_ahead)
+        self.advice = []
+
+    def give_advice(self, stream, offset, size, advice):
+        self.advice.append((offset, size, advice))
+
+
+class AdviseReads(unittest.TestCase):
+    tracks = [
+        [('v%d' % index, 40, 0 == index % 3) for index in range(6)],
+        [('a%d' % index, 30, True) for index in range(8)],
+    ]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'file.mp4')
+        open(self.path, 'wb').write(render_movie(self.tracks))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testAdvisesScanAndMovie(self):
+        policy = RecordingPolicy()
+        movie = Mp4File(self.path, io_policy=policy).get_movie()
+        self.assertEqual([(0, 0, iopolicy.SEQUENTIAL),
+            (movie.get_source_offset(), movie.get_size(), iopolicy.WILLNEED)],
+            policy.advice)
+
+    def testReadsAheadInBlocks(self):
+        mp4file = Mp4File(self.path, io_policy=RecordingPolicy(read_ahead=16))
+        self.assertEqual(self.tracks, read_samples(mp4file))
+
+    def testReleasesStreamedMedia(self):
+        policy = RecordingPolicy()
+        mp4file = Mp4File(self.path, io_policy=policy)
+        mdat = mp4file.get_children_of_type('mdat')[0]
+        remux.faststart(mp4file, StringIO.StringIO())
+        self.assertEqual((mdat.get_source_offset(), mdat.get_size(),
+                          iopolicy.DONTNEED), policy.advice[-1])
+
+    @unittest.skipIf(LIBC is None or iopolicy.FADVISE is None,
+                     'needs mincore and posix_fadvise')
+    def testReleasedMediaLeavesPageCache(self):
+        path = os.path.join(self.directory, 'large.mp4')
+        data = os.urandom(1024 * 1024)
+        stream = open(path, 'wb')
+        stream.write(render_movie([[(data * 16, 40, True)]]))
+        # Only clean pages can be dropped
+        stream.flush()
+        os.fsync(stream.fileno())
+        stream.close()
+        open(path, 'rb').read()
+        self.assertTrue(0.9 < get_resident_fraction(path))
+
+        with Mp4File(path, io_policy=IOPolicy()) as mp4file:
+            output = StringIO.StringIO()
+            remux.faststart(mp4file, output)
+            # Pages that share a folio (which may be 2MB) with the headers
+            # before the mdat may stay
+            self.assertTrue(get_resident_fraction(path) < 0.25)
+        self.assertTrue(data * 16 in output.getvalue())
+
+    def testWithoutPolicyGivesNoAdvice(self):
+        mp4file = Mp4File(self.path)
+        mp4file.release(mp4file.get_children_of_type('mdat')[0])
+        self.assertEqual(None, mp4file.io_policy)
+
+    def testAdviceIsBestEffort(self):
+        policy = IOPolicy()
+        stream = open(self.path, 'rb')
+        policy.start_scan(stream)
+        policy.will_need(stream, 0, 100)
+        policy.done_with(stream, 0, 0)
+        stream.close()
+        # Streams without a descriptor, and closed ones, are ignored
+        policy.will_need(StringIO.StringIO(), 0, 100)
+        policy.will_need(stream, 0, 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,16 +5,178 @@ __author__ = "Steve Marshall (steve@nascentguruism.com)"
 __copyright__ = "Copyright (c) 2008 Steve Marshall"
 __license__ = "Python"
 
-from atom import Atom
+from atom import ATOM_HEADER, HEADER_BLOCK_SIZE, Atom, HeaderScanner, \
+    close_source, get_source_reader
+import bitrate
+from struct import calcsize
+from tags import Tags
+from track import Track
 import os
+import validation
+
+def prepare_track(atom):
+    """Decode the sample tables of <atom> if it's a trak"""
+    if 'trak' != atom.type:
+        return None
+    track = Track(atom)
+    track.get_sample_table().load()
+    return track
+
 
 class Mp4File(list):
-    def __init__(self, file):
-        fh = open(file, 'rb')
-        size = os.stat(file).st_size
-        while fh.tell() < size:
-            root_atom = Atom( stream=fh, offset=fh.tell() )
-            root_atom.seek( 0, os.SEEK_END )
+    def __init__(self, file, threads=0, follow=False, io_policy=None):
+        """Load the atoms of <file>. If <threads> is more than 1, the
+           subtrees of moov's children are loaded, and their sample tables
+           decoded, concurrently on that many threads.
+           
+           If <follow> is set, <file> is taken to be still growing (as a
+           recording in progress would be): only complete root atoms are
+           loaded, and refresh() loads those appended since.
+
+           If an iopolicy.IOPolicy <io_policy> is given, headers are read
+           ahead as it says, and the kernel is advised of how the file
+           will be read.
+        """
+        self.filename = file
+        self.follow = follow
+        self.__threads = threads
+        self.__tracks = {}
+        self.__tags = None
+        self.__stream = open(file, 'rb')
+        self.io_policy = io_policy
+        # With an I/O policy, media is read through the file rather than a
+        # map of it, as the kernel only takes advice on unmapped pages
+        self.__reader = get_source_reader(self.__stream,
+                                          use_map=io_policy is None)
+        if io_policy is not None:
+            io_policy.start_scan(self.__stream)
+        # The end of the last root atom loaded
+        self.__end = 0
+        self.size = 0
+        self.refresh()
+
+    def __is_complete(self, scanner, offset):
+        """Whether the whole of the root atom at <offset> has been written"""
+        try:
+            (type, size, header_size) = scanner.parse(offset)
+        except EOFError:
+            # Only part of a large atom's header has been written
+            return False
+        # A zero size is written while the atom's real size isn't known
+        declared_size = scanner.read(offset, calcsize(ATOM_HEADER['basic']))
+        return offset + header_size + size <= self.size \
+            and not declared_size.startswith('\0\0\0\0')
+
+    def refresh(self):
+        """Load any root atoms after those already loaded, in a file that
+           has grown since; return the atoms loaded.
+        """
+        # A new scanner, as the old one may hold the old end of the file
+        block_size = HEADER_BLOCK_SIZE
+        if self.io_policy is not None:
+            block_size = self.io_policy.read_ahead
+        scanner = HeaderScanner(self.__stream, block_size)
+        self.size = os.fstat(self.__stream.fileno()).st_size
+        loaded = []
+        offset = self.__end
+        # Ignore trailing data too short to be an atom
+        while calcsize(ATOM_HEADER['basic']) <= self.size - offset:
+            if self.follow and not self.__is_complete(scanner, offset):
+                break
+            (type, size, header_size) = scanner.parse(offset)
+            if 'moov' == type and self.io_policy is not None:
+                # The moov's atoms are read all over, so fetch it at once
+                self.io_policy.will_need(self.__stream, offset,
+                                         header_size + size)
+            if 1 < self.__threads and 'moov' == type:
+                root_atom = Atom( stream=self.__stream, offset=offset,
+                                  load_children=False, scanner=scanner )
+                self.__add_tracks(root_atom.load_children_concurrently(
+                    self.__threads, prepare_track))
+            else:
+                root_atom = Atom( stream=self.__stream, offset=offset,
+                                  scanner=scanner )
             self.append( root_atom )
-    
+            loaded.append( root_atom )
+            offset = root_atom.get_content_offset() \
+                + max(0, root_atom.get_source_size())
+        self.__end = offset
+        return loaded
+
+    def release(self, atom):
+        """Advise that the source of root <atom> (an mdat just streamed
+           through, say) won't be read again soon, if there's an I/O policy
+        """
+        if self.io_policy is not None \
+         and atom.get_content_offset() is not None:
+            self.io_policy.done_with(self.__stream, atom.get_source_offset(),
+                atom.get_content_offset() + atom.get_source_size() \
+                - atom.get_source_offset())
+
+    def get_source_reader(self):
+        """Get the SourceReader the file's atoms are read through"""
+        return self.__reader
+
+    def close(self):
+        """Close the file, and drop any map of it. Atoms not yet read
+           can't be read afterwards.
+        """
+        close_source(self.__stream)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __add_tracks(self, tracks):
+        for track in tracks:
+            if track is not None:
+                self.__tracks[id(track.trak)] = track
+
+    def get_children_of_type(self, type):
+        return [atom for atom in self if atom.type == type]
+
+    def get_movie(self):
+        """Get the file's moov atom, or None if it has none"""
+        movies = self.get_children_of_type('moov')
+        if 0 == len(movies):
+            return None
+        return movies[0]
+
+    def get_tracks(self):
+        movie = self.get_movie()
+        if movie is None:
+            return []
+        # Keep each trak's Track, so its decoded tables are kept too
+        tracks = []
+        for trak in movie.get_children_of_type('trak'):
+            if id(trak) not in self.__tracks:
+                self.__tracks[id(trak)] = Track(trak)
+            tracks.append(self.__tracks[id(trak)])
+        return tracks
+
+    @property
+    def tags(self):
+        """The file's iTunes tags, as a tags.Tags view that decodes each
+           value only when it's looked up
+        """
+        if self.__tags is None:
+            self.__tags = Tags(self)
+        return self.__tags
+
+    def get_bitrate_profiles(self, window=bitrate.WINDOW, step=None):
+        """Profile the bitrate of each track over windows of <window>
+           seconds, starting every <step> seconds (by default, every
+           <window> seconds), without reading any media; return a
+           bitrate.BitrateProfile for each track, keyed by track id
+        """
+        return bitrate.get_bitrate_profiles(self, window, step)
+
+    def validate(self):
+        """Check the file's atom structure and cross-check its sample
+           tables against its mdat, without reading any media; return a
+           validation.ValidationReport
+        """
+        return validation.validate(self)
 
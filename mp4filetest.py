@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Unit tests for mp4file.py
+
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+import gc
+import os
+from struct import pack
+import shutil
+import tempfile
+import unittest
+
+import atom
+from atom import ATOM_HEADER, render_atom_header
+from mp4file import Mp4File
+from remuxtest import read_samples, render_movie
+
+class LoadFile(unittest.TestCase):
+    tracks = [
+        [('v%d' % index, 40, 0 == index % 3) for index in range(9)],
+        [('a%d' % index, 30, True) for index in range(12)],
+        [('t%d' % index, 120, True) for index in range(3)],
+    ]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'file.mp4')
+        open(self.path, 'wb').write(render_movie(self.tracks))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testLoadsRootAtoms(self):
+        self.assertEqual(['ftyp', 'mdat', 'moov'],
+                         [atom.type for atom in Mp4File(self.path)])
+
+    def testTracksAreKept(self):
+        mp4file = Mp4File(self.path)
+        self.assertEqual(mp4file.get_tracks(), mp4file.get_tracks())
+        self.assertTrue(mp4file.get_tracks()[0] is mp4file.get_tracks()[0])
+
+    def testConcurrentLoadMatchesSequentialLoad(self):
+        sequential = Mp4File(self.path)
+        concurrent = Mp4File(self.path, threads=3)
+
+        self.assertEqual(list(sequential), list(concurrent))
+        self.assertEqual(read_samples(sequential), read_samples(concurrent))
+
+    def testConcurrentLoadDecodesTables(self):
+        concurrent = Mp4File(self.path, threads=3)
+        self.assertEqual(3, len(concurrent.get_tracks()))
+        self.assertEqual(self.tracks, read_samples(concurrent))
+
+
+class CloseFile(unittest.TestCase):
+    tracks = [[('v1a', 40, True), ('v1bb', 40, False)]]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'file.mp4')
+        open(self.path, 'wb').write(render_movie(self.tracks))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def count_open_files(self):
+        return len(os.listdir('/proc/self/fd'))
+
+    @unittest.skipUnless(os.path.isdir('/proc/self/fd'), 'needs /proc')
+    def testDroppedFilesAreFreed(self):
+        open_files = self.count_open_files()
+        for threads in (0, 4):
+            for index in range(20):
+                mp4file = Mp4File(self.path, threads=threads)
+                read_samples(mp4file)
+                mp4file.get_tracks()[0].get_sample_table().get_sample_sizes()
+                del mp4file
+            gc.collect()
+            self.assertEqual(open_files, self.count_open_files())
+
+    @unittest.skipUnless(os.path.isdir('/proc/self/fd'), 'needs /proc')
+    def testConcurrentLoadOpensNoOtherStreams(self):
+        open_files = self.count_open_files()
+        mp4file = Mp4File(self.path, threads=4)
+        # The file itself, and the map its tables were decoded through
+        self.assertTrue(self.count_open_files() <= open_files + 2)
+        self.assertEqual(self.tracks, read_samples(mp4file))
+
+    @unittest.skipUnless(os.path.isdir('/proc/self/fd'), 'needs /proc')
+    def testCloseFreesFile(self):
+        open_files = self.count_open_files()
+        with Mp4File(self.path) as mp4file:
+            mdat = mp4file.get_children_of_type('mdat')[0]
+            mdat.seek(0)
+            self.assertEqual('v1av1bb', mdat.read())
+        self.assertEqual(open_files, self.count_open_files())
+        mdat.seek(0)
+        self.assertRaises(ValueError, mdat.read)
+
+
+class FollowGrowingFile(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'recording.mp4')
+        self.recording = open(self.path, 'wb')
+        self.write(render_movie([[('v0', 40, True)]]))
+
+    def tearDown(self):
+        self.recording.close()
+        shutil.rmtree(self.directory)
+
+    def write(self, data):
+        self.recording.write(data)
+        self.recording.flush()
+
+    def render_fragment(self, number):
+        mfhd = render_atom_header('mfhd', 8) + pack('>4xL', number)
+        media = 'fragment %d' % number
+        return render_atom_header('moof', len(mfhd)) + mfhd \
+            + render_atom_header('mdat', len(media)) + media
+
+    def testLoadsAppendedAtoms(self):
+        mp4file = Mp4File(self.path, follow=True)
+        self.assertEqual(['ftyp', 'mdat', 'moov'], [a.type for a in mp4file])
+
+        self.write(self.render_fragment(1) + self.render_fragment(2))
+        self.assertEqual(['moof', 'mdat', 'moof', 'mdat'],
+                         [a.type for a in mp4file.refresh()])
+        self.assertEqual(7, len(mp4file))
+        self.assertEqual([], mp4file.refresh())
+
+    def testWaitsForIncompleteAtoms(self):
+        mp4file = Mp4File(self.path, follow=True)
+        fragment = self.render_fragment(1)
+        self.write(fragment[:-4])
+        self.assertEqual(['moof'], [a.type for a in mp4file.refresh()])
+
+        self.write(fragment[-4:])
+        media = mp4file.refresh()
+        self.assertEqual(['mdat'], [a.type for a in media])
+        media[0].seek(0)
+        self.assertEqual('fragment 1', media[0].read())
+
+    def testWaitsForAtomsOfUnknownSize(self):
+        mp4file = Mp4File(self.path, follow=True)
+        self.write(pack('>L4s', 0, 'mdat') + 'still recording')
+        self.assertEqual([], mp4file.refresh())
+
+    def testWaitsForIncompleteLargeHeaders(self):
+        mp4file = Mp4File(self.path, follow=True)
+        media = 'large recording'
+        header = pack(ATOM_HEADER['large'], 1, 'mdat', 16 + len(media))
+        self.write(header[:8])
+        self.assertEqual([], mp4file.refresh())
+
+        self.write(header[8:] + media)
+        loaded = mp4file.refresh()
+        self.assertEqual(['mdat'], [a.type for a in loaded])
+        loaded[0].seek(0)
+        self.assertEqual(media, loaded[0].read())
+
+    def testRefreshReadsOnlyNewData(self):
+        mp4file = Mp4File(self.path, follow=True)
+        self.write(self.render_fragment(1))
+        bytes_read = atom.IO_COUNTERS['bytes']
+        mp4file.refresh()
+        self.assertTrue(atom.IO_COUNTERS['bytes'] - bytes_read \
+            <= len(self.render_fragment(1)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Command-line triage of MP4 files.
+
+    mp4tool.py [--stats] [--threads N] [--read-ahead BYTES] COMMAND ...
+
+Commands:
+    probe FILE                 summarise a file's layout and tracks
+    dump FILE                  list atoms (limit with --depth and --path)
+    extract FILE PATH          stream an atom's content to --output
+    faststart INPUT OUTPUT     copy INPUT with its moov before its media
+    interleave INPUT OUTPUT    copy INPUT with its tracks' media interleaved
+    repack INPUT OUTPUT        copy INPUT without free space, but --padding
+    tags FILE                  print iTunes tags (and save --cover)
+    diff FIRST SECOND          list atoms added, removed or modified
+    verify FILE                hash every chunk (on --processes processes)
+
+dump and extract read only atom headers, so neither loads a file's atom
+tree. --stats prints timings and I/O counters to standard error.
+--read-ahead reads headers in blocks of BYTES and advises the kernel of
+how files will be read, for scans of storage that isn't cached.
+faststart, interleave and repack write OUTPUT by way of OUTPUT.partial,
+and if interrupted, resume from the last checkpoint when run again.
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+import argparse
+from contextlib import contextmanager
+from multiprocessing import cpu_count
+import sys
+import time
+
+import atom
+import diff
+from atom import HeaderScanner, close_source, get_source_reader, \
+    walk_atom_headers
+from iopolicy import IOPolicy
+from mp4file import Mp4File
+import remux
+from rewrite import get_source_job, rewrite
+from sampletable import read_content
+import tags
+import verify
+
+class Stats(object):
+    """Timings of the steps of a command"""
+    def __init__(self):
+        self.timings = []
+
+    @contextmanager
+    def timer(self, step):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timings.append((step, time.time() - start))
+
+    def render(self):
+        lines = ['%-10s %.6fs' % timing for timing in self.timings]
+        lines.append('%-10s %d' % ('reads', atom.IO_COUNTERS['reads']))
+        lines.append('%-10s %d' % ('bytes', atom.IO_COUNTERS['bytes']))
+        return '\n'.join(lines) + '\n'
+
+
+def get_io_policy(args):
+    if args.read_ahead is None:
+        return None
+    return IOPolicy(args.read_ahead)
+
+def open_scan(args):
+    """Open args.file to scan its headers; return (stream, scanner)"""
+    stream = open(args.file, 'rb')
+    io_policy = get_io_policy(args)
+    # With a policy, read through the file so that advice applies
+    get_source_reader(stream, use_map=io_policy is None)
+    if io_policy is None:
+        return (stream, HeaderScanner(stream))
+    io_policy.start_scan(stream)
+    return (stream, HeaderScanner(stream, io_policy.read_ahead))
+
+def load(args, stats, file=None):
+    """Load args.file (or <file>), loading and decoding moov's children
+       on a thread per CPU
+    """
+    if file is None:
+        file = args.file
+    with stats.timer('parse'):
+        return Mp4File(file, threads=args.threads,
+                       io_policy=get_io_policy(args))
+
+def get_tag_name(type):
+    names = [name for (name, tag_type) in tags.TAG_NAMES.items() \
+        if tag_type == type]
+    if names:
+        return names[0]
+    return repr(type)
+
+def render_value(value):
+    if isinstance(value, tags.Image):
+        return '<%s image, %d bytes>' % (value.format, len(value.data))
+    elif isinstance(value, unicode):
+        return value.encode('utf-8')
+    elif isinstance(value, list):
+        return ', '.join([render_value(item) for item in value])
+    elif isinstance(value, str):
+        return repr(value)
+    return str(value)
+
+def probe(args, out, err, stats):
+    mp4file = load(args, stats)
+    out.write('file       %s\n' % mp4file.filename)
+    out.write('size       %d\n' % mp4file.size)
+
+    file_types = mp4file.get_children_of_type('ftyp')
+    if file_types:
+        content = read_content(file_types[0])
+        brands = [content[index:index + 4] \
+            for index in range(8, len(content) - 3, 4)]
+        out.write('brand      %s (%s)\n' % (content[:4], ' '.join(brands)))
+
+    root_types = [root.type for root in mp4file]
+    fast_start = 'moov' in root_types and ('mdat' not in root_types \
+        or root_types.index('moov') < root_types.index('mdat'))
+    out.write('faststart  %s\n' % (fast_start and 'yes' or 'no'))
+    for root in mp4file:
+        out.write('atom       %s at %d, %d bytes\n' % (root.type,
+            root.get_source_offset(), root.get_size()))
+
+    with stats.timer('tracks'):
+        for track in mp4file.get_tracks():
+            timescale = track.get_timescale()
+            out.write('track %-4d %s, %d samples, %.3fs\n' % (
+                track.get_track_id(), track.get_handler_type(),
+                track.get_sample_table().get_sample_count(),
+                float(track.get_duration()) / (timescale or 1)))
+    with stats.timer('validate'):
+        report = mp4file.validate()
+    out.write('problems   %d errors, %d warnings\n' % (
+        len(report.get_errors()), len(report.get_warnings())))
+    if not report.is_valid():
+        return 1
+    return 0
+
+def dump(args, out, err, stats):
+    with stats.timer('scan'):
+        (stream, scanner) = open_scan(args)
+        try:
+            for (path, type, offset, header_size, size) in \
+             walk_atom_headers(stream, args.depth, scanner):
+                if args.path and path != args.path \
+                 and not path.startswith(args.path + '/'):
+                    continue
+                out.write('%s%-4s %12d %12d  %s\n' % (
+                    '  ' * path.count('/'), repr(type)[1:-1], offset,
+                    header_size + size, path))
+        finally:
+            close_source(stream)
+    return 0
+
+def extract(args, out, err, stats):
+    if '-' == args.output:
+        output = out
+    else:
+        output = open(args.output, 'wb')
+    (stream, scanner) = open_scan(args)
+    try:
+        with stats.timer('scan'):
+            found = [(offset + header_size, size) for (path, type, offset, \
+                header_size, size) in walk_atom_headers(stream, \
+                args.path.count('/'), scanner) if path == args.path]
+        if not found:
+            err.write('%s has no atom at %s\n' % (args.file, args.path))
+            return 1
+
+        with stats.timer('copy'):
+            (offset, size) = found[0]
+            reader = get_source_reader(stream)
+            end = offset + size
+            while offset < end:
+                block = reader.read(offset, \
+                    min(remux.COPY_BLOCK_SIZE, end - offset))
+                if not block:
+                    break
+                output.write(block)
+                offset += len(block)
+            io_policy = get_io_policy(args)
+            if io_policy is not None:
+                io_policy.done_with(stream, found[0][0], size)
+    finally:
+        close_source(stream)
+        if output is not out:
+            output.close()
+    return 0
+
+def write_output(args, stats, operation, write):
+    """Call <write> with a stream for args.output, resuming where an
+       interrupted run of the same <operation> on args.file left off
+    """
+    job = get_source_job(operation, args.file)
+    with stats.timer('write'):
+        rewrite(args.output, write, job)
+
+def faststart(args, out, err, stats):
+    mp4file = load(args, stats)
+    write_output(args, stats, 'faststart',
+                 lambda output: remux.faststart(mp4file, output))
+    return 0
+
+def interleave(args, out, err, stats):
+    mp4file = load(args, stats)
+    write_output(args, stats, 'interleave %r' % args.duration,
+                 lambda output: remux.interleave(mp4file, output,
+                                                 args.duration))
+    return 0
+
+def repack(args, out, err, stats):
+    mp4file = load(args, stats)
+    write_output(args, stats, 'repack %d' % args.padding,
+                 lambda output: remux.repack(mp4file, output, args.padding))
+    return 0
+
+def print_tags(args, out, err, stats):
+    mp4file = load(args, stats)
+    with stats.timer('decode'):
+        for type in mp4file.tags:
+            out.write('%-14s %s\n' % (get_tag_name(type),
+                render_value(mp4file.tags[type])))
+    if args.cover:
+        if 'covr' not in mp4file.tags:
+            err.write('%s has no cover\n' % args.file)
+            return 1
+        output = open(args.cover, 'wb')
+        try:
+            with stats.timer('cover'):
+                tags.extract_cover(mp4file, output)
+        finally:
+            output.close()
+    return 0
+
+def print_diff(args, out, err, stats):
+    first = load(args, stats)
+    second = load(args, stats, args.second)
+    with stats.timer('diff'):
+        shallow_types = diff.SHALLOW_TYPES
+        if args.deep:
+            shallow_types = ()
+        report = diff.diff(first, second, shallow_types)
+    for difference in report:
+        out.write('%-9s %s\n' % (difference.change,
+                                 repr(difference.path)[1:-1]))
+    if not report.is_identical():
+        return 1
+    return 0
+
+def print_verify(args, out, err, stats):
+    mp4file = load(args, stats)
+    with stats.timer('verify'):
+        report = verify.verify(mp4file, args.processes)
+    out.write('chunks     %d\n' % len(report))
+    out.write('bytes      %d\n' % sum([result.size for result in report]))
+    if not report.is_valid():
+        out.write(str(report) + '\n')
+        return 1
+    return 0
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Inspect MP4 files.')
+    parser.add_argument('--stats', action='store_true',
+                        help='print timings and I/O counters to stderr')
+    parser.add_argument('--threads', type=int, default=cpu_count(),
+                        help='threads to load moov with (default: one per CPU)')
+    parser.add_argument('--read-ahead', type=int, metavar='BYTES',
+                        help='read headers ahead in blocks of BYTES, and '
+                             'advise the kernel how files will be read')
+    commands = parser.add_subparsers(dest='command')
+
+    command = commands.add_parser('probe', help="summarise a file")
+    command.add_argument('file')
+    command.set_defaults(run=probe)
+
+    command = commands.add_parser('dump', help="list a file's atoms")
+    command.add_argument('file')
+    command.add_argument('--depth', type=int, default=None,
+                         help='levels to list below the root atoms')
+    command.add_argument('--path',
+                         help='only list the atom at PATH and its descendants')
+    command.set_defaults(run=dump)
+
+    command = commands.add_parser('extract', help="copy an atom's content")
+    command.add_argument('file')
+    command.add_argument('path', help="the atom's path, eg. moov/udta")
+    command.add_argument('--output', '-o', default='-')
+    command.set_defaults(run=extract)
+
+    command = commands.add_parser('faststart',
+                                  help='move the moov before the media')
+    command.add_argument('file')
+    command.add_argument('output')
+    command.set_defaults(run=faststart)
+
+    command = commands.add_parser('interleave',
+                                  help="interleave the tracks' media")
+    command.add_argument('file')
+    command.add_argument('output')
+    command.add_argument('--duration', type=float,
+                         default=remux.INTERLEAVE_DURATION,
+                         help='seconds of each track per chunk')
+    command.set_defaults(run=interleave)
+
+    command = commands.add_parser('repack', help='drop free space')
+    command.add_argument('file')
+    command.add_argument('output')
+    command.add_argument('--padding', type=int, default=remux.REPACK_PADDING,
+                         help='bytes of free space to leave after the moov')
+    command.set_defaults(run=repack)
+
+    command = commands.add_parser('tags', help="print a file's tags")
+    command.add_argument('file')
+    command.add_argument('--cover', help='save the first cover image here')
+    command.set_defaults(run=print_tags)
+
+    command = commands.add_parser('diff', help='compare two files')
+    command.add_argument('file')
+    command.add_argument('second')
+    command.add_argument('--deep', action='store_true',
+                         help='compare media by content, not just size')
+    command.set_defaults(run=print_diff)
+
+    command = commands.add_parser('verify', help="check a file's media")
+    command.add_argument('file')
+    command.add_argument('--processes', type=int, default=cpu_count(),
+                         help='processes to hash with (default: one per CPU)')
+    command.set_defaults(run=print_verify)
+    return parser
+
+def main(argv=None, out=None, err=None):
+    """Run the command in <argv>, writing output to <out> and statistics
+       to <err>; return the exit status
+    """
+    if out is None:
+        out = sys.stdout
+    if err is None:
+        err = sys.stderr
+    args = get_parser().parse_args(argv)
+
+    stats = Stats()
+    with stats.timer('total'):
+        status = args.run(args, out, err, stats)
+    if args.stats:
+        err.write(stats.render())
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
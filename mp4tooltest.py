@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Unit tests for mp4tool.py
+
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+from mp4file import Mp4File
+import mp4tool
+from remuxtest import read_samples, render_movie
+import tags
+from tagstest import render_tagged_movie
+
+class RunCommands(unittest.TestCase):
+    tracks = [
+        [('v%d' % index, 40, 0 == index % 3) for index in range(6)],
+        [('a%d' % index, 30, True) for index in range(8)],
+    ]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'file.mp4')
+        open(self.path, 'wb').write(render_movie(self.tracks))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_command(self, *argv):
+        out = StringIO.StringIO()
+        err = StringIO.StringIO()
+        status = mp4tool.main(list(argv), out, err)
+        return (status, out.getvalue(), err.getvalue())
+
+    def testProbe(self):
+        (status, out, err) = self.run_command('probe', self.path)
+        self.assertEqual(0, status)
+        self.assertTrue('faststart  no\n' in out)
+        self.assertTrue('track 1    vide, 6 samples' in out)
+        self.assertTrue('track 2    soun, 8 samples' in out)
+        self.assertEqual('', err)
+
+    def testDumpLimitsDepth(self):
+        (status, out, err) = self.run_command('dump', self.path,
+                                              '--depth', '1')
+        paths = [line.split()[-1] for line in out.splitlines()]
+        self.assertEqual(['ftyp', 'mdat', 'moov', 'moov/mvhd',
+                          'moov/trak[1]', 'moov/trak[2]'], paths)
+
+    def testDumpFiltersByPath(self):
+        (status, out, err) = self.run_command('dump', self.path,
+                                              '--path', 'moov/trak[2]/mdia')
+        paths = [line.split()[-1] for line in out.splitlines()]
+        self.assertEqual('moov/trak[2]/mdia', paths[0])
+        self.assertTrue('moov/trak[2]/mdia/minf/stbl/stsz' in paths)
+        self.assertEqual([], [path for path in paths \
+            if not path.startswith('moov/trak[2]/mdia')])
+
+    def testExtract(self):
+        (status, out, err) = self.run_command('extract', self.path, 'mdat')
+        mdat = Mp4File(self.path).get_children_of_type('mdat')[0]
+        mdat.seek(0)
+        self.assertEqual(mdat.read(), out)
+
+    def testExtractMissingAtomFails(self):
+        (status, out, err) = self.run_command('extract', self.path, 'udta')
+        self.assertEqual(1, status)
+
+    def testFastStart(self):
+        output_path = os.path.join(self.directory, 'output.mp4')
+        (status, out, err) = self.run_command('--threads', '2', 'faststart',
+                                              self.path, output_path)
+        output = Mp4File(output_path)
+        self.assertEqual(['ftyp', 'moov', 'mdat'], [a.type for a in output])
+        self.assertEqual(self.tracks, read_samples(output))
+        self.assertFalse(os.path.exists(output_path + '.partial'))
+        self.assertFalse(os.path.exists(output_path + '.journal'))
+
+    def testInterleave(self):
+        output_path = os.path.join(self.directory, 'output.mp4')
+        (status, out, err) = self.run_command('interleave', self.path,
+                                              output_path, '--duration', '0.1')
+        self.assertEqual(0, status)
+        self.assertEqual(self.tracks, read_samples(Mp4File(output_path)))
+
+    def testRepack(self):
+        output_path = os.path.join(self.directory, 'output.mp4')
+        (status, out, err) = self.run_command('repack', self.path,
+                                              output_path, '--padding', '64')
+        output = Mp4File(output_path)
+        self.assertEqual(['ftyp', 'moov', 'free', 'mdat'],
+                         [a.type for a in output])
+        self.assertEqual(self.tracks, read_samples(output))
+
+    def testTags(self):
+        path = os.path.join(self.directory, 'file.m4a')
+        open(path, 'wb').write(render_tagged_movie([
+            ('\xa9nam', [(tags.UTF8, 'Title')]),
+            ('covr', [(tags.PNG, '\x89PNG')])]))
+        cover_path = os.path.join(self.directory, 'cover.png')
+        (status, out, err) = self.run_command('tags', path,
+                                              '--cover', cover_path)
+        self.assertEqual('title          Title\n'
+                         'cover          <png image, 4 bytes>\n', out)
+        self.assertEqual('\x89PNG', open(cover_path, 'rb').read())
+
+    def testTagsWithoutCoverFails(self):
+        path = os.path.join(self.directory, 'file.m4a')
+        open(path, 'wb').write(render_tagged_movie([
+            ('\xa9nam', [(tags.UTF8, 'Title')])]))
+        cover_path = os.path.join(self.directory, 'cover.png')
+        (status, out, err) = self.run_command('tags', path,
+                                              '--cover', cover_path)
+        self.assertEqual(1, status)
+        self.assertEqual('%s has no cover\n' % path, err)
+        self.assertFalse(os.path.exists(cover_path))
+
+    def testDiff(self):
+        other_path = os.path.join(self.directory, 'other.mp4')
+        open(other_path, 'wb').write(render_movie(self.tracks[:1]))
+        (status, out, err) = self.run_command('diff', self.path, other_path)
+        self.assertEqual(1, status)
+        self.assertTrue('removed   moov/trak[2]\n' in out)
+        (status, out, err) = self.run_command('diff', self.path, self.path)
+        self.assertEqual((0, ''), (status, out))
+
+    def testVerify(self):
+        (status, out, err) = self.run_command('verify', self.path,
+                                              '--processes', '2')
+        self.assertEqual(0, status)
+        self.assertTrue('chunks     ' in out)
+
+    def testReadAhead(self):
+        (status, out, err) = self.run_command('dump', self.path)
+        self.assertEqual((0, out), self.run_command('--read-ahead', '16',
+                                                    'dump', self.path)[:2])
+        (status, out, err) = self.run_command('--read-ahead', '16', 'probe',
+                                              self.path)
+        self.assertEqual(0, status)
+
+    def testStats(self):
+        (status, out, err) = self.run_command('--stats', 'dump', self.path)
+        steps = [line.split()[0] for line in err.splitlines()]
+        self.assertEqual(['scan', 'total', 'reads', 'bytes'], steps)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Streaming creation of MP4 files from samples.
+
+Samples are written straight into mdat as they arrive, while their
+sizes, durations and chunk offsets are gathered in typed arrays (and
+durations, composition offsets and chunk layouts run-length encoded as
+they go). The moov is built from those tables when the file is closed.
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+from array import array
+from struct import pack
+import StringIO
+
+from atom import ATOM_HEADER, Atom, render_atom_header
+from sampletable import INT32, UINT32, UINT64, make_sample_table_atoms
+from track import HEADER_DURATION_FIELD, HEADER_FIELDS
+
+IDENTITY_MATRIX = pack('>9L', 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+MEDIA_HEADER_TYPES = {
+    'vide': ('vmhd', pack('>B3sH6x', 0, '\0\0\1', 0)),
+    'soun': ('smhd', pack('>4x4x')),
+}
+
+def render_full_atom(type, content, version=0, flags=0):
+    return render_atom_header(type, 4 + len(content)) \
+        + pack('>B', version) + pack('>L', flags)[1:] + content
+
+def render_header_atom(type, fields, rest, flags=0):
+    """Render an mvhd, mdhd or tkhd whose leading <fields> are followed by
+       <rest>, as a version 1 header if its duration doesn't fit in 32 bits
+    """
+    version = 0
+    if 2**32 <= fields[HEADER_DURATION_FIELD[type]]:
+        version = 1
+    return render_full_atom(type, pack(HEADER_FIELDS[type][version], *fields) \
+        + rest, version, flags)
+
+def pack_language(language):
+    """Pack a 3-letter ISO 639-2 <language> code as mdhd stores it"""
+    packed = 0
+    for letter in language:
+        packed = (packed << 5) | (ord(letter) - 0x60)
+    return packed
+
+def load_atom(rendered):
+    stream = StringIO.StringIO(rendered)
+    return Atom(stream)
+
+
+class TrackWriter(object):
+    """The sample tables of one track being written by an Mp4Writer"""
+    def __init__(self, track_id, handler_type, timescale, description,
+                 width=0, height=0, language='und', name=''):
+        self.track_id = track_id
+        self.handler_type = handler_type
+        self.timescale = timescale
+        self.description = description
+        self.width = width
+        self.height = height
+        self.language = language
+        self.name = name
+
+        self.sample_sizes = array(UINT32)
+        self.sync_samples = array(UINT32)
+        self.has_non_sync_samples = False
+        self.chunk_offsets = array(UINT64)
+        self.duration = 0
+        # Run-length encoded as samples arrive
+        self.duration_counts = array(UINT32)
+        self.durations = array(UINT32)
+        self.composition_counts = array(UINT32)
+        self.composition_offsets = array(INT32)
+        self.first_chunks = array(UINT32)
+        self.samples_per_chunk = array(UINT32)
+        self.chunk_sample_count = 0
+
+    def add_run(self, counts, values, value):
+        if 0 < len(values) and values[-1] == value:
+            counts[-1] += 1
+        else:
+            counts.append(1)
+            values.append(value)
+
+    def start_chunk(self, offset):
+        self.end_chunk()
+        self.chunk_offsets.append(offset)
+
+    def end_chunk(self):
+        if 0 == self.chunk_sample_count:
+            return
+        if 0 == len(self.samples_per_chunk) \
+         or self.samples_per_chunk[-1] != self.chunk_sample_count:
+            self.first_chunks.append(len(self.chunk_offsets))
+            self.samples_per_chunk.append(self.chunk_sample_count)
+        self.chunk_sample_count = 0
+
+    def add_sample(self, size, duration, sync, composition_offset):
+        self.sample_sizes.append(size)
+        self.chunk_sample_count += 1
+        self.duration += duration
+        self.add_run(self.duration_counts, self.durations, duration)
+        self.add_run(self.composition_counts, self.composition_offsets,
+                     composition_offset)
+        if sync:
+            self.sync_samples.append(len(self.sample_sizes))
+        else:
+            self.has_non_sync_samples = True
+
+    def render_sample_table(self):
+        self.end_chunk()
+        stsd = render_atom_header('stsd', 8 + len(self.description)) \
+            + pack('>4xL', 1) + self.description
+        sync_samples = None
+        if self.has_non_sync_samples:
+            sync_samples = self.sync_samples
+        children = [load_atom(stsd)] + make_sample_table_atoms( \
+            self.sample_sizes, (self.duration_counts, self.durations),
+            (self.first_chunks, self.samples_per_chunk,
+             array(UINT32, [1]) * len(self.first_chunks)),
+            self.chunk_offsets,
+            (self.composition_counts, self.composition_offsets),
+            sync_samples)
+
+        stbl = Atom(type='stbl')
+        stbl[0:] = children
+        return stbl
+
+    def render_track(self, movie_timescale):
+        movie_duration = self.duration * movie_timescale // self.timescale
+        volume = 'soun' == self.handler_type and 0x100 or 0
+        tkhd = render_header_atom('tkhd', \
+            (0, 0, self.track_id, 0, movie_duration), \
+            pack('>8xhhH2x36sLL', 0, 0, volume, IDENTITY_MATRIX, \
+            self.width << 16, self.height << 16), flags=3)
+        mdhd = render_header_atom('mdhd', \
+            (0, 0, self.timescale, self.duration), \
+            pack('>HH', pack_language(self.language), 0))
+        hdlr = render_full_atom('hdlr', pack('>L4s12x', 0, \
+            self.handler_type) + self.name + '\0')
+
+        if self.handler_type in MEDIA_HEADER_TYPES:
+            (type, content) = MEDIA_HEADER_TYPES[self.handler_type]
+            media_header = render_atom_header(type, len(content)) + content
+        else:
+            media_header = render_full_atom('nmhd', '')
+        url = render_full_atom('url ', '', flags=1)
+        dinf = render_atom_header('dinf', 16 + len(url)) \
+            + render_full_atom('dref', pack('>L', 1) + url)
+
+        minf = load_atom(render_atom_header('minf', \
+            len(media_header + dinf)) + media_header + dinf)
+        minf.append(self.render_sample_table())
+        mdia = load_atom(render_atom_header('mdia', len(mdhd + hdlr)) \
+            + mdhd + hdlr)
+        mdia.append(minf)
+        trak = load_atom(render_atom_header('trak', len(tkhd)) + tkhd)
+        trak.append(mdia)
+        return trak
+
+
+class Mp4Writer(object):
+    """Write an MP4 file to a seekable <stream>, one sample at a time.
+
+    Add tracks with add_track(), write their samples with write_sample()
+    in decode order (interleaving tracks as they arrive), then close()
+    to write the moov. Consecutive samples of the same track are stored
+    together as one chunk, up to <chunk_size> bytes.
+    """
+    def __init__(self, stream, brands=('isom', 'iso2', 'mp41'),
+                 timescale=1000, chunk_size=1024 * 1024):
+        self.stream = stream
+        self.timescale = timescale
+        self.chunk_size = chunk_size
+        self.tracks = []
+        self.__current_track = None
+        self.__current_chunk_size = 0
+
+        ftyp = pack('>4sL', brands[0], 0) + ''.join(brands)
+        self.stream.write(render_atom_header('ftyp', len(ftyp)) + ftyp)
+
+        # Always use a large header, as mdat's size isn't known yet
+        self.__mdat_offset = self.stream.tell()
+        self.stream.write(pack(ATOM_HEADER['large'], 1, 'mdat', 0))
+        self.__position = self.stream.tell()
+
+    def add_track(self, handler_type, timescale, description, **kwargs):
+        """Add a track of media with <handler_type> (eg. 'vide' or
+           'soun'), timed in units of <timescale> per second, and described
+           by <description>, a rendered sample entry (eg. an avc1 or mp4a
+           atom); return its TrackWriter.
+
+           Keyword arguments set the track's width, height, language and
+           name.
+        """
+        if not isinstance(description, str):
+            rendered = StringIO.StringIO()
+            description.save(rendered)
+            description = rendered.getvalue()
+
+        track = TrackWriter(len(self.tracks) + 1, handler_type, timescale,
+                            description, **kwargs)
+        self.tracks.append(track)
+        return track
+
+    def write_sample(self, track, data, duration, sync=True,
+                     composition_offset=0):
+        """Append a sample of <data> to <track>, lasting <duration> units
+           of the track's timescale
+        """
+        if track is not self.__current_track \
+         or self.chunk_size <= self.__current_chunk_size:
+            track.start_chunk(self.__position)
+            self.__current_track = track
+            self.__current_chunk_size = 0
+
+        self.stream.write(data)
+        self.__position += len(data)
+        self.__current_chunk_size += len(data)
+        track.add_sample(len(data), duration, sync, composition_offset)
+
+    def close(self):
+        """Fill in mdat's size and write the moov"""
+        self.stream.seek(self.__mdat_offset)
+        self.stream.write(pack(ATOM_HEADER['large'], 1, 'mdat', \
+            self.__position - self.__mdat_offset))
+        self.stream.seek(self.__position)
+
+        duration = max([0] + [track.duration * self.timescale // track.timescale \
+            for track in self.tracks])
+        mvhd = render_header_atom('mvhd', (0, 0, self.timescale, duration), \
+            pack('>LH10x36s24xL', 0x10000, 0x100, IDENTITY_MATRIX, \
+            len(self.tracks) + 1))
+
+        moov = load_atom(render_atom_header('moov', len(mvhd)) + mvhd)
+        for track in self.tracks:
+            moov.append(track.render_track(self.timescale))
+        moov.save(self.stream)
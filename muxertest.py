@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Unit tests for muxer.py
+
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import atom
+from mp4file import Mp4File
+import muxer
+from remuxtest import read_samples
+from track import get_header_duration
+
+VIDEO_DESCRIPTION = atom.render_atom_header('avc1', 8) + 'x' * 8
+AUDIO_DESCRIPTION = atom.render_atom_header('mp4a', 28) + '\0' * 28
+
+def write_movie(path, tracks, **kwargs):
+    """Write a movie of video and audio tracks, each a list of
+       (data, duration, sync) samples, interleaving one sample of each
+       track at a time
+    """
+    stream = open(path, 'wb')
+    writer = muxer.Mp4Writer(stream, **kwargs)
+    track_writers = [writer.add_track('vide', 1000, VIDEO_DESCRIPTION,
+                                      width=320, height=240),
+                     writer.add_track('soun', 1000, AUDIO_DESCRIPTION)]
+    for index in range(max([len(samples) for samples in tracks])):
+        for (track_writer, samples) in zip(track_writers, tracks):
+            if index < len(samples):
+                (data, duration, sync) = samples[index]
+                writer.write_sample(track_writer, data, duration, sync)
+    writer.close()
+    stream.close()
+
+
+class WriteMovie(unittest.TestCase):
+    tracks = [
+        [('v1a', 40, True), ('v1bb', 40, False), ('v1c', 40, True)],
+        [('a1a', 20, True), ('a1bb', 20, True)],
+    ]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'file.mp4')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testWrittenFileIsValid(self):
+        write_movie(self.path, self.tracks)
+        self.assertEqual([], Mp4File(self.path).validate())
+
+    def testSamplesCanBeReadBack(self):
+        write_movie(self.path, self.tracks)
+        self.assertEqual(self.tracks, read_samples(Mp4File(self.path)))
+
+    def testLargeChunksAreSplit(self):
+        tracks = [[('v%d' % index, 40, True) for index in range(4)], []]
+        write_movie(self.path, tracks, chunk_size=4)
+        mp4file = Mp4File(self.path)
+
+        table = mp4file.get_tracks()[0].get_sample_table()
+        self.assertEqual([2, 2], list(table.get_samples_per_chunk()))
+        self.assertEqual(tracks[:1], read_samples(mp4file)[:1])
+
+    def testDurationsAreRunLengthEncoded(self):
+        write_movie(self.path, self.tracks)
+        table = Mp4File(self.path).get_tracks()[0].get_sample_table()
+        self.assertEqual(([3], [40]),
+            tuple([list(column) for column in table.get_time_to_sample()]))
+
+    def testTablesAreOmittedWhenUnneeded(self):
+        write_movie(self.path, self.tracks)
+        (video, audio) = Mp4File(self.path).get_tracks()
+
+        self.assertEqual([1, 3],
+            list(video.get_sample_table().get_sync_samples()))
+        self.assertEqual(None, audio.get_sample_table().get_sync_samples())
+        self.assertEqual(None,
+            video.get_sample_table().get_composition_offsets())
+
+    def testTrackHeadersAreWritten(self):
+        write_movie(self.path, self.tracks)
+        (video, audio) = Mp4File(self.path).get_tracks()
+
+        self.assertEqual(['vide', 'soun'],
+            [video.get_handler_type(), audio.get_handler_type()])
+        self.assertEqual([120, 40], [video.get_duration(), audio.get_duration()])
+        self.assertEqual([1, 2], [video.get_track_id(), audio.get_track_id()])
+
+    def testLongDurationsUseLargeHeaders(self):
+        long_tracks = [[('v1a', 2000000000, True), ('v1b', 2000000000, True),
+                        ('v1c', 2000000000, True)], []]
+        write_movie(self.path, long_tracks)
+        mp4file = Mp4File(self.path)
+        (video, audio) = mp4file.get_tracks()
+
+        self.assertEqual(6000000000, video.get_duration())
+        self.assertEqual(6000000000,
+            get_header_duration(video.get_track_header()))
+        self.assertEqual(6000000000, get_header_duration(
+            mp4file.get_movie().get_children_of_type('mvhd')[0]))
+        self.assertEqual([long_tracks[0]], read_samples(mp4file)[:1])
+
+
+if __name__ == "__main__":
+    unittest.main()
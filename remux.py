@@ -0,0 +1,511 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Operations that write new MP4 files from the atoms of existing ones.
+
+Media data is always streamed between files in fixed-size blocks, so
+memory use depends on the size of the sample tables rather than the
+size of the media.
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import repeat
+from operator import add
+import StringIO
+from struct import calcsize
+
+from atom import ATOM_HEADER, Atom, render_atom_header, render_free, \
+    skip_written
+from sampletable import UINT32, UINT64, compact_sample_to_chunk, \
+    make_data_atom, make_sample_table_atoms, render_chunk_offsets, \
+    render_stsc
+from track import Track, get_movie_timescale, set_header_duration
+
+COPY_BLOCK_SIZE = 1024 * 1024
+# Default length of the chunks interleave() makes, in seconds
+INTERLEAVE_DURATION = 0.5
+# Default size of the free atom repack() leaves after the moov
+REPACK_PADDING = 4 * 1024
+FREE_TYPES = ('free', 'skip')
+
+def copy_atom_content(atom, stream, block_size=COPY_BLOCK_SIZE):
+    """Stream the content of a data <atom> to <stream> in blocks of
+       <block_size> bytes; return the number of bytes copied (counting any
+       that <stream> already held, which are skipped rather than read).
+    """
+    copied = skip_written(stream, atom.get_content_size())
+    atom.seek(copied)
+    block = atom.read(block_size)
+    while block:
+        stream.write(block)
+        copied += len(block)
+        block = atom.read(block_size)
+    return copied
+
+def copy_range(reader, offset, size, stream, block_size=COPY_BLOCK_SIZE):
+    """Stream <size> bytes from <offset> of <reader> (a SourceReader) to
+       <stream> in blocks of <block_size> bytes
+    """
+    end = offset + size
+    offset += skip_written(stream, size)
+    while offset < end:
+        block = reader.read(offset, min(block_size, end - offset))
+        if not block:
+            raise IOError, 'Media ends %d bytes early' % (end - offset)
+        stream.write(block)
+        offset += len(block)
+
+def copy_atom(atom):
+    """Make an independent copy of a (small) <atom> tree"""
+    rendered = StringIO.StringIO()
+    atom.save(rendered)
+    rendered.seek(0)
+    return Atom(rendered)
+
+def render_atom(atom):
+    rendered = StringIO.StringIO()
+    atom.save(rendered)
+    return rendered.getvalue()
+
+
+# Concatenation
+
+def check_concatenation(mp4files):
+    """Check that <mp4files> hold the same tracks with identical sample
+       descriptions, raising ValueError if they don't; return the tracks
+       of each file.
+    """
+    if 0 == len(mp4files):
+        raise ValueError, 'At least one Mp4File is required'
+
+    file_tracks = [mp4file.get_tracks() for mp4file in mp4files]
+    first_tracks = file_tracks[0]
+    if 0 == len(first_tracks):
+        raise ValueError, '%s has no tracks' % mp4files[0].filename
+
+    first_descriptions = [render_atom(track.get_sample_table() \
+        .get_sample_description()) for track in first_tracks]
+    for (mp4file, tracks) in zip(mp4files[1:], file_tracks[1:]):
+        if len(tracks) != len(first_tracks):
+            raise ValueError, '%s has %d tracks, expected %d' \
+                % (mp4file.filename, len(tracks), len(first_tracks))
+
+        for (index, track) in enumerate(tracks):
+            first_track = first_tracks[index]
+            if track.get_handler_type() != first_track.get_handler_type():
+                raise ValueError, 'Track %d of %s has a different handler' \
+                    % (index + 1, mp4file.filename)
+            if track.get_timescale() != first_track.get_timescale():
+                raise ValueError, 'Track %d of %s has a different timescale' \
+                    % (index + 1, mp4file.filename)
+            description = track.get_sample_table().get_sample_description()
+            if render_atom(description) != first_descriptions[index]:
+                raise ValueError, \
+                    'Track %d of %s has different sample descriptions' \
+                    % (index + 1, mp4file.filename)
+
+    return file_tracks
+
+def concatenate_sample_tables(tables, table_chunk_offsets):
+    """Build the stbl children for the concatenation of sample <tables>,
+       using each table's entry in <table_chunk_offsets> (its chunk offsets
+       as relocated into the output) in place of its own chunk offsets
+    """
+    stts_counts = array(UINT32)
+    stts_deltas = array(UINT32)
+    ctts_counts = array(UINT32)
+    ctts_offsets = []
+    first_chunks = array(UINT32)
+    samples_per_chunk = array(UINT32)
+    description_indices = array(UINT32)
+    sizes = array(UINT32)
+    sync_samples = array(UINT32)
+    chunk_offsets = None
+
+    has_composition_offsets = 0 < len([table for table in tables \
+        if table.get_composition_offsets() is not None])
+    has_sync_samples = 0 < len([table for table in tables \
+        if table.get_sync_samples() is not None])
+
+    for (table, offsets) in zip(tables, table_chunk_offsets):
+        sample_count = len(sizes)
+        chunk_count = chunk_offsets is not None and len(chunk_offsets) or 0
+
+        (counts, deltas) = table.get_time_to_sample()
+        stts_counts.extend(counts)
+        stts_deltas.extend(deltas)
+
+        if has_composition_offsets:
+            composition_offsets = table.get_composition_offsets()
+            if composition_offsets is None:
+                composition_offsets = ([table.get_sample_count()], [0])
+            ctts_counts.extend(array(UINT32, composition_offsets[0]))
+            ctts_offsets.extend(composition_offsets[1])
+
+        (firsts, counts, indices) = table.get_sample_to_chunk()
+        first_chunks.extend(array(UINT32, \
+            [first + chunk_count for first in firsts]))
+        samples_per_chunk.extend(counts)
+        description_indices.extend(indices)
+
+        if has_sync_samples:
+            syncs = table.get_sync_samples()
+            if syncs is None:
+                syncs = xrange(1, table.get_sample_count() + 1)
+            sync_samples.extend(array(UINT32, \
+                [sample + sample_count for sample in syncs]))
+
+        sizes.extend(table.get_sample_sizes())
+
+        if chunk_offsets is None:
+            chunk_offsets = array(offsets.typecode, offsets)
+        else:
+            chunk_offsets.extend(offsets)
+
+    composition_offsets = None
+    if has_composition_offsets:
+        composition_offsets = (ctts_counts, ctts_offsets)
+    if not has_sync_samples:
+        sync_samples = None
+    children = make_sample_table_atoms(sizes, (stts_counts, stts_deltas),
+        (first_chunks, samples_per_chunk, description_indices),
+        chunk_offsets, composition_offsets, sync_samples)
+    return (children, sum([count * delta for (count, delta) \
+        in zip(stts_counts, stts_deltas)]))
+
+def concatenate(mp4files, stream, block_size=COPY_BLOCK_SIZE):
+    """Write the concatenation of <mp4files> to <stream>.
+
+    Every file must hold the same tracks, in the same order, with the
+    same sample descriptions (as is the case for consecutive recordings
+    from one encoder). The output holds the first file's ftyp, a single
+    mdat holding every file's media back to back, then a moov whose
+    sample tables are the inputs' tables appended with their chunk
+    offsets and sample numbers rebased. Edit lists are dropped, as they
+    describe only the first file's presentation.
+
+    The media is copied in one sequential pass over the inputs, in
+    blocks of <block_size> bytes, so memory use is proportional to the
+    size of the sample tables rather than the media.
+    """
+    file_tracks = check_concatenation(mp4files)
+
+    written = 0
+    file_types = mp4files[0].get_children_of_type('ftyp')
+    if 0 < len(file_types):
+        rendered_file_type = render_atom(file_types[0])
+        stream.write(rendered_file_type)
+        written += len(rendered_file_type)
+
+    media_atoms = [mp4file.get_children_of_type('mdat') \
+        for mp4file in mp4files]
+    media_size = sum([mdat.get_content_size() \
+        for mdats in media_atoms for mdat in mdats])
+    media_header = render_atom_header('mdat', media_size)
+    stream.write(media_header)
+    written += len(media_header)
+
+    # Find where each input mdat's content lands in the output, so chunk
+    # offsets into it can be moved along with it
+    file_extents = []
+    for (mp4file, mdats) in zip(mp4files, media_atoms):
+        extents = []
+        for mdat in mdats:
+            start = mdat.get_content_offset()
+            extents.append((start, start + mdat.get_content_size(), written))
+            written += copy_atom_content(mdat, stream, block_size)
+            mp4file.release(mdat)
+        file_extents.append(sorted(extents))
+
+    movie = copy_atom(mp4files[0].get_movie())
+    movie_timescale = get_movie_timescale(movie)
+    movie_duration = 0
+    for (index, trak) in enumerate(movie.get_children_of_type('trak')):
+        tables = []
+        table_chunk_offsets = []
+        for (tracks, extents) in zip(file_tracks, file_extents):
+            table = tracks[index].get_sample_table()
+            # A track's chunks may be spread over several mdats
+            table_chunk_offsets.append(relocate_chunk_offsets( \
+                table.get_chunk_offsets(), extents))
+            tables.append(table)
+
+        (children, media_duration) = \
+            concatenate_sample_tables(tables, table_chunk_offsets)
+        stbl = Track(trak).get_sample_table_atom()
+        stbl[0:] = stbl.get_children_of_type('stsd') + children
+
+        trak[0:] = [child for child in trak if 'edts' != child.type]
+        mdia = trak.get_children_of_type('mdia')[0]
+        set_header_duration(mdia.get_children_of_type('mdhd')[0], \
+            media_duration)
+        timescale = file_tracks[0][index].get_timescale()
+        track_duration = media_duration * movie_timescale // timescale
+        set_header_duration(trak.get_children_of_type('tkhd')[0], \
+            track_duration)
+        movie_duration = max(movie_duration, track_duration)
+
+    set_header_duration(movie.get_children_of_type('mvhd')[0], movie_duration)
+    movie.save(stream)
+
+
+
+# Fast start
+
+def relocate_chunk_offsets(offsets, extents):
+    """Move each of <offsets> along with the media it points into, given
+       <extents>, a sorted list of (old start, old end, new start) of each
+       mdat's content
+    """
+    starts = [start for (start, end, new_start) in extents]
+    relocated = array(offsets.typecode)
+    for offset in offsets:
+        index = bisect_right(starts, offset) - 1
+        if 0 <= index and offset < extents[index][1]:
+            (start, end, new_start) = extents[index]
+            offset += new_start - start
+        relocated.append(offset)
+    return relocated
+
+def split_root_atoms(mp4file):
+    """Split the root atoms of <mp4file>, apart from its moov and any free
+       space, into those before its first mdat and those from it on
+    """
+    movie = mp4file.get_movie()
+    atoms = [atom for atom in mp4file if atom is not movie \
+        and atom.type not in FREE_TYPES]
+    first_media = len(atoms)
+    media_types = [atom.type for atom in atoms]
+    if 'mdat' in media_types:
+        first_media = media_types.index('mdat')
+    return (atoms[:first_media], atoms[first_media:])
+
+def write_movie_first(mp4file, movie, stream, padding=0,
+                      block_size=COPY_BLOCK_SIZE):
+    """Write <mp4file> to <stream> with <movie> (a copy of its moov) before
+       its media, followed by a free atom of <padding> bytes if any, moving
+       chunk offsets along with the media
+    """
+    (leading, trailing) = split_root_atoms(mp4file)
+    traks = movie.get_children_of_type('trak')
+    tracks = mp4file.get_tracks()
+    leading_size = sum([atom.get_size() for atom in leading])
+
+    # Chunk offsets depend on the size of the moov, which depends on
+    # whether they need 64 bits, so repeat until the size settles
+    movie_size = movie.get_size()
+    while True:
+        extents = []
+        position = leading_size + movie_size + padding
+        for atom in trailing:
+            if 'mdat' == atom.type and atom.get_content_offset() is not None:
+                extents.append((atom.get_content_offset(),
+                    atom.get_content_offset() + atom.get_source_size(),
+                    position + atom.get_size() - atom.get_content_size()))
+            position += atom.get_size()
+        extents.sort()
+
+        for (trak, track) in zip(traks, tracks):
+            offsets = relocate_chunk_offsets( \
+                track.get_sample_table().get_chunk_offsets(), extents)
+            stbl = Track(trak).get_sample_table_atom()
+            for (index, child) in enumerate(stbl):
+                if child.type in ('stco', 'co64'):
+                    stbl[index] = \
+                        make_data_atom(*render_chunk_offsets(offsets))
+        if movie.get_size() == movie_size:
+            break
+        movie_size = movie.get_size()
+
+    for atom in leading:
+        atom.save(stream)
+    movie.save(stream)
+    if padding:
+        stream.write(render_free(padding))
+    for atom in trailing:
+        if atom.is_container():
+            atom.save(stream)
+        else:
+            stream.write(render_atom_header(atom.type, atom.get_content_size()))
+            copy_atom_content(atom, stream, block_size)
+            mp4file.release(atom)
+
+def faststart(mp4file, stream, block_size=COPY_BLOCK_SIZE):
+    """Write a copy of <mp4file> to <stream> with its moov before its
+    media, so that players can start before the whole file has arrived.
+
+    Root atoms before the first mdat (such as ftyp) stay in front of the
+    moov, and root free atoms are dropped. Chunk offsets are moved along
+    with the media, which is streamed across unchanged in blocks of
+    <block_size> bytes.
+    """
+    movie = mp4file.get_movie()
+    if movie is None:
+        raise ValueError, '%s has no moov' % mp4file.filename
+    write_movie_first(mp4file, copy_atom(movie), stream,
+                      block_size=block_size)
+
+
+# Repacking
+
+def remove_free_atoms(atoms):
+    """Remove free and skip atoms from within the containers <atoms>"""
+    for atom in atoms:
+        if atom.is_container():
+            if [child for child in atom if child.type in FREE_TYPES]:
+                atom[0:] = [child for child in atom \
+                    if child.type not in FREE_TYPES]
+            remove_free_atoms(atom)
+
+def repack(mp4file, stream, padding=REPACK_PADDING,
+           block_size=COPY_BLOCK_SIZE):
+    """Write a compacted copy of <mp4file> to <stream>.
+
+    Every free and skip atom at the root or within the moov is dropped,
+    and a single free atom of <padding> bytes (none if 0) is reserved
+    straight after the moov, which goes before the media as with
+    faststart(). Later edits that grow the moov by up to <padding> bytes
+    can then take in the free atom rather than moving the media. The file
+    is written in one pass, streaming the media in blocks of <block_size>
+    bytes.
+    """
+    movie = mp4file.get_movie()
+    if movie is None:
+        raise ValueError, '%s has no moov' % mp4file.filename
+    if 0 < padding < calcsize(ATOM_HEADER['basic']):
+        raise ValueError, 'Padding must be 0 or at least %d bytes' \
+            % calcsize(ATOM_HEADER['basic'])
+    movie = copy_atom(movie)
+    remove_free_atoms([movie])
+    write_movie_first(mp4file, movie, stream, padding, block_size)
+
+
+# Interleaving
+
+def plan_chunks(track, duration):
+    """Split <track>'s samples into chunks, each starting at the first
+       sample decoded in a new span of <duration> seconds (or at a change
+       of sample description); return (start time in seconds, first
+       sample, last sample, sample description index) for each chunk,
+       where <last sample> is excluded from it
+    """
+    table = track.get_sample_table()
+    decode_times = table.get_decode_times()
+    sample_count = table.get_sample_count()
+    timescale = track.get_timescale()
+    span = duration * timescale
+
+    # Chunks can't mix sample descriptions, so start one at each change
+    descriptions = {0: 1}
+    chunk_first_samples = table.get_chunk_first_samples()
+    (first_chunks, samples_per_chunk, description_indices) = \
+        table.get_sample_to_chunk()
+    for (first_chunk, index) in zip(first_chunks, description_indices):
+        if first_chunk <= len(chunk_first_samples):
+            descriptions[chunk_first_samples[first_chunk - 1]] = index
+
+    boundaries = set(descriptions)
+    sample = 0
+    while sample < sample_count:
+        boundaries.add(sample)
+        # Skip spans in which no sample is decoded
+        end = (decode_times[sample] // span + 1) * span
+        sample = max(sample + 1, bisect_left(decode_times, end, sample))
+    boundaries = sorted([boundary for boundary in boundaries \
+        if boundary < sample_count]) + [sample_count]
+
+    chunks = []
+    description = 1
+    for (first, last) in zip(boundaries[:-1], boundaries[1:]):
+        description = descriptions.get(first, description)
+        chunks.append((float(decode_times[first]) / timescale, first, last,
+                       description))
+    return chunks
+
+def render_planned_stsc(chunks):
+    """Render sample-to-chunk content for planned <chunks>"""
+    return render_stsc(*compact_sample_to_chunk(xrange(1, len(chunks) + 1),
+        [last - first for (start, first, last, description) in chunks],
+        [description for (start, first, last, description) in chunks]))
+
+def interleave(mp4file, stream, duration=INTERLEAVE_DURATION,
+               block_size=COPY_BLOCK_SIZE):
+    """Write a copy of <mp4file> to <stream> with its media interleaved,
+    so that players reading it progressively don't have to seek.
+
+    Each track's samples are regrouped into chunks of about <duration>
+    seconds of decode time, and the chunks of every track are written in
+    order of decode time into a single mdat, after the moov. Sample
+    tables other than stsc and stco/co64 are unchanged. Each chunk's
+    samples are copied in blocks of <block_size> bytes, from as few runs
+    of the source file as they're stored in.
+    """
+    movie = mp4file.get_movie()
+    if movie is None:
+        raise ValueError, '%s has no moov' % mp4file.filename
+    if duration <= 0:
+        raise ValueError, 'Chunks must be longer than 0 seconds'
+    (leading, trailing) = split_root_atoms(mp4file)
+    trailing = [atom for atom in trailing if 'mdat' != atom.type]
+
+    tracks = mp4file.get_tracks()
+    plans = [plan_chunks(track, duration) for track in tracks]
+    order = sorted([(start, track_index, chunk_index) \
+        for (track_index, chunks) in enumerate(plans) \
+        for (chunk_index, (start, first, last, description)) \
+        in enumerate(chunks)])
+
+    # Lay the chunks out relative to the start of the mdat's content
+    positions = [array(UINT64, [0]) * len(chunks) for chunks in plans]
+    media_size = 0
+    for (start, track_index, chunk_index) in order:
+        (start, first, last, description) = plans[track_index][chunk_index]
+        positions[track_index][chunk_index] = media_size
+        media_size += sum(tracks[track_index].get_sample_table() \
+            .get_sample_sizes()[first:last])
+    media_header = render_atom_header('mdat', media_size)
+
+    movie = copy_atom(movie)
+    traks = movie.get_children_of_type('trak')
+    stbls = [Track(trak).get_sample_table_atom() for trak in traks]
+    for (stbl, chunks) in zip(stbls, plans):
+        for (index, child) in enumerate(stbl):
+            if 'stsc' == child.type:
+                stbl[index] = make_data_atom('stsc',
+                                             render_planned_stsc(chunks))
+
+    # Chunk offsets depend on the size of the moov, which depends on
+    # whether they need 64 bits, so repeat until the size settles
+    leading_size = sum([atom.get_size() for atom in leading])
+    movie_size = movie.get_size()
+    while True:
+        media_start = leading_size + movie_size + len(media_header)
+        for (stbl, chunk_positions) in zip(stbls, positions):
+            offsets = array(UINT64, map(add, chunk_positions,
+                repeat(media_start, len(chunk_positions))))
+            for (index, child) in enumerate(stbl):
+                if child.type in ('stco', 'co64'):
+                    stbl[index] = \
+                        make_data_atom(*render_chunk_offsets(offsets))
+        if movie.get_size() == movie_size:
+            break
+        movie_size = movie.get_size()
+
+    for atom in leading:
+        atom.save(stream)
+    movie.save(stream)
+    stream.write(media_header)
+    reader = mp4file.get_source_reader()
+    for (start, track_index, chunk_index) in order:
+        (start, first, last, description) = plans[track_index][chunk_index]
+        table = tracks[track_index].get_sample_table()
+        for (offset, size) in table.get_byte_ranges(first, last):
+            copy_range(reader, offset, size, stream, block_size)
+    for atom in mp4file.get_children_of_type('mdat'):
+        mp4file.release(atom)
+    for atom in trailing:
+        atom.save(stream)
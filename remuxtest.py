@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Unit tests for remux.py
+
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+from array import array
+from struct import pack, unpack
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+import atom
+from mp4file import Mp4File
+import remux
+from sampletable import UINT64
+
+def render(type, content):
+    return atom.render_atom_header(type, len(content)) + content
+
+def render_full(type, content, version=0):
+    return render(type, pack('>B3x', version) + content)
+
+def render_track(track_id, handler, timescale, samples, chunk_offset,
+                 description='mp4v'):
+    """Render a trak holding <samples> of (data, duration, sync), stored
+       two to a chunk starting at <chunk_offset>
+    """
+    duration = sum([sample[1] for sample in samples])
+    stts = ''.join([pack('>LL', 1, sample[1]) for sample in samples])
+    stss = ''.join([pack('>L', number + 1) \
+        for (number, sample) in enumerate(samples) if sample[2]])
+    stsz = ''.join([pack('>L', len(sample[0])) for sample in samples])
+    offsets = []
+    for index in range(0, len(samples), 2):
+        offsets.append(chunk_offset)
+        chunk_offset += sum([len(sample[0]) for sample in samples[index:index + 2]])
+    stco = ''.join([pack('>L', offset) for offset in offsets])
+    stsc = [pack('>LLL', 1, 2, 1)]
+    if len(samples) % 2:
+        stsc = stsc[:len(samples) // 2] + [pack('>LLL', len(offsets), 1, 1)]
+
+    stbl = render('stbl',
+        render('stsd', pack('>4xL', 1) + render(description, 'x' * 8))
+        + render_full('stts', pack('>L', len(samples)) + stts)
+        + render_full('stss', pack('>L', len(stss) // 4) + stss)
+        + render_full('stsc', pack('>L', len(stsc)) + ''.join(stsc))
+        + render_full('stsz', pack('>LL', 0, len(samples)) + stsz)
+        + render_full('stco', pack('>L', len(offsets)) + stco)
+    )
+    return render('trak',
+        render_full('tkhd', pack('>LLLLL', 0, 0, track_id, 0, duration))
+        + render('edts', render_full('elst', pack('>L', 0)))
+        + render('mdia',
+            render_full('mdhd', pack('>LLLL', 0, 0, timescale, duration))
+            + render_full('hdlr', pack('>L4s12x', 0, handler))
+            + render('minf', stbl)
+        )
+    )
+
+def render_movie(tracks, movie_first=False):
+    """Render a file of ftyp, mdat and moov (or ftyp, moov and mdat if
+       <movie_first>) from a list of tracks, each a list of
+       (data, duration, sync) samples
+    """
+    ftyp = render('ftyp', 'isom\0\0\0\0isom')
+    media = ''.join([''.join([sample[0] for sample in samples]) \
+        for samples in tracks])
+    mdat = render('mdat', media)
+
+    def render_moov(offset):
+        traks = ''
+        for (index, samples) in enumerate(tracks):
+            traks += render_track(index + 1, index and 'soun' or 'vide',
+                1000, samples, offset)
+            offset += sum([len(sample[0]) for sample in samples])
+        duration = max([sum([sample[1] for sample in samples]) \
+            for samples in tracks])
+        return render('moov',
+            render_full('mvhd', pack('>LLLL76xL', 0, 0, 1000, duration, 3))
+            + traks)
+
+    if movie_first:
+        # Offsets don't change the moov's size, so render it to measure it
+        moov_size = len(render_moov(0))
+        moov = render_moov(len(ftyp) + moov_size + len(mdat) - len(media))
+        return ftyp + moov + mdat
+    return ftyp + mdat + render_moov(len(ftyp) + len(mdat) - len(media))
+
+def read_samples(mp4file):
+    """Read every track's samples from <mp4file> as (data, duration, sync)"""
+    tracks = []
+    stream = open(mp4file.filename, 'rb')
+    for track in mp4file.get_tracks():
+        table = track.get_sample_table()
+        durations = []
+        for (count, delta) in zip(*table.get_time_to_sample()):
+            durations += [delta] * count
+        syncs = table.get_sync_samples()
+        sizes = table.get_sample_sizes()
+        samples = []
+        for (offset, count) in \
+         zip(table.get_chunk_offsets(), table.get_samples_per_chunk()):
+            stream.seek(offset)
+            for index in range(len(samples), len(samples) + count):
+                samples.append((stream.read(sizes[index]), durations[index],
+                    syncs is None or (index + 1) in syncs))
+        tracks.append(samples)
+    stream.close()
+    return tracks
+
+
+class ConcatenateFiles(unittest.TestCase):
+    first_tracks = [
+        [('v1a', 40, True), ('v1bb', 40, False), ('v1c', 40, True)],
+        [('a1a', 20, True), ('a1bb', 20, True)],
+    ]
+    second_tracks = [
+        [('v2aaa', 40, True), ('v2b', 40, False)],
+        [('a2a', 20, True), ('a2b', 25, True), ('a2c', 20, True)],
+    ]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.files = []
+        for (name, tracks) in \
+         [('first', self.first_tracks), ('second', self.second_tracks)]:
+            path = os.path.join(self.directory, name + '.mp4')
+            open(path, 'wb').write(render_movie(tracks))
+            self.files.append(Mp4File(path))
+        self.output_path = os.path.join(self.directory, 'output.mp4')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def concatenate(self):
+        output = open(self.output_path, 'wb')
+        remux.concatenate(self.files, output, block_size=4)
+        output.close()
+        return Mp4File(self.output_path)
+
+    def testOutputHasOneMediaAtom(self):
+        output = self.concatenate()
+        self.assertEqual(['ftyp', 'mdat', 'moov'], [a.type for a in output])
+
+    def testSamplesAreAppended(self):
+        output = self.concatenate()
+        expected = [first + second for (first, second) \
+            in zip(self.first_tracks, self.second_tracks)]
+        self.assertEqual(expected, read_samples(output))
+
+    def testDurationsAreSummed(self):
+        output = self.concatenate()
+        self.assertEqual([200, 105],
+            [track.get_duration() for track in output.get_tracks()])
+
+    def testEditListsAreDropped(self):
+        output = self.concatenate()
+        self.assertEqual([], output.get_movie().get_descendants_of_type('edts'))
+
+    def testRelocatesTracksSpreadOverMediaAtoms(self):
+        # Split the first file's mdat after the video track's first chunk,
+        # so its second chunk (and the audio track) are in another mdat
+        rendered = render_movie(self.first_tracks)
+        split = rendered.index('mdat') + 4 + len('v1av1bb')
+        moov = rendered.index('moov') - 4
+        tables = rendered[moov:]
+        for stco in (tables.index('stco'), tables.rindex('stco')):
+            (count,) = unpack('>L', tables[stco + 8:stco + 12])
+            offsets = unpack('>%dL' % count,
+                             tables[stco + 12:stco + 12 + count * 4])
+            offsets = [offset + 8 * (split <= offset) for offset in offsets]
+            tables = tables[:stco + 12] + pack('>%dL' % count, *offsets) \
+                + tables[stco + 12 + count * 4:]
+        open(self.files[0].filename, 'wb').write(rendered[:split - 15] \
+            + render('mdat', rendered[split - 7:split]) \
+            + render('mdat', rendered[split:moov]) + tables)
+        self.files[0] = Mp4File(self.files[0].filename)
+        self.assertEqual(self.first_tracks, read_samples(self.files[0]))
+
+        output = self.concatenate()
+        expected = [first + second for (first, second) \
+            in zip(self.first_tracks, self.second_tracks)]
+        self.assertEqual(expected, read_samples(output))
+
+    def testRejectsDifferentSampleDescriptions(self):
+        path = os.path.join(self.directory, 'other.mp4')
+        movie = render_movie(self.second_tracks).replace('mp4v', 'avc1')
+        open(path, 'wb').write(movie)
+        self.files[1] = Mp4File(path)
+
+        self.assertRaises(ValueError, remux.concatenate,
+                          self.files, StringIO.StringIO())
+
+    def testRejectsDifferentTrackCounts(self):
+        path = os.path.join(self.directory, 'other.mp4')
+        open(path, 'wb').write(render_movie(self.second_tracks[:1]))
+        self.files[1] = Mp4File(path)
+
+        self.assertRaises(ValueError, remux.concatenate,
+                          self.files, StringIO.StringIO())
+
+
+class FastStart(unittest.TestCase):
+    tracks = ConcatenateFiles.first_tracks
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output_path = os.path.join(self.directory, 'output.mp4')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def faststart(self, movie_first=False):
+        path = os.path.join(self.directory, 'input.mp4')
+        open(path, 'wb').write(render_movie(self.tracks, movie_first))
+        output = open(self.output_path, 'wb')
+        remux.faststart(Mp4File(path), output, block_size=4)
+        output.close()
+        return Mp4File(self.output_path)
+
+    def testMovesMovieBeforeMedia(self):
+        output = self.faststart()
+        self.assertEqual(['ftyp', 'moov', 'mdat'], [a.type for a in output])
+
+    def testChunkOffsetsFollowMedia(self):
+        output = self.faststart()
+        self.assertEqual(self.tracks, read_samples(output))
+        self.assertTrue(output.validate().is_valid())
+
+    def testFastStartFileIsUnchanged(self):
+        output = self.faststart(movie_first=True)
+        self.assertEqual(['ftyp', 'moov', 'mdat'], [a.type for a in output])
+        self.assertEqual(self.tracks, read_samples(output))
+
+    def testRelocatesOffsetsIntoEachMediaAtom(self):
+        offsets = array(UINT64, [10, 15, 100, 105, 300])
+        extents = [(8, 50, 1008), (100, 200, 2000)]
+        self.assertEqual([1010, 1015, 2000, 2005, 300],
+            list(remux.relocate_chunk_offsets(offsets, extents)))
+
+
+class Repack(unittest.TestCase):
+    tracks = ConcatenateFiles.first_tracks
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output_path = os.path.join(self.directory, 'output.mp4')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def repack(self, padding):
+        # Add free atoms within the trailing moov, and after it
+        rendered = render_movie(self.tracks)
+        path = os.path.join(self.directory, 'input.mp4')
+        open(path, 'wb').write(rendered)
+        moov = Mp4File(path).get_movie()
+        (offset, size) = (moov.get_source_offset(), moov.get_size())
+        content = rendered[offset + 8:offset + size] + atom.render_free(20)
+        open(path, 'wb').write(rendered[:offset] + render('moov', content)
+                               + atom.render_free(30))
+
+        output = open(self.output_path, 'wb')
+        remux.repack(Mp4File(path), output, padding, block_size=4)
+        output.close()
+        return Mp4File(self.output_path)
+
+    def testDropsFreeAtomsAndReservesPadding(self):
+        output = self.repack(100)
+        self.assertEqual(['ftyp', 'moov', 'free', 'mdat'],
+                         [a.type for a in output])
+        self.assertEqual(100, output[2].get_size())
+        self.assertEqual([], output.get_movie().get_descendants_of_type('free'))
+        self.assertEqual(self.tracks, read_samples(output))
+        self.assertTrue(output.validate().is_valid())
+
+    def testWithoutPadding(self):
+        output = self.repack(0)
+        self.assertEqual(['ftyp', 'moov', 'mdat'], [a.type for a in output])
+        self.assertEqual(self.tracks, read_samples(output))
+
+    def testRejectsPaddingSmallerThanHeader(self):
+        self.assertRaises(ValueError, self.repack, 4)
+
+
+class Interleave(unittest.TestCase):
+    # Two seconds of video, then two seconds of audio
+    tracks = [
+        [('v%d' % index, 250, 0 == index % 4) for index in range(8)],
+        [('a%d' % index, 100, True) for index in range(20)],
+    ]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output_path = os.path.join(self.directory, 'output.mp4')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def interleave(self, duration=0.5):
+        path = os.path.join(self.directory, 'input.mp4')
+        open(path, 'wb').write(render_movie(self.tracks))
+        output = open(self.output_path, 'wb')
+        remux.interleave(Mp4File(path), output, duration, block_size=3)
+        output.close()
+        return Mp4File(self.output_path)
+
+    def testKeepsSamples(self):
+        output = self.interleave()
+        self.assertEqual(['ftyp', 'moov', 'mdat'], [a.type for a in output])
+        self.assertEqual(self.tracks, read_samples(output))
+        self.assertTrue(output.validate().is_valid())
+
+    def testInterleavesChunksByDecodeTime(self):
+        output = self.interleave()
+        (video, audio) = [track.get_sample_table() \
+            for track in output.get_tracks()]
+        self.assertEqual([2] * 4, list(video.get_samples_per_chunk()))
+        self.assertEqual([5] * 4, list(audio.get_samples_per_chunk()))
+        # Each half second of video is followed by its half second of audio
+        for (video_offset, audio_offset, video_size) in zip( \
+         video.get_chunk_offsets(), audio.get_chunk_offsets(),
+         video.get_chunk_sizes()):
+            self.assertEqual(video_offset + video_size, audio_offset)
+
+    def testSingleChunkPerTrack(self):
+        output = self.interleave(duration=10)
+        self.assertEqual(self.tracks, read_samples(output))
+        self.assertEqual([1, 1], [track.get_sample_table().get_chunk_count() \
+            for track in output.get_tracks()])
+
+    def testRejectsEmptyChunks(self):
+        self.assertRaises(ValueError, self.interleave, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
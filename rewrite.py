@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Crash-safe, resumable writing of new files.
+
+A JournaledWriter writes output to a temporary sibling of its
+destination and, every so often, syncs it to disk and records in a
+journal how many bytes are safely written. When the output is complete,
+it is renamed over the destination in one step, so the destination is
+never left half-written.
+
+If the process dies, running the same job again resumes from the last
+checkpoint: output before it is discarded rather than written, and media
+copies (through atom.skip_written) skip it rather than reading it again.
+This relies on the job writing exactly the same bytes each time, as the
+remux operations do for an unchanged source.
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+import json
+import os
+
+# Bytes written between syncs and checkpoints
+FSYNC_INTERVAL = 64 * 1024 * 1024
+PARTIAL_SUFFIX = '.partial'
+JOURNAL_SUFFIX = '.journal'
+
+def get_source_job(operation, source_path):
+    """Name the job of <operation> on the file at <source_path> as it is
+       now, so that a journal left by the job on an older version of the
+       file isn't resumed from
+    """
+    status = os.stat(source_path)
+    return '%s %s %d %d' % (operation, os.path.abspath(source_path),
+                            status.st_size, int(status.st_mtime))
+
+def sync_directory(path):
+    """Sync the directory holding <path>, so a rename within it is durable.
+       Not every platform can open a directory, so this is best-effort.
+    """
+    try:
+        descriptor = os.open(os.path.dirname(os.path.abspath(path)),
+                             os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(descriptor)
+    except OSError:
+        pass
+    finally:
+        os.close(descriptor)
+
+
+class JournaledWriter(object):
+    """A stream that writes <path> by way of a temporary sibling, syncing
+       it and recording a checkpoint in a journal every <fsync_interval>
+       bytes. An interrupted <job> (any name for what's being written) is
+       resumed from its last checkpoint.
+    """
+    def __init__(self, path, job='', fsync_interval=FSYNC_INTERVAL):
+        self.path = path
+        self.partial_path = path + PARTIAL_SUFFIX
+        self.journal_path = path + JOURNAL_SUFFIX
+        self.job = job
+        self.fsync_interval = fsync_interval
+        # Bytes of output produced so far, including any skipped
+        self.position = 0
+        # Bytes already safely written by an earlier run
+        self.checkpoint = self.__read_checkpoint()
+
+        if 0 < self.checkpoint:
+            self.__file = open(self.partial_path, 'r+b')
+            self.__file.truncate(self.checkpoint)
+            self.__file.seek(self.checkpoint)
+        else:
+            self.__file = open(self.partial_path, 'wb')
+        self.__synced = self.checkpoint
+
+    def __read_checkpoint(self):
+        """Find where an earlier run of the same job got to, if anywhere"""
+        if not os.path.exists(self.journal_path) \
+         or not os.path.exists(self.partial_path):
+            return 0
+        try:
+            with open(self.journal_path, 'rb') as journal_file:
+                journal = json.load(journal_file)
+            checkpoint = int(journal['checkpoint'])
+            if self.job != journal['job']:
+                return 0
+        except (KeyError, TypeError, ValueError):
+            return 0
+        if os.path.getsize(self.partial_path) < checkpoint:
+            return 0
+        return checkpoint
+
+    def __write_journal(self, checkpoint):
+        # Replace the journal whole, so a crash leaves the old or the new
+        temporary_path = self.journal_path + PARTIAL_SUFFIX
+        with open(temporary_path, 'wb') as journal:
+            json.dump({'job': self.job, 'checkpoint': checkpoint}, journal)
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.rename(temporary_path, self.journal_path)
+
+    def tell(self):
+        return self.position
+
+    def write(self, data):
+        end = self.position + len(data)
+        if end <= self.checkpoint:
+            # Written by an earlier run
+            self.position = end
+            return
+        if self.position < self.checkpoint:
+            data = data[self.checkpoint - self.position:]
+            self.position = self.checkpoint
+        self.__file.write(data)
+        self.position = end
+        if self.fsync_interval <= self.position - self.__synced:
+            self.sync()
+
+    def skip_written(self, size):
+        """Skip past as many of the next <size> bytes as an earlier run
+           wrote; return the number skipped
+        """
+        skipped = max(0, min(size, self.checkpoint - self.position))
+        self.position += skipped
+        return skipped
+
+    def sync(self):
+        """Sync everything written so far, and record it as a checkpoint"""
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+        self.__write_journal(self.position)
+        self.__synced = self.position
+
+    def close(self):
+        """Stop writing, leaving the temporary file and journal to resume
+           from
+        """
+        self.__file.close()
+
+    def commit(self):
+        """Sync the finished output and move it into place"""
+        if self.position < self.checkpoint:
+            raise IOError, 'Only %d of the %d bytes written before were ' \
+                'written again' % (self.position, self.checkpoint)
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+        self.__file.close()
+        os.rename(self.partial_path, self.path)
+        sync_directory(self.path)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+
+def rewrite(path, write, job='', fsync_interval=FSYNC_INTERVAL):
+    """Call <write> with a JournaledWriter for <path>, then move the
+       output into place; if <write> fails, the output written so far is
+       kept, for a later call with the same <job> to resume from
+    """
+    writer = JournaledWriter(path, job, fsync_interval)
+    try:
+        write(writer)
+    except:
+        writer.close()
+        raise
+    writer.commit()
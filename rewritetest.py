@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Unit tests for rewrite.py
+
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+import atom
+from mp4file import Mp4File
+import remux
+from remuxtest import read_samples, render_movie
+from rewrite import JournaledWriter, get_source_job, rewrite
+
+class Interrupted(Exception):
+    pass
+
+
+class InterruptingStream(object):
+    """Pass writes on to <stream> until <limit> bytes have been written"""
+    def __init__(self, stream, limit):
+        self.stream = stream
+        self.limit = limit
+
+    def write(self, data):
+        if self.limit < self.stream.tell() + len(data):
+            raise Interrupted
+        self.stream.write(data)
+
+    def skip_written(self, size):
+        return self.stream.skip_written(size)
+
+
+class ResumeRewrite(unittest.TestCase):
+    tracks = [
+        [('v%d' % index * 40, 40, 0 == index % 3) for index in range(30)],
+        [('a%d' % index * 20, 30, True) for index in range(40)],
+    ]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source_path = os.path.join(self.directory, 'source.mp4')
+        open(self.source_path, 'wb').write(render_movie(self.tracks))
+        self.path = os.path.join(self.directory, 'output.mp4')
+        self.job = get_source_job('faststart', self.source_path)
+
+        expected = StringIO.StringIO()
+        remux.faststart(Mp4File(self.source_path), expected)
+        self.expected = expected.getvalue()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def faststart(self, limit=None, job=None):
+        if job is None:
+            job = self.job
+        mp4file = Mp4File(self.source_path)
+        def write(stream):
+            if limit is not None:
+                stream = InterruptingStream(stream, limit)
+            remux.faststart(mp4file, stream, block_size=64)
+        rewrite(self.path, write, job, fsync_interval=100)
+
+    def testWritesOutputInPlace(self):
+        self.faststart()
+        self.assertEqual(self.expected, open(self.path, 'rb').read())
+        self.assertEqual(['output.mp4', 'source.mp4'],
+                         sorted(os.listdir(self.directory)))
+
+    def testKeepsPartialOutputWhenInterrupted(self):
+        self.assertRaises(Interrupted, self.faststart, 5000)
+        self.assertFalse(os.path.exists(self.path))
+        partial = open(self.path + '.partial', 'rb').read()
+        self.assertTrue(4900 <= len(partial) <= 5000)
+        self.assertEqual(self.expected[:len(partial)], partial)
+
+    def testResumesFromCheckpoint(self):
+        self.assertRaises(Interrupted, self.faststart, 5000)
+        read = atom.IO_COUNTERS['bytes']
+        self.faststart()
+        resumed_read = atom.IO_COUNTERS['bytes'] - read
+        self.assertEqual(self.expected, open(self.path, 'rb').read())
+        self.assertEqual(self.tracks, read_samples(Mp4File(self.path)))
+
+        # Media before the checkpoint isn't read again
+        read = atom.IO_COUNTERS['bytes']
+        self.faststart()
+        self.assertTrue(resumed_read < atom.IO_COUNTERS['bytes'] - read - 2000)
+
+    def testOtherJobStartsAgain(self):
+        self.assertRaises(Interrupted, self.faststart, 5000)
+        open(self.path + '.partial', 'r+b').write('garbage')
+        self.faststart(job='another job')
+        self.assertEqual(self.expected, open(self.path, 'rb').read())
+
+    def testSkipsOnlyWhatWasWritten(self):
+        writer = JournaledWriter(self.path, fsync_interval=10)
+        writer.write('0123456789abc')
+        writer.close()
+
+        writer = JournaledWriter(self.path)
+        self.assertEqual(13, writer.checkpoint)
+        writer.write('0123')
+        self.assertEqual(6, writer.skip_written(6))
+        self.assertEqual(3, writer.skip_written(10))
+        writer.write('XYZ')
+        writer.commit()
+        self.assertEqual('0123456789abcXYZ', open(self.path, 'rb').read())
+
+
+if __name__ == "__main__":
+    unittest.main()
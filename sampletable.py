@@ -0,0 +1,503 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Decoding and rendering of sample table (stbl) atoms.
+
+Each table is decoded from its atom's content in a single pass into a
+typed array, so whole tables can be sliced, concatenated and compared
+without unpacking entries one at a time.
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+from array import array
+from bisect import bisect_right
+from itertools import groupby
+from struct import calcsize, pack, unpack
+import sys
+
+from atom import Atom
+
+def get_array_typecode(itemsize, signed=False):
+    """Find an array typecode for integers of <itemsize> bytes"""
+    for typecode in (signed and 'bhil' or 'BHIL'):
+        if itemsize == array(typecode).itemsize:
+            return typecode
+    return None
+
+UINT32 = get_array_typecode(4)
+INT32 = get_array_typecode(4, signed=True)
+# Doubles hold offsets exactly up to 2**53 where there's no 64-bit type
+UINT64 = get_array_typecode(8) or 'd'
+INT64 = get_array_typecode(8, signed=True) or 'd'
+
+FULL_BOX_HEADER = '>B3s'
+# Tables whose entries all follow an entry count
+TABLE_HEADER = '>B3sL'
+# Edit list entries, for version 0 and version 1 boxes respectively
+EDIT_LIST_ENTRY = ('LlhH', 'QqhH')
+SAMPLE_SIZE_HEADER = '>B3sLL'
+# Bytes per entry of the tables that follow TABLE_HEADER
+TABLE_ENTRY_SIZES = {'stts': 8, 'ctts': 8, 'stsc': 12, 'stss': 4,
+                     'stco': 4, 'co64': 8}
+
+def unpack_array(typecode, data):
+    """Unpack big-endian <data> into an array of <typecode> items"""
+    if 'd' == typecode:
+        return array('d', unpack('>%dQ' % (len(data) // 8), data))
+
+    values = array(typecode)
+    values.fromstring(data)
+    if 'little' == sys.byteorder:
+        values.byteswap()
+    return values
+
+def pack_array(values, typecode=None):
+    """Pack <values> as big-endian items of <typecode>"""
+    if typecode is None:
+        typecode = UINT32
+    if 'd' == typecode:
+        return pack('>%dQ' % len(values), *[long(v) for v in values])
+
+    values = array(typecode, values)
+    if 'little' == sys.byteorder:
+        values.byteswap()
+    return values.tostring()
+
+def interleave(*columns):
+    """Interleave equal-length <columns> into a single array"""
+    width = len(columns)
+    entries = array(columns[0].typecode, columns[0]) * width
+    for (index, column) in enumerate(columns):
+        entries[index::width] = array(entries.typecode, column)
+    return entries
+
+def deinterleave(entries, width):
+    """Split <entries> into <width> columns"""
+    return tuple([entries[index::width] for index in range(width)])
+
+def compact_runs(counts, values):
+    """Merge adjacent runs in a run-length table that share a value"""
+    compacted_counts = array(counts.typecode)
+    compacted_values = array(values.typecode)
+    for (value, runs) in groupby(zip(counts, values), lambda run: run[1]):
+        compacted_counts.append(sum([run[0] for run in runs]))
+        compacted_values.append(value)
+    return (compacted_counts, compacted_values)
+
+def expand_runs(counts, values, typecode=None):
+    """Expand a run-length table into one value per sample"""
+    if typecode is None:
+        typecode = values.typecode
+    expanded = array(typecode)
+    for (count, value) in zip(counts, values):
+        expanded.extend(array(typecode, [value]) * count)
+    return expanded
+
+def read_content(atom):
+    """Read the whole content of a data <atom>"""
+    initial_position = atom.tell()
+    atom.seek(0)
+    content = atom.read()
+    atom.seek(initial_position)
+    return content
+
+def make_data_atom(type, content):
+    """Create a data atom of <type> holding <content>"""
+    data_atom = Atom(type=type)
+    data_atom.write(content)
+    data_atom.seek(0)
+    return data_atom
+
+
+# Decoding
+
+def unpack_header(layout, content):
+    """Unpack the <layout> header at the start of <content>, raising
+       ValueError if <content> is too short to hold it
+    """
+    header_size = calcsize(layout)
+    if len(content) < header_size:
+        raise ValueError, 'Header needs %d bytes, but there are only %d' \
+            % (header_size, len(content))
+    return unpack(layout, content[:header_size])
+
+def get_table_size(type, content):
+    """Get the size of table content of <type> that its header declares,
+       or None if <type> isn't a sample table; raise ValueError if
+       <content> is too short to hold the header
+    """
+    if 'stsz' == type:
+        (version, flags, uniform_size, sample_count) = \
+            unpack_header(SAMPLE_SIZE_HEADER, content)
+        if 0 != uniform_size:
+            return calcsize(SAMPLE_SIZE_HEADER)
+        return calcsize(SAMPLE_SIZE_HEADER) + sample_count * 4
+    if type not in TABLE_ENTRY_SIZES:
+        return None
+    (version, flags, entry_count) = unpack_header(TABLE_HEADER, content)
+    return calcsize(TABLE_HEADER) + entry_count * TABLE_ENTRY_SIZES[type]
+
+def get_entries(content, start, size):
+    """Get the <size> bytes of entries from <start> in <content>, raising
+       ValueError if there are fewer
+    """
+    if len(content) < start + size:
+        raise ValueError, 'Table declares %d bytes of entries, but has ' \
+            'only %d' % (size, max(0, len(content) - start))
+    return content[start:start + size]
+
+def decode_table(content, width, typecode=None):
+    """Decode a full box holding an entry count followed by entries of
+       <width> 32-bit fields; return (version, flags, columns).
+    """
+    if typecode is None:
+        typecode = UINT32
+    (version, flags, entry_count) = unpack_header(TABLE_HEADER, content)
+    entries = unpack_array(typecode, get_entries(content,
+        calcsize(TABLE_HEADER), entry_count * width * 4))
+    return (version, flags, deinterleave(entries, width))
+
+def decode_stts(content):
+    """Decode time-to-sample content into (counts, deltas)"""
+    return decode_table(content, 2)[2]
+
+def decode_ctts(content):
+    """Decode composition offset content into (counts, offsets)"""
+    (version, flags, entry_count) = unpack_header(TABLE_HEADER, content)
+    # Version 1 offsets are signed
+    typecode = version and INT32 or UINT32
+    (counts, offsets) = decode_table(content, 2, typecode)[2]
+    return (array(UINT32, counts), offsets)
+
+def decode_stsc(content):
+    """Decode sample-to-chunk content into
+       (first_chunks, samples_per_chunk, description_indices)
+    """
+    return decode_table(content, 3)[2]
+
+def decode_stsz(content):
+    """Decode sample size content into (uniform_size, sizes), with sizes
+       holding one entry per sample even if they are uniform
+    """
+    (version, flags, uniform_size, sample_count) = \
+        unpack_header(SAMPLE_SIZE_HEADER, content)
+    if 0 != uniform_size:
+        return (uniform_size, array(UINT32, [uniform_size]) * sample_count)
+
+    return (0, unpack_array(UINT32, get_entries(content,
+        calcsize(SAMPLE_SIZE_HEADER), sample_count * 4)))
+
+def decode_stco(content):
+    """Decode 32-bit chunk offset content into 64-bit offsets"""
+    return array(UINT64, decode_table(content, 1)[2][0])
+
+def decode_co64(content):
+    """Decode 64-bit chunk offset content"""
+    (version, flags, entry_count) = unpack_header(TABLE_HEADER, content)
+    return unpack_array(UINT64, get_entries(content,
+        calcsize(TABLE_HEADER), entry_count * 8))
+
+def decode_elst(content):
+    """Decode edit list content into (segment_durations, media_times,
+       media_rates). Durations are in movie timescale units, and media
+       times in media timescale units (or -1 for an empty edit).
+    """
+    (version, flags, entry_count) = unpack_header(TABLE_HEADER, content)
+    entry = EDIT_LIST_ENTRY[version and 1 or 0]
+    entries = get_entries(content, calcsize(TABLE_HEADER),
+                          calcsize('>' + entry) * entry_count)
+    fields = unpack('>' + entry * entry_count, entries)
+    rates = array('d', [integer + fraction / 65536.0 for (integer, fraction) \
+        in zip(fields[2::4], fields[3::4])])
+    return (array(UINT64, fields[0::4]), array(INT64, fields[1::4]), rates)
+
+def decode_stss(content):
+    """Decode sync sample content into 1-based sample numbers"""
+    return decode_table(content, 1)[2][0]
+
+
+# Rendering
+
+def render_table(columns, version=0, flags=0, typecode=None):
+    """Render a full box holding an entry count followed by <columns>"""
+    entry_count = len(columns[0])
+    content = pack(TABLE_HEADER, version, pack('>L', flags)[1:], entry_count)
+    return content + pack_array(interleave(*columns), typecode)
+
+def render_stts(counts, deltas):
+    return render_table((counts, deltas))
+
+def render_ctts(counts, offsets):
+    """Render composition offsets, using version 1 if any are negative"""
+    if 0 < len(offsets) and min(offsets) < 0:
+        return render_table((array(INT32, counts), offsets), 1, typecode=INT32)
+    return render_table((counts, offsets))
+
+def render_stsc(first_chunks, samples_per_chunk, description_indices):
+    return render_table((first_chunks, samples_per_chunk, description_indices))
+
+def render_stsz(sizes):
+    """Render sample sizes, collapsing them if they are uniform"""
+    if 0 < len(sizes) and min(sizes) == max(sizes):
+        return pack(SAMPLE_SIZE_HEADER, 0, '\0\0\0', sizes[0], len(sizes))
+    return pack(SAMPLE_SIZE_HEADER, 0, '\0\0\0', 0, len(sizes)) \
+        + pack_array(sizes)
+
+def render_stss(sample_numbers):
+    return render_table((sample_numbers,))
+
+def render_chunk_offsets(offsets):
+    """Render <offsets> as stco if they fit in 32 bits, otherwise as co64;
+       return (type, content)
+    """
+    if 0 < len(offsets) and 2**32 <= max(offsets):
+        content = pack(TABLE_HEADER, 0, '\0\0\0', len(offsets))
+        return ('co64', content + pack_array(offsets, UINT64))
+    return ('stco', render_table((offsets,)))
+
+def compact_sample_to_chunk(first_chunks, samples_per_chunk,
+                            description_indices):
+    """Drop sample-to-chunk entries that repeat the layout of the entry
+       before them
+    """
+    compacted = (array(UINT32), array(UINT32), array(UINT32))
+    for entry in zip(first_chunks, samples_per_chunk, description_indices):
+        if 0 == len(compacted[0]) \
+         or entry[1:] != (compacted[1][-1], compacted[2][-1]):
+            for (column, value) in zip(compacted, entry):
+                column.append(value)
+    return compacted
+
+def make_sample_table_atoms(sizes, time_to_sample, sample_to_chunk,
+                            chunk_offsets, composition_offsets=None,
+                            sync_samples=None):
+    """Make the children of an stbl, other than its stsd, each in its most
+       compact encoding: runs in <time_to_sample> (counts, deltas) and
+       <composition_offsets> (counts, offsets) are merged, entries of
+       <sample_to_chunk> that repeat a layout are dropped, uniform <sizes>
+       are collapsed, and <chunk_offsets> use 64 bits only if they must.
+       Composition offsets that are all zero, and <sync_samples> that
+       cover every sample, are left out, as are either if None.
+    """
+    (counts, deltas) = time_to_sample
+    children = [make_data_atom('stts', render_stts( \
+        *compact_runs(array(UINT32, counts), array(UINT32, deltas))))]
+    if sync_samples is not None and len(sync_samples) != len(sizes):
+        children.append(make_data_atom('stss', render_stss(sync_samples)))
+    if composition_offsets is not None and 0 < len(composition_offsets[1]) \
+     and (0 != min(composition_offsets[1]) \
+     or 0 != max(composition_offsets[1])):
+        (counts, offsets) = composition_offsets
+        if 0 <= min(offsets):
+            offsets = array(UINT32, offsets)
+        else:
+            offsets = array(INT32, offsets)
+        children.append(make_data_atom('ctts',
+            render_ctts(*compact_runs(array(UINT32, counts), offsets))))
+    children.append(make_data_atom('stsc',
+        render_stsc(*compact_sample_to_chunk(*sample_to_chunk))))
+    children.append(make_data_atom('stsz', render_stsz(sizes)))
+    children.append(make_data_atom(*render_chunk_offsets(chunk_offsets)))
+    return children
+
+
+class SampleTable(object):
+    """Decoded view of an stbl atom's tables. Each table is decoded the
+       first time it is needed and then cached.
+    """
+    def __init__(self, stbl):
+        self.stbl = stbl
+        self.__cache = {}
+
+    def __decode(self, type, decoder):
+        if type not in self.__cache:
+            children = self.stbl.get_children_of_type(type)
+            if 0 == len(children):
+                self.__cache[type] = None
+            else:
+                self.__cache[type] = decoder(read_content(children[0]))
+        return self.__cache[type]
+
+    def get_sample_description(self):
+        descriptions = self.stbl.get_children_of_type('stsd')
+        if 0 == len(descriptions):
+            return None
+        return descriptions[0]
+
+    def get_time_to_sample(self):
+        """Return the (counts, deltas) time-to-sample runs"""
+        time_to_sample = self.__decode('stts', decode_stts)
+        if time_to_sample is None:
+            return (array(UINT32), array(UINT32))
+        return time_to_sample
+
+    def get_composition_offsets(self):
+        """Return the (counts, offsets) composition offset runs, or None"""
+        return self.__decode('ctts', decode_ctts)
+
+    def get_sample_to_chunk(self):
+        """Return the (first_chunks, samples_per_chunk,
+           description_indices) sample-to-chunk entries
+        """
+        sample_to_chunk = self.__decode('stsc', decode_stsc)
+        if sample_to_chunk is None:
+            return (array(UINT32), array(UINT32), array(UINT32))
+        return sample_to_chunk
+
+    def get_sample_sizes(self):
+        sample_sizes = self.__decode('stsz', decode_stsz)
+        if sample_sizes is None:
+            return array(UINT32)
+        return sample_sizes[1]
+
+    def get_chunk_offsets(self):
+        offsets = self.__decode('stco', decode_stco)
+        if offsets is None:
+            offsets = self.__decode('co64', decode_co64)
+        if offsets is None:
+            return array(UINT64)
+        return offsets
+
+    def get_sync_samples(self):
+        """Return 1-based sync sample numbers, or None if every sample is
+           a sync sample
+        """
+        return self.__decode('stss', decode_stss)
+
+    def get_sample_count(self):
+        return len(self.get_sample_sizes())
+
+    def get_chunk_count(self):
+        return len(self.get_chunk_offsets())
+
+    def get_duration(self):
+        """Return the total decode duration, in media timescale units"""
+        (counts, deltas) = self.get_time_to_sample()
+        return sum([count * delta for (count, delta) in zip(counts, deltas)])
+
+    def get_samples_per_chunk(self):
+        """Return the number of samples in each chunk"""
+        if 'samples_per_chunk' not in self.__cache:
+            (first_chunks, samples_per_chunk, description_indices) = \
+                self.get_sample_to_chunk()
+            chunk_count = self.get_chunk_count()
+            last_chunks = list(first_chunks[1:]) + [chunk_count + 1]
+
+            expanded = array(UINT32)
+            for (first, last, count) in \
+             zip(first_chunks, last_chunks, samples_per_chunk):
+                expanded.extend(array(UINT32, [count]) * (last - first))
+            self.__cache['samples_per_chunk'] = expanded[:chunk_count]
+        return self.__cache['samples_per_chunk']
+
+    def get_chunk_sizes(self):
+        """Return the total size of the samples in each chunk"""
+        if 'chunk_sizes' not in self.__cache:
+            sizes = self.get_sample_sizes()
+            chunk_sizes = array(UINT64)
+            first_sample = 0
+            for count in self.get_samples_per_chunk():
+                chunk_sizes.append(sum(sizes[first_sample:first_sample + count]))
+                first_sample += count
+            self.__cache['chunk_sizes'] = chunk_sizes
+        return self.__cache['chunk_sizes']
+
+    def get_chunk_first_samples(self):
+        """Return the (0-based) index of the first sample in each chunk"""
+        if 'chunk_first_samples' not in self.__cache:
+            first_samples = array(UINT32)
+            first_sample = 0
+            for count in self.get_samples_per_chunk():
+                first_samples.append(first_sample)
+                first_sample += count
+            self.__cache['chunk_first_samples'] = first_samples
+        return self.__cache['chunk_first_samples']
+
+    def get_sample_offsets(self):
+        """Return the file offset of each sample"""
+        if 'sample_offsets' not in self.__cache:
+            sizes = self.get_sample_sizes()
+            offsets = array(UINT64)
+            first_sample = 0
+            for (chunk_offset, count) in \
+             zip(self.get_chunk_offsets(), self.get_samples_per_chunk()):
+                offset = chunk_offset
+                for size in sizes[first_sample:first_sample + count]:
+                    offsets.append(offset)
+                    offset += size
+                first_sample += count
+            self.__cache['sample_offsets'] = offsets
+        return self.__cache['sample_offsets']
+
+    def get_sample_durations(self):
+        """Return the decode duration of each sample"""
+        if 'sample_durations' not in self.__cache:
+            self.__cache['sample_durations'] = \
+                expand_runs(*self.get_time_to_sample())
+        return self.__cache['sample_durations']
+
+    def get_decode_times(self):
+        """Return the decode time of each sample, in media timescale units"""
+        if 'decode_times' not in self.__cache:
+            times = array(UINT64)
+            time = 0
+            for (count, delta) in zip(*self.get_time_to_sample()):
+                if 0 == delta:
+                    times.extend(array(UINT64, [time]) * count)
+                else:
+                    times.extend(xrange(time, time + count * delta, delta))
+                time += count * delta
+            self.__cache['decode_times'] = times
+        return self.__cache['decode_times']
+
+    def get_sample_composition_offsets(self):
+        """Return the composition offset of each sample (all zero if the
+           table has no composition offsets)
+        """
+        if 'sample_composition_offsets' not in self.__cache:
+            composition_offsets = self.get_composition_offsets()
+            if composition_offsets is None:
+                expanded = array(INT32, [0]) * self.get_sample_count()
+            else:
+                expanded = expand_runs(*composition_offsets)
+            self.__cache['sample_composition_offsets'] = expanded
+        return self.__cache['sample_composition_offsets']
+
+    def get_byte_ranges(self, first_sample, last_sample):
+        """Return the (offset, size) byte ranges holding samples
+           <first_sample> up to (but excluding) <last_sample>, merging
+           ranges that are contiguous in the file
+        """
+        sizes = self.get_sample_sizes()
+        chunk_offsets = self.get_chunk_offsets()
+        chunk_first_samples = self.get_chunk_first_samples()
+        samples_per_chunk = self.get_samples_per_chunk()
+
+        ranges = []
+        chunk = max(0, bisect_right(chunk_first_samples, first_sample) - 1)
+        while chunk < len(chunk_offsets) \
+         and chunk_first_samples[chunk] < last_sample:
+            chunk_first = chunk_first_samples[chunk]
+            start = max(first_sample, chunk_first)
+            end = min(last_sample, chunk_first + samples_per_chunk[chunk])
+            offset = chunk_offsets[chunk] + sum(sizes[chunk_first:start])
+            size = sum(sizes[start:end])
+
+            if ranges and ranges[-1][0] + ranges[-1][1] == offset:
+                ranges[-1] = (ranges[-1][0], ranges[-1][1] + size)
+            elif 0 < size:
+                ranges.append((offset, size))
+            chunk += 1
+        return ranges
+
+    def load(self):
+        """Decode every table now, rather than when each is first needed"""
+        self.get_sample_description()
+        self.get_time_to_sample()
+        self.get_composition_offsets()
+        self.get_sample_to_chunk()
+        self.get_sample_sizes()
+        self.get_chunk_offsets()
+        self.get_sync_samples()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Unit tests for sampletable.py
+
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+from array import array
+import unittest
+
+from sampletable import INT32, UINT32, UINT64, decode_co64, decode_ctts, \
+    decode_stsc, decode_stss, decode_stsz, decode_stts, \
+    get_table_size, make_sample_table_atoms, read_content, render_stsz, \
+    render_stts
+
+class MakeSampleTable(unittest.TestCase):
+    sizes = array(UINT32, [10, 20, 30, 40])
+    time_to_sample = (array(UINT32, [1, 1, 2]), array(UINT32, [5, 5, 6]))
+    sample_to_chunk = (array(UINT32, [1, 2, 3]), array(UINT32, [2, 1, 1]),
+                       array(UINT32, [1, 1, 1]))
+    chunk_offsets = array(UINT64, [100, 200, 300])
+
+    def make(self, **tables):
+        arguments = {
+            'sizes': self.sizes,
+            'time_to_sample': self.time_to_sample,
+            'sample_to_chunk': self.sample_to_chunk,
+            'chunk_offsets': self.chunk_offsets,
+        }
+        arguments.update(tables)
+        children = make_sample_table_atoms(**arguments)
+        contents = dict([(child.type, read_content(child)) \
+            for child in children])
+        return (contents, [child.type for child in children])
+
+    def testWritesTablesInOrder(self):
+        (contents, types) = self.make(
+            composition_offsets=(array(UINT32, [4]), array(UINT32, [1])),
+            sync_samples=array(UINT32, [1, 3]))
+        self.assertEqual(['stts', 'stss', 'ctts', 'stsc', 'stsz', 'stco'],
+                         types)
+        self.assertEqual([1, 3], list(decode_stss(contents['stss'])))
+
+    def testMergesRuns(self):
+        (contents, types) = self.make(composition_offsets=(
+            array(UINT32, [1, 1, 2]), array(INT32, [-1, -1, 2])))
+        self.assertEqual(([2, 2], [5, 6]),
+            tuple([list(column) for column in decode_stts(contents['stts'])]))
+        self.assertEqual(([2, 2], [-1, 2]),
+            tuple([list(column) for column in decode_ctts(contents['ctts'])]))
+        # Negative composition offsets need a version 1 box
+        self.assertEqual(1, ord(contents['ctts'][0]))
+
+    def testDropsRepeatedChunkLayouts(self):
+        (contents, types) = self.make()
+        self.assertEqual(([1, 2], [2, 1], [1, 1]),
+            tuple([list(column) for column in decode_stsc(contents['stsc'])]))
+
+    def testLeavesOutRedundantTables(self):
+        (contents, types) = self.make(
+            composition_offsets=(array(UINT32, [4]), array(UINT32, [0])),
+            sync_samples=array(UINT32, [1, 2, 3, 4]))
+        self.assertEqual(['stts', 'stsc', 'stsz', 'stco'], types)
+
+    def testCollapsesUniformSizes(self):
+        (contents, types) = self.make(sizes=array(UINT32, [8] * 4))
+        self.assertEqual(12, len(contents['stsz']))
+        self.assertEqual(8, decode_stsz(contents['stsz'])[0])
+
+    def testUsesLargeOffsetsOnlyIfNeeded(self):
+        (contents, types) = self.make(
+            chunk_offsets=array(UINT64, [100, 2**32, 2**33]))
+        self.assertEqual('co64', types[-1])
+        self.assertEqual([100, 2**32, 2**33],
+                         list(decode_co64(contents['co64'])))
+
+    def testWritesEmptyTables(self):
+        empty = array(UINT32)
+        (contents, types) = self.make(sizes=empty, time_to_sample=(empty,
+            empty), sample_to_chunk=(empty, empty, empty), chunk_offsets=empty)
+        self.assertEqual(['stts', 'stsc', 'stsz', 'stco'], types)
+
+
+class DecodeTable(unittest.TestCase):
+    def testDeclaredSize(self):
+        stts = render_stts(array(UINT32, [1, 2]), array(UINT32, [5, 6]))
+        self.assertEqual(24, get_table_size('stts', stts))
+        self.assertEqual(12, get_table_size('stsz', render_stsz([7, 7, 7])))
+        self.assertEqual(20, get_table_size('stsz', render_stsz([7, 8])))
+        self.assertEqual(None, get_table_size('stsd', ''))
+        self.assertRaises(ValueError, get_table_size, 'stco', '\0' * 7)
+
+    def testShortTablesAreErrors(self):
+        content = render_stts(array(UINT32, [1, 2]), array(UINT32, [5, 6]))
+        self.assertRaises(ValueError, decode_stts, content[:-1])
+        self.assertRaises(ValueError, decode_stts, content[:6])
+        self.assertRaises(ValueError, decode_stsz, render_stsz([7, 8])[:-4])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Pooled scratch storage for the content of modified atoms.
+
+Rather than each modified atom opening a temporary file of its own,
+every atom's content is kept in a ScratchBuffer from a shared
+ScratchArena. Small content is kept in memory, within a budget shared by
+the whole arena; anything larger (or anything that doesn't fit in the
+budget) spills into a single backing file that the arena divides into
+fixed-size extents, which are reused as buffers are closed.
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+import os
+import tempfile
+import threading
+
+# Largest content kept in memory
+MEMORY_THRESHOLD = 64 * 1024
+# Most memory used by all of an arena's in-memory buffers together
+MEMORY_BUDGET = 64 * 1024 * 1024
+# Size of the extents the backing file is divided into
+EXTENT_SIZE = 256 * 1024
+# Size of the blocks in which lines are searched for
+LINE_BLOCK_SIZE = 8 * 1024
+
+
+class ScratchArena(object):
+    """Scratch storage shared by many ScratchBuffers.
+
+    Buffers of up to <memory_threshold> bytes are kept in memory while
+    all of them together fit in <memory_budget> bytes. Others are stored
+    in extents of <extent_size> bytes in one backing temporary file,
+    which is only created once something spills.
+    """
+    def __init__(self, memory_threshold=MEMORY_THRESHOLD,
+                 memory_budget=MEMORY_BUDGET, extent_size=EXTENT_SIZE):
+        self.memory_threshold = memory_threshold
+        self.memory_budget = memory_budget
+        self.extent_size = extent_size
+        self.memory_used = 0
+        self.extent_count = 0
+        self.__free_extents = []
+        self.__file = None
+        self.__lock = threading.Lock()
+
+    def allocate(self):
+        """Get a new, empty ScratchBuffer"""
+        return ScratchBuffer(self)
+
+    def reserve_memory(self, size):
+        """Reserve <size> more bytes of the memory budget; return whether
+           they could be
+        """
+        with self.__lock:
+            if self.memory_budget < self.memory_used + size:
+                return False
+            self.memory_used += size
+            return True
+
+    def release_memory(self, size):
+        with self.__lock:
+            self.memory_used -= size
+
+    def allocate_extent(self):
+        """Get the number of an unused extent of the backing file"""
+        with self.__lock:
+            if self.__free_extents:
+                return self.__free_extents.pop()
+            if self.__file is None:
+                self.__file = tempfile.TemporaryFile()
+            self.extent_count += 1
+            return self.extent_count - 1
+
+    def release_extents(self, extents):
+        with self.__lock:
+            self.__free_extents.extend(extents)
+
+    def write_at(self, offset, data):
+        with self.__lock:
+            self.__file.seek(offset)
+            self.__file.write(data)
+
+    def readinto_at(self, offset, buffer):
+        """Read from <offset> in the backing file into <buffer>, a writable
+           memoryview, filling it whole
+        """
+        with self.__lock:
+            self.__file.seek(offset)
+            count = self.__file.readinto(buffer)
+        # Parts of extents never written to read as zeroes
+        buffer[count:] = '\0' * (len(buffer) - count)
+
+    def read_at(self, offset, size):
+        with self.__lock:
+            self.__file.seek(offset)
+            data = self.__file.read(size)
+        # Parts of extents never written to read as zeroes
+        return data + '\0' * (size - len(data))
+
+
+class ScratchBuffer(object):
+    """A file-like buffer whose content is kept by a ScratchArena"""
+    def __init__(self, arena):
+        self.arena = arena
+        self.__memory = bytearray()
+        self.__extents = []
+        self.__size = 0
+        self.__position = 0
+
+    def is_in_memory(self):
+        return self.__memory is not None
+
+    def __resize(self, size):
+        """Make room for <size> bytes of content, or drop anything past it.
+           New content in memory is zeroed, but new content in extents must
+           be written (or zeroed) before it is read.
+        """
+        if self.__memory is not None:
+            growth = size - len(self.__memory)
+            if growth <= 0:
+                del self.__memory[size:]
+                self.arena.release_memory(-growth)
+            elif size <= self.arena.memory_threshold \
+             and self.arena.reserve_memory(growth):
+                self.__memory.extend('\0' * growth)
+            else:
+                # Spill the content into extents of the backing file
+                content = str(self.__memory)
+                self.arena.release_memory(len(self.__memory))
+                self.__memory = None
+                self.__resize_extents(size)
+                self.__write_extents(0, content)
+        else:
+            self.__resize_extents(size)
+        self.__size = size
+
+    def __resize_extents(self, size):
+        extent_size = self.arena.extent_size
+        extent_count = (size + extent_size - 1) // extent_size
+        if extent_count < len(self.__extents):
+            self.arena.release_extents(self.__extents[extent_count:])
+            del self.__extents[extent_count:]
+        while len(self.__extents) < extent_count:
+            self.__extents.append(self.arena.allocate_extent())
+
+    def __zero_extents(self, start, end):
+        # Extents are reused, so may hold another buffer's old content
+        while start < end:
+            count = min(self.arena.extent_size, end - start)
+            self.__write_extents(start, '\0' * count)
+            start += count
+
+    def __iter_extents(self, position, size):
+        """Iterate over (file offset, size) of the pieces of extents that
+           hold <size> bytes of content from <position>
+        """
+        extent_size = self.arena.extent_size
+        end = position + size
+        while position < end:
+            (index, offset) = divmod(position, extent_size)
+            count = min(extent_size - offset, end - position)
+            yield (self.__extents[index] * extent_size + offset, count)
+            position += count
+
+    def __write_extents(self, position, data):
+        written = 0
+        for (offset, count) in self.__iter_extents(position, len(data)):
+            self.arena.write_at(offset, data[written:written + count])
+            written += count
+
+    def __read_extents(self, position, size):
+        return ''.join([self.arena.read_at(offset, count) \
+            for (offset, count) in self.__iter_extents(position, size)])
+
+    # File-like behaviours
+
+    def tell(self):
+        return self.__position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if os.SEEK_CUR == whence:
+            offset += self.__position
+        elif os.SEEK_END == whence:
+            offset += self.__size
+        if offset < 0:
+            raise IOError, 'Invalid seek to before the start of the buffer'
+        self.__position = offset
+
+    def read(self, size=-1):
+        remaining = max(0, self.__size - self.__position)
+        if size < 0 or remaining < size:
+            size = remaining
+        if self.__memory is not None:
+            data = str(self.__memory[self.__position:self.__position + size])
+        else:
+            data = self.__read_extents(self.__position, size)
+        self.__position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        """Read into <buffer> without making an intermediate string"""
+        count = max(0, min(len(buffer), self.__size - self.__position))
+        target = memoryview(buffer)
+        if self.__memory is not None:
+            target[:count] = memoryview(self.__memory)[ \
+                self.__position:self.__position + count]
+        else:
+            copied = 0
+            for (offset, size) in self.__iter_extents(self.__position, count):
+                self.arena.readinto_at(offset,
+                                       target[copied:copied + size])
+                copied += size
+        self.__position += count
+        return count
+
+    def readline(self, size=-1):
+        start = self.__position
+        line = ''
+        while size < 0 or len(line) < size:
+            block = self.read(LINE_BLOCK_SIZE)
+            if not block:
+                break
+            end = block.find('\n')
+            if -1 != end:
+                line += block[:end + 1]
+                break
+            line += block
+        if 0 <= size:
+            line = line[:size]
+        self.__position = start + len(line)
+        return line
+
+    def readlines(self, size=0):
+        lines = []
+        read = 0
+        for line in self:
+            lines.append(line)
+            read += len(line)
+            if 0 < size <= read:
+                break
+        return lines
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def __iter__(self):
+        return self
+
+    def write(self, data):
+        end = self.__position + len(data)
+        initial_size = self.__size
+        if initial_size < end:
+            self.__resize(end)
+        if self.__memory is not None:
+            self.__memory[self.__position:end] = data
+        else:
+            # Writing past the end leaves a gap of zeroes, as files do
+            self.__zero_extents(initial_size, self.__position)
+            self.__write_extents(self.__position, data)
+        self.__position = end
+
+    def writelines(self, sequence):
+        for data in sequence:
+            self.write(data)
+
+    def truncate(self, size=None):
+        if size is None:
+            size = self.__position
+        initial_size = self.__size
+        self.__resize(size)
+        if self.__memory is None:
+            self.__zero_extents(initial_size, size)
+
+    def close(self):
+        """Return the buffer's memory or extents to its arena"""
+        if self.__memory is not None:
+            self.arena.release_memory(len(self.__memory))
+            self.__memory = bytearray()
+        self.arena.release_extents(self.__extents)
+        self.__extents = []
+        self.__size = 0
+        self.__position = 0
+
+# The arena that atoms keep their modified content in
+DEFAULT_ARENA = ScratchArena()
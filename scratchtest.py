@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Unit tests for scratch.py
+
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+import os
+import unittest
+
+import atom
+import scratch
+
+class ScratchBufferBehaviour(unittest.TestCase):
+    def setUp(self):
+        self.arena = scratch.ScratchArena(memory_threshold=16,
+                                          memory_budget=40, extent_size=8)
+
+    def testSmallContentStaysInMemory(self):
+        buffer = self.arena.allocate()
+        buffer.write('small')
+        buffer.seek(0)
+        self.assertEqual('small', buffer.read())
+        self.assertTrue(buffer.is_in_memory())
+        self.assertEqual(5, self.arena.memory_used)
+
+    def testLargeContentSpills(self):
+        buffer = self.arena.allocate()
+        buffer.write('0123456789')
+        buffer.write('abcdefghij')
+        self.assertFalse(buffer.is_in_memory())
+        self.assertEqual(0, self.arena.memory_used)
+        self.assertEqual(3, self.arena.extent_count)
+        buffer.seek(5)
+        self.assertEqual('56789abcdefghij', buffer.read())
+        buffer.seek(7)
+        self.assertEqual('789ab', buffer.read(5))
+
+    def testBudgetIsShared(self):
+        buffers = [self.arena.allocate() for index in range(3)]
+        for buffer in buffers:
+            buffer.write('x' * 15)
+        self.assertEqual([True, True, False],
+                         [buffer.is_in_memory() for buffer in buffers])
+        self.assertEqual(30, self.arena.memory_used)
+
+    def testCloseReturnsStorage(self):
+        (small, large) = (self.arena.allocate(), self.arena.allocate())
+        small.write('small')
+        large.write('x' * 20)
+        small.close()
+        large.close()
+        self.assertEqual(0, self.arena.memory_used)
+
+        reused = self.arena.allocate()
+        reused.write('y' * 20)
+        self.assertEqual(3, self.arena.extent_count)
+
+    def testReusedExtentsReadAsZeroes(self):
+        old = self.arena.allocate()
+        old.write('x' * 24)
+        old.close()
+
+        buffer = self.arena.allocate()
+        buffer.write('y' * 17)
+        buffer.seek(20)
+        buffer.write('z')
+        buffer.seek(0)
+        self.assertEqual('y' * 17 + '\0' * 3 + 'z', buffer.read())
+
+    def testCanTruncate(self):
+        buffer = self.arena.allocate()
+        buffer.write('0123456789' * 2)
+        buffer.truncate(12)
+        buffer.seek(0, os.SEEK_END)
+        self.assertEqual(12, buffer.tell())
+        buffer.truncate(14)
+        buffer.seek(0)
+        self.assertEqual('0123456789' + '01\0\0', buffer.read())
+
+    def testCanIterateOverLines(self):
+        buffer = self.arena.allocate()
+        buffer.writelines(['line 1\n', 'a longer line 2\n', 'line 3'])
+        buffer.seek(0)
+        self.assertEqual(['line 1\n', 'a longer line 2\n', 'line 3'],
+                         list(buffer))
+        buffer.seek(0)
+        self.assertEqual('line', buffer.readline(4))
+        self.assertEqual(' 1\n', buffer.readline())
+
+    def testCanReadInto(self):
+        buffer = self.arena.allocate()
+        buffer.write('0123456789' * 2)
+        buffer.seek(6)
+        target = bytearray(10)
+        self.assertEqual(10, buffer.readinto(target))
+        self.assertEqual('6789012345', str(target))
+
+    def testCanReadIntoFromExtents(self):
+        buffer = self.arena.allocate()
+        buffer.write('0123456789abcdefghij')
+        self.assertFalse(buffer.is_in_memory())
+        buffer.seek(5)
+        target = bytearray('-' * 20)
+        self.assertEqual(15, buffer.readinto(target))
+        self.assertEqual('56789abcdefghij' + '-' * 5, str(target))
+        self.assertEqual(0, buffer.readinto(target))
+
+
+class AtomsShareArena(unittest.TestCase):
+    def setUp(self):
+        self.default_arena = scratch.DEFAULT_ARENA
+        scratch.DEFAULT_ARENA = scratch.ScratchArena(memory_threshold=16)
+
+    def tearDown(self):
+        scratch.DEFAULT_ARENA = self.default_arena
+
+    def testModifiedAtomsUseArena(self):
+        data_atoms = [atom.Atom(type='free') for index in range(100)]
+        for data_atom in data_atoms:
+            data_atom.write('tag value')
+        self.assertEqual(900, scratch.DEFAULT_ARENA.memory_used)
+        del data_atoms, data_atom
+        self.assertEqual(0, scratch.DEFAULT_ARENA.memory_used)
+
+
+if __name__ == "__main__":
+    unittest.main()
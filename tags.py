@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Access to the iTunes metadata stored in moov/udta/meta/ilst.
+
+Each tag is an atom in ilst (such as '\xa9nam' or 'trkn') holding one or
+more data atoms, whose values are decoded according to their well-known
+type. Values are only decoded when they're looked up. Cover art can also
+be streamed out of and into files, without holding images in memory.
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+from collections import Mapping, namedtuple
+import os
+from struct import calcsize, pack, unpack
+import StringIO
+
+from atom import ATOM_HEADER, Atom, get_atom_at_path, render_atom_header, \
+    render_free
+from remux import COPY_BLOCK_SIZE
+from sampletable import read_content
+
+TAGS_PATH = 'moov/udta/meta/ilst'
+# Friendlier names for common tags
+TAG_NAMES = {
+    'title': '\xa9nam',
+    'artist': '\xa9ART',
+    'album_artist': 'aART',
+    'album': '\xa9alb',
+    'grouping': '\xa9grp',
+    'composer': '\xa9wrt',
+    'comment': '\xa9cmt',
+    'genre': '\xa9gen',
+    'genre_id': 'gnre',
+    'year': '\xa9day',
+    'track': 'trkn',
+    'disk': 'disk',
+    'tempo': 'tmpo',
+    'compilation': 'cpil',
+    'encoder': '\xa9too',
+    'copyright': 'cprt',
+    'cover': 'covr',
+}
+# Well-known types of data atoms
+IMPLICIT = 0
+UTF8 = 1
+UTF16 = 2
+JPEG = 13
+PNG = 14
+SIGNED_INTEGER = 21
+UNSIGNED_INTEGER = 22
+BMP = 27
+IMAGE_FORMATS = {
+    JPEG: 'jpeg',
+    PNG: 'png',
+    BMP: 'bmp',
+}
+IMAGE_TYPES = dict([(format, data_type) for (data_type, format) \
+    in IMAGE_FORMATS.items()])
+# Tags that may hold several values, such as many pieces of cover art
+LIST_TAGS = ['covr']
+# Data atoms start with their type and a locale
+DATA_HEADER = '>LL'
+
+Image = namedtuple('Image', 'format data')
+
+def decode_integer(data, signed):
+    value = 0
+    for byte in data:
+        value = (value << 8) | ord(byte)
+    if signed and data and ord(data[0]) & 0x80:
+        value -= 1 << (8 * len(data))
+    return value
+
+def decode_data(tag_type, content):
+    """Decode the <content> of a data atom belonging to a <tag_type> tag"""
+    if len(content) < calcsize(DATA_HEADER):
+        raise ValueError, 'Data atom of %r tag has only %d bytes' \
+            % (tag_type, len(content))
+    (data_type, locale) = unpack(DATA_HEADER, content[:8])
+    # The top byte of the type is reserved
+    data_type &= 0xffffff
+    data = content[8:]
+
+    if UTF8 == data_type:
+        return data.decode('utf-8')
+    elif UTF16 == data_type:
+        return data.decode('utf-16-be')
+    elif data_type in IMAGE_FORMATS:
+        return Image(IMAGE_FORMATS[data_type], data)
+    elif data_type in (SIGNED_INTEGER, UNSIGNED_INTEGER):
+        return decode_integer(data, SIGNED_INTEGER == data_type)
+    elif IMPLICIT == data_type and tag_type in ('trkn', 'disk') \
+     and 6 <= len(data):
+        # (number, total)
+        return unpack('>2xHH', data[:6])
+    elif IMPLICIT == data_type and 'gnre' == tag_type and 2 == len(data):
+        return unpack('>H', data)[0]
+    return data
+
+def get_data_atoms(tag_atom):
+    """Get the data atoms of <tag_atom>. Tags whose types aren't known to
+       be containers (such as '\xa9gen' or '----') load as data atoms, so
+       their data atoms are read from their content.
+    """
+    if tag_atom.is_container():
+        return tag_atom.get_children_of_type('data')
+
+    content = read_content(tag_atom)
+    stream = StringIO.StringIO(content)
+    data_atoms = []
+    offset = 0
+    while offset + calcsize(ATOM_HEADER['basic']) <= len(content):
+        atom = Atom(stream, offset, load_children=False)
+        end = atom.get_content_offset() + atom.get_source_size()
+        if end <= offset or len(content) < end:
+            break
+        if 'data' == atom.type:
+            data_atoms.append(atom)
+        offset = end
+    return data_atoms
+
+def get_atom_chain(atoms, target):
+    """Find the atoms from one of <atoms> down to its descendant <target>,
+       or an empty list if <target> isn't among them
+    """
+    for atom in atoms:
+        if atom is target:
+            return [atom]
+        if atom.is_container():
+            chain = get_atom_chain(atom, target)
+            if chain:
+                return [atom] + chain
+    return []
+
+
+class Tags(Mapping):
+    """A read-only, dict-like view of the iTunes tags of <atoms> (such as
+    an Mp4File), keyed by tag type or by a name in TAG_NAMES.
+
+    Each value is decoded when it's first looked up, and kept until its
+    data atoms are written to or replaced.
+    """
+    def __init__(self, atoms):
+        self.atoms = atoms
+        self.__cache = {}
+
+    def get_tags_atom(self):
+        """Get the ilst atom holding the tags, or None if there is none"""
+        return get_atom_at_path(self.atoms, TAGS_PATH)
+
+    def __get_tag_atoms(self):
+        tags_atom = self.get_tags_atom()
+        if tags_atom is None:
+            return []
+        return list(tags_atom)
+
+    def get_tag_atom(self, key):
+        """Get the atom of the tag <key>, or None if there is none"""
+        type = TAG_NAMES.get(key, key)
+        for atom in self.__get_tag_atoms():
+            if atom.type == type:
+                return atom
+        return None
+
+    def __getitem__(self, key):
+        tag_atom = self.get_tag_atom(key)
+        if tag_atom is None:
+            raise KeyError, key
+        type = tag_atom.type
+        # Data atoms read from a tag's content are made afresh each time,
+        # so such a tag's value is kept for as long as the tag is unchanged
+        if tag_atom.is_container():
+            sources = tag_atom.get_children_of_type('data')
+        else:
+            sources = [tag_atom]
+
+        revisions = [atom.get_revision() for atom in sources]
+        if type in self.__cache:
+            (cached_atoms, cached_revisions, value) = self.__cache[type]
+            if revisions == cached_revisions \
+             and len(cached_atoms) == len(sources) \
+             and all([atom is cached_atom for (atom, cached_atom) \
+             in zip(sources, cached_atoms)]):
+                return value
+
+        values = [decode_data(type, read_content(atom)) \
+            for atom in get_data_atoms(tag_atom)]
+        if type in LIST_TAGS:
+            value = values
+        elif 0 == len(values):
+            value = None
+        else:
+            value = values[0]
+        self.__cache[type] = (sources, revisions, value)
+        return value
+
+    def __iter__(self):
+        return iter([atom.type for atom in self.__get_tag_atoms()])
+
+    def __len__(self):
+        return len(self.__get_tag_atoms())
+
+    def __contains__(self, key):
+        return self.get_tag_atom(key) is not None
+
+
+# Cover art
+
+def get_cover_atom(atoms, index=0):
+    """Get the data atom of the <index>th cover image of <atoms>"""
+    cover = Tags(atoms).get_tag_atom('covr')
+    if cover is None:
+        raise KeyError, 'covr'
+    data_atoms = get_data_atoms(cover)
+    if len(data_atoms) <= index:
+        raise IndexError, 'There is no cover image %d' % index
+    return data_atoms[index]
+
+def extract_cover(atoms, stream, index=0, block_size=COPY_BLOCK_SIZE):
+    """Stream the <index>th cover image of <atoms> (such as an Mp4File) to
+       <stream>, <block_size> bytes at a time; return its format.
+    """
+    data_atom = get_cover_atom(atoms, index)
+    initial_position = data_atom.tell()
+    data_atom.seek(0)
+    (data_type, locale) = unpack(DATA_HEADER, data_atom.read(8))
+
+    block = memoryview(bytearray(block_size))
+    count = data_atom.readinto(block)
+    while 0 < count:
+        stream.write(block[:count].tobytes())
+        count = data_atom.readinto(block)
+    data_atom.seek(initial_position)
+    return IMAGE_FORMATS.get(data_type & 0xffffff)
+
+def get_source_end(atom):
+    return atom.get_content_offset() + atom.get_source_size()
+
+def find_adjacent_free(atoms, chain):
+    """Find free padding starting where the last atom of <chain> ends: a
+       free atom following it, or following an ancestor it is the last
+       child of. Return the atoms of <chain> that must grow to take in
+       the padding and the free atom, or None if there is none.
+    """
+    parents = [atoms] + chain[:-1]
+    for depth in range(len(chain) - 1, -1, -1):
+        (parent, atom) = (parents[depth], chain[depth])
+        siblings = list(parent)
+        index = [index for (index, sibling) in enumerate(siblings) \
+            if sibling is atom][0]
+        if index + 1 < len(siblings):
+            following = siblings[index + 1]
+            if following.type in ('free', 'skip') \
+             and following.get_source_offset() == get_source_end(atom):
+                return (chain[depth:], following)
+            return None
+        if 0 == depth or get_source_end(parent) != get_source_end(atom):
+            return None
+    return None
+
+def resize_header(stream, atom, growth):
+    """Rewrite the header of loaded <atom> in place, for content <growth>
+       bytes larger
+    """
+    header_size = atom.get_content_offset() - atom.get_source_offset()
+    size = header_size + atom.get_source_size() + growth
+    if calcsize(ATOM_HEADER['large']) == header_size:
+        header = pack(ATOM_HEADER['large'], 1, atom.type, size)
+    elif size < 2**32:
+        header = pack(ATOM_HEADER['basic'], size, atom.type)
+    else:
+        raise ValueError, '%s is too large for its header' % atom.type
+    stream.seek(atom.get_source_offset())
+    stream.write(header)
+
+def move_tail(stream, start, distance, block_size=COPY_BLOCK_SIZE):
+    """Move everything from <start> to the end of <stream> <distance>
+       bytes later (or earlier, if negative)
+    """
+    stream.seek(0, os.SEEK_END)
+    end = stream.tell()
+    if 0 < distance:
+        # Copy from the end, so nothing is overwritten before it's moved
+        position = end
+        while start < position:
+            block_start = max(start, position - block_size)
+            stream.seek(block_start)
+            block = stream.read(position - block_start)
+            stream.seek(block_start + distance)
+            stream.write(block)
+            position = block_start
+    else:
+        position = start
+        while position < end:
+            stream.seek(position)
+            block = stream.read(min(block_size, end - position))
+            stream.seek(position + distance)
+            stream.write(block)
+            position += len(block)
+        stream.truncate(end + distance)
+
+def replace_cover(mp4file, image, format='jpeg', index=0, size=None,
+                  block_size=COPY_BLOCK_SIZE):
+    """Replace the <index>th cover image of <mp4file> (an Mp4File) in its
+       file, streaming the new image from the file-like <image> (<size>
+       bytes of it, or the rest of it by default) in blocks of
+       <block_size> bytes.
+
+       The image goes where the old one was if it fits, leaving any space
+       to spare as free padding, or taking the space it lacks from free
+       padding that directly follows it. Otherwise, everything after the
+       image is moved along to make room, which is only possible if no
+       media follows it; ValueError is raised if some does.
+
+       <mp4file> describes the old layout afterwards, so should be loaded
+       again.
+    """
+    if format not in IMAGE_TYPES:
+        raise ValueError, 'Unknown image format %s' % format
+    if size is None:
+        position = image.tell()
+        image.seek(0, os.SEEK_END)
+        size = image.tell() - position
+        image.seek(position)
+
+    data_atom = get_cover_atom(mp4file, index)
+    header = render_atom_header('data', calcsize(DATA_HEADER) + size) \
+        + pack(DATA_HEADER, IMAGE_TYPES[format], 0)
+    growth = len(header) + size \
+        - (get_source_end(data_atom) - data_atom.get_source_offset())
+    chain = get_atom_chain(mp4file, data_atom)
+
+    stream = open(mp4file.filename, 'r+b')
+    try:
+        padding = find_adjacent_free(mp4file, chain)
+        if padding is not None:
+            (resized, free) = padding
+            free_size = get_source_end(free) - free.get_source_offset()
+            remaining = free_size - growth
+            # What's left must be nothing, or big enough to be an atom
+            if remaining < 0 \
+             or 0 < remaining < calcsize(ATOM_HEADER['basic']):
+                padding = None
+
+        if 0 == growth:
+            resized = []
+        elif padding is not None:
+            if 0 < remaining:
+                stream.seek(free.get_source_offset() + growth)
+                stream.write(render_free(remaining))
+        elif calcsize(ATOM_HEADER['basic']) <= -growth:
+            # Leave the spare space as free padding after the image
+            stream.seek(get_source_end(data_atom) + growth)
+            stream.write(render_free(-growth))
+            resized = []
+        elif [atom for atom in mp4file if 'mdat' == atom.type \
+         and get_source_end(data_atom) <= atom.get_source_offset()]:
+            raise ValueError, 'Cannot move media to make room for the image'
+        else:
+            move_tail(stream, get_source_end(data_atom), growth, block_size)
+            resized = chain
+
+        for atom in resized:
+            if atom is not data_atom:
+                resize_header(stream, atom, growth)
+
+        stream.seek(data_atom.get_source_offset())
+        stream.write(header)
+        while 0 < size:
+            block = image.read(min(block_size, size))
+            if not block:
+                raise EOFError, 'The image ended %d bytes early' % size
+            stream.write(block)
+            size -= len(block)
+    finally:
+        stream.close()
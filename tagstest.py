@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Unit tests for tags.py
+
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+import os
+import shutil
+from struct import pack
+import StringIO
+import tempfile
+import unittest
+
+from atom import Atom, render_atom_header
+from mp4file import Mp4File
+import remux
+import tags
+from tags import extract_cover, render_free, replace_cover
+
+def render_data(data_type, data):
+    content = pack(tags.DATA_HEADER, data_type, 0) + data
+    return render_atom_header('data', len(content)) + content
+
+def render_tagged_movie(tag_values, padding=0):
+    """Render a moov holding <tag_values>, a list of (type, [(data_type,
+       data)]) for each tag, followed within the moov by a free atom of
+       <padding> bytes (if any)
+    """
+    ilst = ''
+    for (type, values) in tag_values:
+        content = ''.join([render_data(*value) for value in values])
+        ilst += render_atom_header(type, len(content)) + content
+    return render_ilst_movie(ilst, padding)
+
+def render_ilst_movie(ilst, padding=0):
+    """Render a moov holding the content <ilst>, as render_tagged_movie"""
+    meta = pack('>4x') + render_atom_header('ilst', len(ilst)) + ilst
+    udta = render_atom_header('meta', len(meta)) + meta
+    moov = render_atom_header('udta', len(udta)) + udta
+    if padding:
+        moov += render_free(padding)
+    return render_atom_header('moov', len(moov)) + moov
+
+
+class ReadTags(unittest.TestCase):
+    tag_values = [
+        ('\xa9nam', [(tags.UTF8, 'Caf\xc3\xa9')]),
+        ('\xa9ART', [(tags.UTF8, 'Artist')]),
+        ('trkn', [(tags.IMPLICIT, pack('>HHHH', 0, 3, 12, 0))]),
+        ('gnre', [(tags.IMPLICIT, pack('>H', 8))]),
+        ('tmpo', [(tags.SIGNED_INTEGER, pack('>h', 120))]),
+        ('cpil', [(tags.SIGNED_INTEGER, pack('>b', -1))]),
+        ('covr', [(tags.JPEG, '\xff\xd8jpeg'), (tags.PNG, '\x89PNG')]),
+        ('\xa9gen', [(tags.UTF8, 'Jazz')]),
+    ]
+
+    def setUp(self):
+        stream = StringIO.StringIO(render_tagged_movie(self.tag_values))
+        self.atoms = [Atom(stream)]
+        self.tags = tags.Tags(self.atoms)
+
+    def testListsTagTypes(self):
+        self.assertEqual([type for (type, values) in self.tag_values],
+                         list(self.tags))
+        self.assertEqual(len(self.tag_values), len(self.tags))
+
+    def testDecodesText(self):
+        self.assertEqual(u'Caf\xe9', self.tags['\xa9nam'])
+
+    def testLooksUpByName(self):
+        self.assertEqual(u'Artist', self.tags['artist'])
+        self.assertTrue('title' in self.tags)
+        self.assertFalse('album' in self.tags)
+
+    def testDecodesNumberPairs(self):
+        self.assertEqual((3, 12), self.tags['track'])
+
+    def testDecodesIntegers(self):
+        self.assertEqual(8, self.tags['gnre'])
+        self.assertEqual(120, self.tags['tempo'])
+        self.assertEqual(-1, self.tags['compilation'])
+
+    def testDecodesEveryImage(self):
+        self.assertEqual([tags.Image('jpeg', '\xff\xd8jpeg'),
+                          tags.Image('png', '\x89PNG')], self.tags['cover'])
+
+    def testDecodesTagsThatLoadAsData(self):
+        self.assertEqual(u'Jazz', self.tags['genre'])
+        self.assertTrue(self.tags['genre'] is self.tags['genre'])
+
+    def testDecodesFreeformTags(self):
+        name = pack('>L', 0) + 'iTunNORM'
+        content = render_atom_header('name', len(name)) + name \
+            + render_data(tags.UTF8, 'normalised')
+        moov = render_ilst_movie(render_atom_header('----', len(content)) \
+            + content)
+        freeform_tags = tags.Tags([Atom(StringIO.StringIO(moov))])
+        self.assertEqual(['----'], list(freeform_tags))
+        self.assertEqual(u'normalised', freeform_tags['----'])
+
+    def testShortDataIsValueError(self):
+        self.assertRaises(ValueError, tags.decode_data, '\xa9nam', '\0' * 7)
+
+    def testMissingTagIsKeyError(self):
+        self.assertRaises(KeyError, self.tags.__getitem__, '\xa9alb')
+        self.assertEqual(None, self.tags.get('album'))
+
+    def testValueIsCached(self):
+        self.assertTrue(self.tags['covr'] is self.tags['covr'])
+
+    def testCacheIsClearedByWrite(self):
+        self.tags['title']
+        data_atom = self.tags.get_tags_atom()[0][0]
+        data_atom.seek(8)
+        data_atom.truncate()
+        data_atom.write('New title')
+        self.assertEqual(u'New title', self.tags['title'])
+
+    def testCacheIsClearedByReplacement(self):
+        self.tags['artist']
+        artist = self.tags.get_tags_atom()[1]
+        replacement = Atom(StringIO.StringIO(render_data(tags.UTF8, 'Other')))
+        artist[0:] = [replacement]
+        self.assertEqual(u'Other', self.tags['artist'])
+
+    def testFileWithoutTagsIsEmpty(self):
+        stream = StringIO.StringIO(render_atom_header('moov', 0))
+        self.assertEqual(0, len(tags.Tags([Atom(stream)])))
+
+
+class FileTags(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'file.m4a')
+        ftyp = pack('>4sL4s', 'M4A ', 0, 'M4A ')
+        open(self.path, 'wb').write(render_atom_header('ftyp', len(ftyp)) \
+            + ftyp + render_tagged_movie([('\xa9alb', [(tags.UTF8, 'LP')])]))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testFileHasTags(self):
+        mp4file = Mp4File(self.path)
+        self.assertEqual(u'LP', mp4file.tags['album'])
+        self.assertTrue(mp4file.tags is mp4file.tags)
+
+
+class CoverArt(unittest.TestCase):
+    cover = '\xff\xd8' + 'old image' * 10
+    media = 'media' * 20
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'file.m4a')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_file(self, moov_first=False, padding=0):
+        ftyp = pack('>4sL4s', 'M4A ', 0, 'M4A ')
+        ftyp = render_atom_header('ftyp', len(ftyp)) + ftyp
+        mdat = render_atom_header('mdat', len(self.media)) + self.media
+        moov = render_tagged_movie([('\xa9nam', [(tags.UTF8, 'Title')]),
+            ('covr', [(tags.JPEG, self.cover)])], padding)
+        if moov_first:
+            (mdat, moov) = (moov, mdat)
+        open(self.path, 'wb').write(ftyp + mdat + moov)
+
+    def replace(self, image, format='png'):
+        replace_cover(Mp4File(self.path), StringIO.StringIO(image), format,
+                      block_size=7)
+        return Mp4File(self.path)
+
+    def assertMediaIsIntact(self, mp4file):
+        mdat = mp4file.get_children_of_type('mdat')[0]
+        mdat.seek(0)
+        self.assertEqual(self.media, mdat.read())
+        self.assertEqual(u'Title', mp4file.tags['title'])
+        self.assertTrue(mp4file.validate().is_valid())
+
+    def testExtractsImage(self):
+        self.write_file()
+        image = StringIO.StringIO()
+        self.assertEqual('jpeg', extract_cover(Mp4File(self.path), image,
+                                               block_size=7))
+        self.assertEqual(self.cover, image.getvalue())
+
+    def testReplacesImageOfSameSize(self):
+        self.write_file(moov_first=True)
+        size = os.path.getsize(self.path)
+        image = 'n' * len(self.cover)
+        mp4file = self.replace(image)
+        self.assertEqual([tags.Image('png', image)], mp4file.tags['cover'])
+        self.assertEqual(size, os.path.getsize(self.path))
+        self.assertMediaIsIntact(mp4file)
+
+    def testSmallerImageLeavesPadding(self):
+        self.write_file(moov_first=True)
+        size = os.path.getsize(self.path)
+        mp4file = self.replace('small')
+        self.assertEqual([tags.Image('png', 'small')], mp4file.tags['cover'])
+        self.assertEqual(size, os.path.getsize(self.path))
+        self.assertEqual(['data', 'free'],
+            [atom.type for atom in mp4file.tags.get_tag_atom('covr')])
+        self.assertMediaIsIntact(mp4file)
+
+    def testLargerImageUsesAdjacentPadding(self):
+        self.write_file(moov_first=True, padding=100)
+        size = os.path.getsize(self.path)
+        image = 'n' * (len(self.cover) + 50)
+        mp4file = self.replace(image)
+        self.assertEqual([tags.Image('png', image)], mp4file.tags['cover'])
+        self.assertEqual(size, os.path.getsize(self.path))
+        self.assertEqual(50, mp4file.get_movie()[-1].get_size())
+        self.assertMediaIsIntact(mp4file)
+
+    def testLargerImageMovesTrailingMovie(self):
+        self.write_file()
+        size = os.path.getsize(self.path)
+        image = 'n' * (len(self.cover) + 50)
+        mp4file = self.replace(image)
+        self.assertEqual([tags.Image('png', image)], mp4file.tags['cover'])
+        self.assertEqual(size + 50, os.path.getsize(self.path))
+        self.assertMediaIsIntact(mp4file)
+
+    def testSlightlySmallerImageMovesTrailingMovie(self):
+        self.write_file()
+        size = os.path.getsize(self.path)
+        image = self.cover[:-3]
+        mp4file = self.replace(image)
+        self.assertEqual([tags.Image('png', image)], mp4file.tags['cover'])
+        self.assertEqual(size - 3, os.path.getsize(self.path))
+        self.assertMediaIsIntact(mp4file)
+
+    def testRepackedFileIsEditedInPlace(self):
+        self.write_file()
+        repacked_path = os.path.join(self.directory, 'repacked.m4a')
+        output = open(repacked_path, 'wb')
+        remux.repack(Mp4File(self.path), output, padding=100)
+        output.close()
+        os.rename(repacked_path, self.path)
+
+        size = os.path.getsize(self.path)
+        image = 'n' * (len(self.cover) + 50)
+        mp4file = self.replace(image)
+        self.assertEqual([tags.Image('png', image)], mp4file.tags['cover'])
+        self.assertEqual(size, os.path.getsize(self.path))
+        self.assertEqual(['ftyp', 'moov', 'free', 'mdat'],
+                         [atom.type for atom in mp4file])
+        self.assertMediaIsIntact(mp4file)
+
+    def testCannotMoveMedia(self):
+        self.write_file(moov_first=True)
+        self.assertRaises(ValueError, self.replace, self.cover * 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Access to the headers and sample tables of movie tracks.
+
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import repeat
+from operator import add
+from struct import calcsize, pack, unpack
+
+from sampletable import INT64, SampleTable, decode_elst, read_content
+
+# Field layouts of full-box headers, after the version and flags, for
+# version 0 and version 1 boxes respectively
+HEADER_FIELDS = {
+    'mvhd': ('>LLLL', '>QQLQ'),
+    'mdhd': ('>LLLL', '>QQLQ'),
+    'tkhd': ('>LLLLL', '>QQLLQ'),
+}
+# Index of each header's duration field within its layout
+HEADER_DURATION_FIELD = {
+    'mvhd': 3,
+    'mdhd': 3,
+    'tkhd': 4,
+}
+
+def parse_header(atom):
+    """Parse the leading fields of an mvhd, mdhd or tkhd <atom>; return
+       (version, fields)
+    """
+    content = read_content(atom)
+    version = ord(content[0])
+    layout = HEADER_FIELDS[atom.type][version and 1 or 0]
+    fields = unpack(layout, content[4:4 + calcsize(layout)])
+    return (version, fields)
+
+def get_header_duration(atom):
+    """Get the duration from an mvhd, mdhd or tkhd <atom>"""
+    (version, fields) = parse_header(atom)
+    return fields[HEADER_DURATION_FIELD[atom.type]]
+
+def set_header_duration(atom, duration):
+    """Set the duration of an mvhd, mdhd or tkhd <atom>, upgrading it to
+       a version 1 header if the duration doesn't fit in 32 bits
+    """
+    content = read_content(atom)
+    version = ord(content[0])
+    layout = HEADER_FIELDS[atom.type][version and 1 or 0]
+    fields = list(unpack(layout, content[4:4 + calcsize(layout)]))
+    fields[HEADER_DURATION_FIELD[atom.type]] = duration
+
+    if 0 == version and 2**32 <= duration:
+        # Version 1 only widens the leading fields, so the rest carries over
+        rest = content[4 + calcsize(layout):]
+        version = 1
+        layout = HEADER_FIELDS[atom.type][1]
+        content = pack('>B', version) + content[1:4] + pack(layout, *fields)
+        content += rest
+        atom.seek(0)
+        atom.truncate(0)
+        atom.write(content)
+    else:
+        atom.seek(4)
+        atom.write(pack(layout, *fields))
+    atom.seek(0)
+
+def get_movie_timescale(moov):
+    """Get the timescale from a <moov>'s movie header"""
+    return parse_header(moov.get_children_of_type('mvhd')[0])[1][2]
+
+def is_in_window(time, start, end):
+    """Check whether <time> lies from <start> up to (but excluding) <end>,
+       or anywhere from <start> if <end> is None
+    """
+    return start <= time and (end is None or time < end)
+
+
+class Timeline(object):
+    """The decode and presentation times of a track's samples, combining
+       its time-to-sample, composition offset and edit list tables. Times
+       are in media timescale units.
+
+       Each edit that shows media maps a window of composition times onto
+       the presentation timeline; empty edits and dwells only delay what
+       follows. A sample shown by more than one edit takes the time of the
+       first, and samples no edit shows keep the first edit's mapping.
+    """
+    def __init__(self, sample_table, timescale, movie_timescale,
+                 edit_list=None):
+        self.timescale = timescale
+        self.movie_timescale = movie_timescale
+        self.__decode_times = sample_table.get_decode_times()
+        offsets = sample_table.get_sample_composition_offsets()
+        self.__composition_times = array(INT64,
+            map(add, self.__decode_times, offsets))
+        if offsets:
+            self.__offset_range = (min(offsets), max(offsets))
+        else:
+            self.__offset_range = (0, 0)
+
+        self.__segments = self.__get_segments(edit_list)
+        self.__presentation_times = None
+        self.__visible_range = None
+        self.__presentation_order = None
+
+    def __get_segments(self, edit_list):
+        """Get (presentation start, media start, media end) of each edit
+           that shows media, with a media end of None for an edit that
+           runs to the end of the media
+        """
+        if edit_list is None or 0 == len(edit_list[0]):
+            return [(0, 0, None)]
+        segments = []
+        start = 0
+        for (duration, media_time, rate) in zip(*edit_list):
+            # Segment durations are in movie timescale units
+            duration = duration * self.timescale // self.movie_timescale
+            if 0 <= media_time and 0 != rate:
+                media_end = None
+                if 0 < duration:
+                    media_end = media_time + duration
+                segments.append((start, media_time, media_end))
+            start += duration
+        return segments
+
+    def __find_samples(self, media_start, media_end):
+        """Find the range of samples, in decode order, spanning those
+           whose composition times lie from <media_start> up to (but
+           excluding) <media_end>. Only samples within the composition
+           offsets of the range's ends are looked at one by one.
+        """
+        decode_times = self.__decode_times
+        composition_times = self.__composition_times
+        (min_offset, max_offset) = self.__offset_range
+        def is_shown(sample):
+            return is_in_window(composition_times[sample], media_start,
+                                media_end)
+
+        first = bisect_left(decode_times, media_start - max_offset)
+        last = len(decode_times)
+        if media_end is not None:
+            last = bisect_left(decode_times, media_end - min_offset)
+        while first < last and not is_shown(first):
+            first += 1
+        while first < last and not is_shown(last - 1):
+            last -= 1
+        return (first, last)
+
+    def get_decode_times(self):
+        return self.__decode_times
+
+    def get_composition_times(self):
+        """Get each sample's composition time, before edits"""
+        return self.__composition_times
+
+    def get_presentation_times(self):
+        """Get each sample's presentation time, after edits"""
+        if self.__presentation_times is None:
+            composition_times = self.__composition_times
+            count = len(composition_times)
+            shift = 0
+            if self.__segments:
+                (start, media_start, media_end) = self.__segments[0]
+                shift = start - media_start
+            times = array(INT64, map(add, composition_times,
+                                     repeat(shift, count)))
+
+            (first_visible, last_visible) = (count, 0)
+            # Earlier edits are applied last, so their times win
+            for (start, media_start, media_end) in reversed(self.__segments):
+                (first, last) = self.__find_samples(media_start, media_end)
+                if last <= first:
+                    continue
+                first_visible = min(first_visible, first)
+                last_visible = max(last_visible, last)
+                if 1 < len(self.__segments):
+                    # Only the samples this edit shows take its mapping
+                    shift = start - media_start
+                    for sample in xrange(first, last):
+                        time = composition_times[sample]
+                        if is_in_window(time, media_start, media_end):
+                            times[sample] = time + shift
+            if last_visible < first_visible:
+                (first_visible, last_visible) = (0, 0)
+
+            self.__presentation_times = times
+            self.__visible_range = (first_visible, last_visible)
+        return self.__presentation_times
+
+    def get_visible_range(self):
+        """Get (first, last) such that the samples any edit shows all lie
+           from sample <first> up to (but excluding) sample <last>, in
+           decode order
+        """
+        self.get_presentation_times()
+        return self.__visible_range
+
+    def get_sample_at(self, time):
+        """Get the index of the visible sample being presented at
+           presentation <time>, or None if no sample is presented yet
+        """
+        if self.__presentation_order is None:
+            times = self.get_presentation_times()
+            (first, last) = self.get_visible_range()
+            order = sorted(xrange(first, last), key=times.__getitem__)
+            self.__presentation_order = (
+                array(INT64, [times[sample] for sample in order]), order)
+        (sorted_times, order) = self.__presentation_order
+        index = bisect_right(sorted_times, time)
+        if 0 == index:
+            return None
+        return order[index - 1]
+
+
+class Track(object):
+    """A trak atom, with convenient access to its headers and its
+       decoded sample table
+    """
+    def __init__(self, trak):
+        self.trak = trak
+        self.__sample_table = None
+        self.__timeline = None
+
+    def __get_descendant(self, *path):
+        atom = self.trak
+        for type in path:
+            children = atom.get_children_of_type(type)
+            if 0 == len(children):
+                return None
+            atom = children[0]
+        return atom
+
+    def get_track_header(self):
+        return self.__get_descendant('tkhd')
+
+    def get_media_header(self):
+        return self.__get_descendant('mdia', 'mdhd')
+
+    def get_handler_type(self):
+        """Get the handler type (eg. 'vide' or 'soun') of the track's media"""
+        hdlr = self.__get_descendant('mdia', 'hdlr')
+        if hdlr is None:
+            return None
+        # Handler type follows version, flags and a predefined field
+        return read_content(hdlr)[8:12]
+
+    def get_track_id(self):
+        return parse_header(self.get_track_header())[1][2]
+
+    def get_timescale(self):
+        """Get the media timescale, in units per second"""
+        return parse_header(self.get_media_header())[1][2]
+
+    def get_duration(self):
+        """Get the media duration, in media timescale units"""
+        return get_header_duration(self.get_media_header())
+
+    def get_sample_table_atom(self):
+        return self.__get_descendant('mdia', 'minf', 'stbl')
+
+    def get_sample_table(self):
+        if self.__sample_table is None:
+            self.__sample_table = SampleTable(self.get_sample_table_atom())
+        return self.__sample_table
+
+    def get_edit_list(self):
+        """Return the (segment_durations, media_times, media_rates) of the
+           track's edit list, or None if it has none
+        """
+        elst = self.__get_descendant('edts', 'elst')
+        if elst is None:
+            return None
+        return decode_elst(read_content(elst))
+
+    def get_timeline(self, movie_timescale):
+        """Get the track's Timeline, given the <movie_timescale> its edit
+           list durations are measured in. The timeline is kept, so it's
+           only computed once.
+        """
+        if self.__timeline is None \
+         or movie_timescale != self.__timeline.movie_timescale:
+            self.__timeline = Timeline(self.get_sample_table(),
+                self.get_timescale(), movie_timescale, self.get_edit_list())
+        return self.__timeline
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Unit tests for track.py
+
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+from struct import pack
+import StringIO
+import unittest
+
+from atom import Atom
+from remuxtest import render, render_full
+from sampletable import decode_elst
+from track import Track
+
+MEDIA_TIMESCALE = 100
+MOVIE_TIMESCALE = 50
+
+def render_elst(edits, version=0):
+    """Render an elst of <edits>, each (duration, media time, rate)"""
+    layout = ('>LlhH', '>QqhH')[version]
+    entries = ''.join([pack(layout, duration, media_time, int(rate),
+        int(rate * 65536) % 65536) for (duration, media_time, rate) in edits])
+    return render_full('elst', pack('>L', len(edits)) + entries, version)
+
+def render_trak(durations, composition_offsets=None, edits=None):
+    """Render a trak of samples with <durations> and (optionally)
+       <composition_offsets>, with an edit list of <edits> if given
+    """
+    count = len(durations)
+    stts = ''.join([pack('>LL', 1, duration) for duration in durations])
+    tables = render_full('stts', pack('>L', count) + stts)
+    if composition_offsets is not None:
+        ctts = ''.join([pack('>LL', 1, offset) \
+            for offset in composition_offsets])
+        tables += render_full('ctts', pack('>L', count) + ctts)
+    tables += render_full('stsc', pack('>LLLL', 1, 1, count, 1)) \
+        + render_full('stsz', pack('>LL', 1, count)) \
+        + render_full('stco', pack('>LL', 1, 0))
+
+    edts = ''
+    if edits is not None:
+        edts = render('edts', edits)
+    trak = render('trak', edts + render('mdia',
+        render_full('mdhd', pack('>LLLL', 0, 0, MEDIA_TIMESCALE,
+                                 sum(durations)))
+        + render('minf', render('stbl', tables))))
+    return Track(Atom(StringIO.StringIO(trak)))
+
+
+class DecodeEditList(unittest.TestCase):
+    def testDecodesVersion0(self):
+        content = render_elst([(10, -1, 1), (20, 5, 1), (30, 7, 0.5)])[8:]
+        (durations, media_times, rates) = decode_elst(content)
+        self.assertEqual([10, 20, 30], list(durations))
+        self.assertEqual([-1, 5, 7], list(media_times))
+        self.assertEqual([1.0, 1.0, 0.5], list(rates))
+
+    def testDecodesVersion1(self):
+        content = render_elst([(2**40, 2**33, 1)], version=1)[8:]
+        (durations, media_times, rates) = decode_elst(content)
+        self.assertEqual([2**40], list(durations))
+        self.assertEqual([2**33], list(media_times))
+
+
+class TrackTimeline(unittest.TestCase):
+    # An I P B B P pattern, presented at 10, 40, 20, 30 and 50
+    durations = [10] * 5
+    composition_offsets = [10, 30, 0, 0, 10]
+
+    def testWithoutEditsPresentsCompositionTimes(self):
+        timeline = render_trak(self.durations, self.composition_offsets) \
+            .get_timeline(MOVIE_TIMESCALE)
+        self.assertEqual([0, 10, 20, 30, 40],
+                         list(timeline.get_decode_times()))
+        self.assertEqual([10, 40, 20, 30, 50],
+                         list(timeline.get_presentation_times()))
+        self.assertEqual((0, 5), timeline.get_visible_range())
+
+    def testEmptyEditListIsIgnored(self):
+        timeline = render_trak(self.durations, edits=render_elst([])) \
+            .get_timeline(MOVIE_TIMESCALE)
+        self.assertEqual([0, 10, 20, 30, 40],
+                         list(timeline.get_presentation_times()))
+        self.assertEqual((0, 5), timeline.get_visible_range())
+
+    def testEditsShiftAndTrim(self):
+        # Delay by 6, then show media from 10 up to 50
+        edits = render_elst([(3, -1, 1), (20, 10, 1)])
+        timeline = render_trak(self.durations, self.composition_offsets,
+                               edits).get_timeline(MOVIE_TIMESCALE)
+        self.assertEqual([6, 36, 16, 26, 46],
+                         list(timeline.get_presentation_times()))
+        self.assertEqual((0, 4), timeline.get_visible_range())
+
+    def testVisibleRangeSkipsHiddenSamples(self):
+        # Show media from 20 up to 40, which only samples 2 and 3 lie in
+        edits = render_elst([(10, 20, 1)])
+        timeline = render_trak(self.durations, self.composition_offsets,
+                               edits).get_timeline(MOVIE_TIMESCALE)
+        self.assertEqual((2, 4), timeline.get_visible_range())
+
+    def testLaterEditsMapTheirOwnSamples(self):
+        # Show media from 10 up to 30, then from 40 up to 60
+        edits = render_elst([(10, 10, 1), (10, 40, 1)])
+        timeline = render_trak(self.durations, self.composition_offsets,
+                               edits).get_timeline(MOVIE_TIMESCALE)
+        self.assertEqual([0, 20, 10, 20, 30],
+                         list(timeline.get_presentation_times()))
+        self.assertEqual((0, 5), timeline.get_visible_range())
+
+    def testFindsPresentedSample(self):
+        edits = render_elst([(3, -1, 1), (20, 10, 1)])
+        timeline = render_trak(self.durations, self.composition_offsets,
+                               edits).get_timeline(MOVIE_TIMESCALE)
+        self.assertEqual(None, timeline.get_sample_at(5))
+        self.assertEqual(0, timeline.get_sample_at(6))
+        self.assertEqual(2, timeline.get_sample_at(20))
+        self.assertEqual(1, timeline.get_sample_at(36))
+        self.assertEqual(1, timeline.get_sample_at(1000))
+
+    def testTimelineIsCached(self):
+        track = render_trak(self.durations)
+        self.assertTrue(track.get_timeline(MOVIE_TIMESCALE) \
+            is track.get_timeline(MOVIE_TIMESCALE))
+        self.assertEqual(1000, track.get_timeline(1000).movie_timescale)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Integrity checks for the structure and sample tables of MP4 files.
+
+Checks work only from atom headers and sample tables, so media data is
+never read.
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+from bisect import bisect_right
+from collections import namedtuple
+from struct import calcsize, error as StructError
+
+from atom import ATOM_HEADER, walk_atoms
+from sampletable import get_table_size, read_content
+
+ERROR = 'error'
+WARNING = 'warning'
+
+Problem = namedtuple('Problem', 'severity path message')
+
+
+class ValidationReport(list):
+    """The problems found in a file, in the order they were found"""
+    def add(self, severity, path, message):
+        self.append(Problem(severity, path, message))
+
+    def get_errors(self):
+        return [problem for problem in self if ERROR == problem.severity]
+
+    def get_warnings(self):
+        return [problem for problem in self if WARNING == problem.severity]
+
+    def is_valid(self):
+        """Whether no errors were found; warnings are allowed"""
+        return 0 == len(self.get_errors())
+
+    def __str__(self):
+        return '\n'.join(['%s: %s: %s' % problem for problem in self])
+
+
+def check_structure(atoms, file_size, report):
+    """Check that each loaded atom lies within its parent, and each root
+       atom within the file
+    """
+    parent_ends = {'': file_size}
+    loaded_atoms = [atom for atom in atoms \
+        if atom.get_content_offset() is not None]
+    if loaded_atoms:
+        end = loaded_atoms[-1].get_content_offset() \
+            + loaded_atoms[-1].get_source_size()
+        if end < file_size:
+            report.add(WARNING, '', '%d trailing bytes at the end of the file' \
+                % (file_size - end))
+    for (path, atom) in walk_atoms(atoms):
+        offset = atom.get_content_offset()
+        size = atom.get_source_size()
+        if offset is None:
+            continue
+
+        parent_path = path[:path.rfind('/') + 1]
+        if parent_path not in parent_ends:
+            # Parent was created rather than loaded, so has no extent
+            continue
+        parent_end = parent_ends[parent_path]
+        if size < 0:
+            report.add(ERROR, path, 'size is smaller than its header')
+            continue
+        if parent_end < offset + size:
+            report.add(ERROR, path, 'extends %d bytes past the end of its %s' \
+                % (offset + size - parent_end, parent_path and 'parent' or 'file'))
+
+        if atom.is_container():
+            parent_ends[path + '/'] = min(offset + size, parent_end)
+            if 0 < len(atom):
+                last_child = atom[-1]
+                unused = offset + size - (last_child.get_content_offset() \
+                    + last_child.get_source_size())
+                if 0 < unused < calcsize(ATOM_HEADER['basic']):
+                    report.add(WARNING, path,
+                        '%d trailing bytes after its last child' % unused)
+
+def check_table_sizes(path, stbl, report):
+    """Check that each of an stbl's tables holds the entries its header
+       declares; return whether they all do
+    """
+    consistent = True
+    for child in stbl:
+        if child.is_container():
+            continue
+        content = read_content(child)
+        try:
+            size = get_table_size(child.type, content)
+        except ValueError, e:
+            report.add(ERROR, '%s/%s' % (path, child.type), str(e))
+            consistent = False
+            continue
+        if size is None:
+            continue
+        if len(content) < size:
+            report.add(ERROR, '%s/%s' % (path, child.type),
+                'declares %d bytes of content, but has only %d' % (size,
+                len(content)))
+            consistent = False
+        elif size < len(content):
+            report.add(WARNING, '%s/%s' % (path, child.type),
+                '%d trailing bytes after its entries' % (len(content) - size))
+    return consistent
+
+def check_counts(path, table, report):
+    """Check that a sample table's tables agree on the number of samples;
+       return whether they do
+    """
+    sample_count = table.get_sample_count()
+    counts = [('stts', sum(table.get_time_to_sample()[0])),
+              ('stsc', sum(table.get_samples_per_chunk()))]
+    composition_offsets = table.get_composition_offsets()
+    if composition_offsets is not None:
+        counts.append(('ctts', sum(composition_offsets[0])))
+
+    consistent = True
+    for (type, count) in counts:
+        if count != sample_count:
+            report.add(ERROR, '%s/%s' % (path, type),
+                'describes %d samples, but stsz has %d' % (count, sample_count))
+            consistent = False
+    return consistent
+
+def check_sample_to_chunk(path, table, report):
+    (first_chunks, samples_per_chunk, description_indices) = \
+        table.get_sample_to_chunk()
+    chunk_count = table.get_chunk_count()
+    description = table.get_sample_description()
+    description_count = description is not None and len(description) or 0
+    path += '/stsc'
+
+    if 0 < len(first_chunks) and 1 != first_chunks[0]:
+        report.add(ERROR, path, 'first entry starts at chunk %d, not 1' \
+            % first_chunks[0])
+    decreasing = [index for index in range(1, len(first_chunks)) \
+        if first_chunks[index] <= first_chunks[index - 1]]
+    if decreasing:
+        report.add(ERROR, path, 'entry %d does not start after the entry ' \
+            'before it' % (decreasing[0] + 1))
+    if 0 < len(first_chunks) and chunk_count < max(first_chunks):
+        report.add(ERROR, path, 'refers to chunk %d, but there are only %d' \
+            % (max(first_chunks), chunk_count))
+    if 0 < len(samples_per_chunk) and 0 == min(samples_per_chunk):
+        report.add(WARNING, path, 'has chunks with no samples')
+    if 0 < len(description_indices) and (0 == min(description_indices) \
+     or description_count < max(description_indices)):
+        report.add(ERROR, path, 'refers to sample descriptions that stsd ' \
+            'does not have')
+
+def check_sync_samples(path, table, report):
+    sync_samples = table.get_sync_samples()
+    if sync_samples is None or 0 == len(sync_samples):
+        return
+
+    if 0 == min(sync_samples) or table.get_sample_count() < max(sync_samples):
+        report.add(ERROR, path + '/stss', 'refers to samples that do not exist')
+    if [number for (number, next_number) \
+     in zip(sync_samples, sync_samples[1:]) if next_number <= number]:
+        report.add(ERROR, path + '/stss', 'sample numbers are not increasing')
+
+def check_chunk_bounds(path, table, media_extents, report):
+    """Check that each chunk's samples lie within an mdat"""
+    starts = [start for (start, end) in media_extents]
+    outside = []
+    for (index, (offset, size)) in \
+     enumerate(zip(table.get_chunk_offsets(), table.get_chunk_sizes())):
+        extent = bisect_right(starts, offset) - 1
+        if extent < 0 or media_extents[extent][1] < offset + size:
+            outside.append(index + 1)
+
+    if outside:
+        type = table.stbl.get_children_of_type('co64') and 'co64' or 'stco'
+        report.add(ERROR, '%s/%s' % (path, type),
+            '%d chunks lie outside mdat, starting with chunk %d' \
+            % (len(outside), outside[0]))
+
+def check_sample_tables(atoms, tracks, report):
+    media_extents = sorted([(atom.get_content_offset(),
+        atom.get_content_offset() + atom.get_source_size()) \
+        for atom in atoms if 'mdat' == atom.type \
+        and atom.get_content_offset() is not None])
+    stbl_paths = dict([(id(atom), path) for (path, atom) \
+        in walk_atoms(atoms) if 'stbl' == atom.type])
+
+    for track in tracks:
+        stbl = track.get_sample_table_atom()
+        if stbl is None:
+            report.add(ERROR, 'moov/trak', 'track %d has no sample table' \
+                % track.get_track_id())
+            continue
+
+        path = stbl_paths[id(stbl)]
+        missing = [type for type in ('stsd', 'stts', 'stsc', 'stsz') \
+            if not stbl.get_children_of_type(type)]
+        if not stbl.get_children_of_type('stco') \
+         and not stbl.get_children_of_type('co64'):
+            missing.append('stco')
+        if missing:
+            report.add(ERROR, path, 'has no %s' % ', '.join(missing))
+            continue
+
+        if not check_table_sizes(path, stbl, report):
+            continue
+        table = track.get_sample_table()
+        try:
+            check_sample_to_chunk(path, table, report)
+            check_sync_samples(path, table, report)
+            if check_counts(path, table, report):
+                check_chunk_bounds(path, table, media_extents, report)
+        except (ValueError, StructError), e:
+            report.add(ERROR, path, 'could not be decoded: %s' % e)
+
+def validate(mp4file):
+    """Check the structure and sample tables of <mp4file>; return a
+       ValidationReport of the problems found
+    """
+    report = ValidationReport()
+    check_structure(mp4file, mp4file.size, report)
+    if mp4file.get_movie() is None:
+        report.add(ERROR, '', 'has no moov')
+    else:
+        check_sample_tables(mp4file, mp4file.get_tracks(), report)
+    return report
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Unit tests for validation.py
+
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+from struct import pack, unpack
+import os
+import shutil
+import tempfile
+import unittest
+
+from mp4file import Mp4File
+from remuxtest import render_movie
+import validation
+
+def shorten_atom(rendered, type_offset, content_size):
+    """Cut the atom whose type is at <type_offset> in <rendered> down to
+       <content_size> bytes of content, filling the rest with a free atom
+    """
+    (size,) = unpack('>L', rendered[type_offset - 4:type_offset])
+    end = type_offset + 4 + content_size
+    return rendered[:type_offset - 4] + pack('>L', content_size + 8) \
+        + rendered[type_offset:end] + pack('>L', size - content_size - 8) \
+        + 'free' + rendered[end + 8:]
+
+
+class ValidateFile(unittest.TestCase):
+    tracks = [
+        [('v1a', 40, True), ('v1bb', 40, False), ('v1c', 40, True)],
+        [('a1a', 20, True), ('a1bb', 20, True)],
+    ]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'file.mp4')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def validate(self, rendered):
+        open(self.path, 'wb').write(rendered)
+        return Mp4File(self.path).validate()
+
+    def testValidFileHasNoProblems(self):
+        report = self.validate(render_movie(self.tracks))
+        self.assertEqual([], report)
+        self.assertTrue(report.is_valid())
+
+    def testChunkOutsideMediaIsError(self):
+        rendered = render_movie(self.tracks)
+        # Point the audio track's second chunk far past the mdat
+        stco = rendered.rindex('stco')
+        rendered = rendered[:stco + 12] + pack('>L', 1000) \
+            + rendered[stco + 16:]
+        report = self.validate(rendered)
+
+        self.assertFalse(report.is_valid())
+        self.assertEqual(['moov/trak[2]/mdia/minf/stbl/stco'],
+                         [problem.path for problem in report.get_errors()])
+
+    def testSampleCountMismatchIsError(self):
+        rendered = render_movie(self.tracks)
+        # Drop the audio track's last sample from stsz's count
+        stsz = rendered.rindex('stsz')
+        rendered = rendered[:stsz + 12] + pack('>L', 1) \
+            + rendered[stsz + 16:]
+        report = self.validate(rendered)
+
+        self.assertEqual(
+            ['moov/trak[2]/mdia/minf/stbl/stss',
+             'moov/trak[2]/mdia/minf/stbl/stts',
+             'moov/trak[2]/mdia/minf/stbl/stsc'],
+            [problem.path for problem in report.get_errors()])
+
+    def testOversizedCountsAreErrors(self):
+        rendered = render_movie(self.tracks)
+        # Claim one sample too many in the audio track's stsz, and far too
+        # many runs in the video track's stts
+        stsz = rendered.rindex('stsz')
+        rendered = rendered[:stsz + 12] + pack('>L', 3) \
+            + rendered[stsz + 16:]
+        stts = rendered.index('stts')
+        rendered = rendered[:stts + 8] + pack('>L', 0x7fffffff) \
+            + rendered[stts + 12:]
+        report = self.validate(rendered)
+
+        self.assertEqual(
+            ['moov/trak[1]/mdia/minf/stbl/stts',
+             'moov/trak[2]/mdia/minf/stbl/stsz'],
+            [problem.path for problem in report.get_errors()])
+        self.assertTrue('declares 24 bytes of content, but has only 20' \
+            in report.get_errors()[1].message)
+
+    def testUndecodableTablesAreErrors(self):
+        rendered = render_movie(self.tracks)
+        # Cut the video track's stts short of its header, and the audio
+        # track's stco short of whole entries
+        rendered = shorten_atom(rendered, rendered.index('stts'), 2)
+        stco = rendered.rindex('stco')
+        (stco_size,) = unpack('>L', rendered[stco - 4:stco])
+        rendered = shorten_atom(rendered, stco, stco_size - 17)
+        report = self.validate(rendered)
+
+        self.assertEqual(
+            ['moov/trak[1]/mdia/minf/stbl/stts',
+             'moov/trak[2]/mdia/minf/stbl/stco'],
+            [problem.path for problem in report.get_errors()])
+
+    def testTruncatedFileIsError(self):
+        report = self.validate(render_movie(self.tracks)[:-4])
+        self.assertTrue('moov' in [problem.path for problem in report])
+        self.assertFalse(report.is_valid())
+
+    def testMissingMovieIsError(self):
+        rendered = render_movie(self.tracks)
+        report = self.validate(rendered[:rendered.index('moov') - 4])
+        self.assertEqual([validation.Problem(validation.ERROR, '',
+            'has no moov')], report)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Verification that the media referenced by a file's sample tables is
+readable, and matches a manifest of chunk hashes.
+
+Chunks are sorted by offset and split into shards of roughly equal size,
+which are hashed in a pool of processes, each reading the file through
+its own positional reader. The results are gathered into one report.
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+from collections import namedtuple
+import hashlib
+from multiprocessing import Pool, cpu_count
+
+from atom import SourceReader
+
+HASH_ALGORITHM = 'sha1'
+# Size of the blocks chunks are hashed in
+HASH_BLOCK_SIZE = 1024 * 1024
+# Shards made for each process, so that slow shards even out
+SHARDS_PER_PROCESS = 4
+
+ChunkResult = namedtuple('ChunkResult',
+                         'track_id chunk offset size digest error')
+
+
+class VerificationReport(list):
+    """The result for every chunk of every track, in file order"""
+    def get_errors(self):
+        return [result for result in self if result.error is not None]
+
+    def is_valid(self):
+        return 0 == len(self.get_errors())
+
+    def get_manifest(self):
+        """Get the hex digest of each readable chunk, keyed by (track id,
+           chunk number)
+        """
+        return dict([((result.track_id, result.chunk), result.digest) \
+            for result in self if result.digest is not None])
+
+    def __str__(self):
+        return '\n'.join(['track %d chunk %d at %d: %s' % (result.track_id,
+            result.chunk, result.offset, result.error) \
+            for result in self.get_errors()])
+
+
+def get_chunks(mp4file):
+    """List (track id, chunk number, offset, size) for every chunk of
+       <mp4file>, in file order
+    """
+    chunks = []
+    for track in mp4file.get_tracks():
+        table = track.get_sample_table()
+        track_id = track.get_track_id()
+        for (index, (offset, size)) in enumerate(zip( \
+         table.get_chunk_offsets(), table.get_chunk_sizes())):
+            chunks.append((track_id, index + 1, offset, size))
+    chunks.sort(key=lambda chunk: chunk[2])
+    return chunks
+
+def split_shards(chunks, count):
+    """Split <chunks> into up to <count> runs of roughly equal size"""
+    total = sum([size for (track_id, chunk, offset, size) in chunks])
+    target = max(1, total // max(1, count))
+    shards = [[]]
+    shard_size = 0
+    for chunk in chunks:
+        if target <= shard_size:
+            shards.append([])
+            shard_size = 0
+        shards[-1].append(chunk)
+        shard_size += chunk[3]
+    return [shard for shard in shards if shard]
+
+def verify_shard(arguments):
+    """Hash the chunks of a shard; return a ChunkResult for each. Run in a
+       worker process, so takes a single tuple of (filename, chunks,
+       algorithm, manifest); a chunk missing from <manifest> is an error
+       unless <manifest> is None.
+    """
+    (filename, chunks, algorithm, manifest) = arguments
+    stream = open(filename, 'rb')
+    reader = SourceReader(stream)
+    try:
+        results = []
+        for (track_id, chunk, offset, size) in chunks:
+            chunk_hash = hashlib.new(algorithm)
+            position = offset
+            while position < offset + size:
+                block = reader.read(position, \
+                    min(HASH_BLOCK_SIZE, offset + size - position))
+                if not block:
+                    break
+                chunk_hash.update(block)
+                position += len(block)
+
+            (digest, error) = (None, None)
+            if position < offset + size:
+                error = 'only %d of %d bytes could be read' \
+                    % (position - offset, size)
+            else:
+                digest = chunk_hash.hexdigest()
+                expected = digest
+                if manifest is not None:
+                    expected = manifest.get((track_id, chunk))
+                if expected is None:
+                    error = 'not in the manifest'
+                elif expected != digest:
+                    error = 'digest %s does not match %s' % (digest, expected)
+            results.append(ChunkResult(track_id, chunk, offset, size,
+                                       digest, error))
+        return results
+    finally:
+        reader.close()
+        stream.close()
+
+def verify(mp4file, processes=None, manifest=None, algorithm=HASH_ALGORITHM):
+    """Read and hash every chunk of <mp4file> across <processes> processes
+       (by default, one per CPU; 1 or less hashes in this process),
+       checking digests against <manifest> (as returned by
+       VerificationReport.get_manifest) if given, where a chunk missing
+       from it is an error; return a VerificationReport.
+    """
+    if processes is None:
+        processes = cpu_count()
+    shards = split_shards(get_chunks(mp4file),
+                          max(1, processes) * SHARDS_PER_PROCESS)
+    # Workers only need the entries for their own chunks
+    shard_manifests = [None] * len(shards)
+    if manifest is not None:
+        shard_manifests = [dict([(key, manifest[key]) \
+            for key in [chunk[:2] for chunk in shard] if key in manifest]) \
+            for shard in shards]
+    work = [(mp4file.filename, shard, algorithm, shard_manifest) \
+        for (shard, shard_manifest) in zip(shards, shard_manifests)]
+
+    if processes <= 1:
+        shard_results = map(verify_shard, work)
+    else:
+        pool = Pool(processes)
+        try:
+            shard_results = pool.map(verify_shard, work)
+        finally:
+            pool.close()
+            pool.join()
+
+    report = VerificationReport()
+    for results in shard_results:
+        report.extend(results)
+    return report
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Unit tests for verify.py
+
+"""
+
+__author__ = "Steve Marshall (steve@nascentguruism.com)"
+__copyright__ = "Copyright (c) 2008 Steve Marshall"
+__license__ = "Python"
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from mp4file import Mp4File
+from remuxtest import render_movie
+import verify
+
+class VerifyChunks(unittest.TestCase):
+    tracks = [
+        [('v%d' % index, 40, 0 == index % 3) for index in range(9)],
+        [('a%d' % index, 30, True) for index in range(12)],
+    ]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'file.mp4')
+        # The movie comes first, so truncation only loses media
+        self.rendered = render_movie(self.tracks, movie_first=True)
+        open(self.path, 'wb').write(self.rendered)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testHashesEveryChunk(self):
+        mp4file = Mp4File(self.path)
+        report = verify.verify(mp4file, processes=2)
+        self.assertTrue(report.is_valid())
+
+        chunks = verify.get_chunks(mp4file)
+        self.assertEqual(len(chunks), len(report))
+        for (result, (track_id, chunk, offset, size)) in zip(report, chunks):
+            self.assertEqual((track_id, chunk), (result.track_id, result.chunk))
+            data = self.rendered[offset:offset + size]
+            self.assertEqual(hashlib.sha1(data).hexdigest(), result.digest)
+
+    def testChunksAreInFileOrder(self):
+        offsets = [offset for (track_id, chunk, offset, size) \
+            in verify.get_chunks(Mp4File(self.path))]
+        self.assertEqual(sorted(offsets), offsets)
+
+    def testSplitsShardsBySize(self):
+        chunks = [(1, index + 1, index * 10, 10) for index in range(10)]
+        shards = verify.split_shards(chunks, 3)
+        self.assertEqual(chunks, sum(shards, []))
+        self.assertEqual([4, 4, 2], [len(shard) for shard in shards])
+
+    def testFindsManifestMismatches(self):
+        manifest = verify.verify(Mp4File(self.path), 1).get_manifest()
+        (track_id, chunk, offset, size) = verify.get_chunks( \
+            Mp4File(self.path))[2]
+        corrupted = open(self.path, 'r+b')
+        corrupted.seek(offset)
+        corrupted.write('X')
+        corrupted.close()
+
+        report = verify.verify(Mp4File(self.path), 2, manifest)
+        self.assertEqual([(track_id, chunk)], [(result.track_id, result.chunk) \
+            for result in report.get_errors()])
+
+    def testReportsChunksMissingFromManifest(self):
+        manifest = verify.verify(Mp4File(self.path), 1).get_manifest()
+        (track_id, chunk, offset, size) = verify.get_chunks( \
+            Mp4File(self.path))[1]
+        del manifest[(track_id, chunk)]
+
+        errors = verify.verify(Mp4File(self.path), 2, manifest).get_errors()
+        self.assertEqual([(track_id, chunk)], [(result.track_id, result.chunk) \
+            for result in errors])
+        self.assertEqual('not in the manifest', errors[0].error)
+
+    def testFindsUnreadableChunks(self):
+        mp4file = Mp4File(self.path)
+        (track_id, chunk, offset, size) = verify.get_chunks(mp4file)[-1]
+        open(self.path, 'r+b').truncate(offset + 1)
+
+        errors = verify.verify(mp4file, 1).get_errors()
+        self.assertEqual([(track_id, chunk)], [(result.track_id, result.chunk) \
+            for result in errors])
+        self.assertEqual('only 1 of %d bytes could be read' % size,
+                         errors[0].error)
+
+
+if __name__ == "__main__":
+    unittest.main()